@@ -7,6 +7,7 @@ import argparse
 from collections import OrderedDict, Counter
 
 import numpy as np
+
 # Each element of the list that is pickled is in the following format:
 # [ssplit, tsplit, imgid, imgname, swords, twords]
 
@@ -92,6 +93,7 @@ if __name__ == '__main__':
     parser.add_argument('-r', '--ratio'     , help='src length to trg length min ratio', default=3, type=int)
     parser.add_argument('-d', '--minvocab'  , help='Consider words occuring at least this number', default=1, type=int)
     parser.add_argument('-o', '--output'    , help='Output directory.', default="./processed")
+    parser.add_argument('-c', '--columnar'  , help='Also write memory-mappable columnar corpora.', action='store_true')
 
     parser.add_argument('-i', '--imagelist'  , help='Image list file.', required=True)
 
@@ -243,5 +245,11 @@ if __name__ == '__main__':
             with open(os.path.join(args.output, 'flickr_30k_align.%s.pkl' % split), 'wb') as f:
                 pickle.dump(sentences[split], f)
 
+            if args.columnar:
+                # Give the .json file as data path to use it
+                from nmtpy.iterators.columnar import write_columnar
+                print("Writing %s columnar corpus" % split)
+                write_columnar(os.path.join(args.output, 'flickr_30k_align.%s' % split), sentences[split])
+
     # Create the dictionary with nmt-build-dict afterwards
     create_dictionaries(sentences['train'], args.output, args.minvocab)
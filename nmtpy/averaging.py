@@ -0,0 +1,284 @@
+# -*- coding: utf-8 -*-
+import time
+import socket
+import struct
+import selectors
+
+import numpy as np
+
+from .defaults import FLOAT
+
+# Multi-node training with periodic parameter averaging:
+#   - nmt-coordinator listens on a TCP port for avg_workers workers.
+#   - Every worker is an nmt-train process given avg_coordinator, avg_rank
+#     and avg_workers. It trains on its own shard of the minibatches and
+#     sends its parameters to the coordinator after each avg_freq updates.
+#   - The coordinator averages the parameters of a round and sends them
+#     back. A round is closed once every worker has sent its parameters or
+#     timeout seconds after the first arrival. Stragglers that miss a round
+#     receive the last average as soon as their parameters arrive.
+#   - Rank 0 validates and saves checkpoints. When it early-stops, the
+#     coordinator tells the other workers to stop.
+#   - Rank 0 also sends its learning rate along with its parameters and
+#     every average is sent back with the last learning rate of rank 0, so
+#     that a decay decided by its validations reaches the other workers.
+#   - The first round is a broadcast instead: every worker starts from the
+#     parameters of rank 0, which may have been resumed from a snapshot, and
+#     the others only send a header. The round waits for rank 0.
+# Messages are a fixed header (flags, rank, round, nbytes, lrate) followed
+# by nbytes of raw parameters. lrate is NaN if not known.
+
+HEADER = struct.Struct('!qqqqd')
+
+# Message flags
+STOP = 1
+BROADCAST = 2
+
+def recv_exact(sock, buf):
+    """Fills the writable buffer buf from sock."""
+    view = memoryview(buf).cast('B')
+    while len(view) > 0:
+        n = sock.recv_into(view)
+        if n == 0:
+            raise ConnectionError('Connection closed by peer')
+        view = view[n:]
+
+def send_msg(sock, flags, rank, rnd, payload=None, lrate=None):
+    """Sends a header and an optional contiguous numpy payload."""
+    nbytes = 0 if payload is None else payload.nbytes
+    lrate = float('nan') if lrate is None else lrate
+    sock.sendall(HEADER.pack(flags, rank, rnd, nbytes, lrate))
+    if nbytes > 0:
+        sock.sendall(memoryview(payload).cast('B'))
+
+def recv_header(sock):
+    """Returns (flags, rank, round, nbytes, lrate)."""
+    header = bytearray(HEADER.size)
+    recv_exact(sock, header)
+    return HEADER.unpack(header)
+
+class AveragingClient(object):
+    """Worker side of parameter averaging."""
+    def __init__(self, address, rank, n_workers):
+        self.rank       = rank
+        self.n_workers  = n_workers
+        self.round      = 0
+
+        # Flattened parameters
+        self.buf        = None
+
+        # Learning rate of rank 0 received with the last average
+        self.lrate      = None
+
+        # Seconds spent sending, waiting for the average and receiving it
+        # in the last round
+        self.timings    = (0., 0., 0.)
+
+        host, port = address.rsplit(':', 1)
+        self.sock = socket.create_connection((host, int(port)))
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        # Introduce ourselves
+        send_msg(self.sock, 0, self.rank, self.round)
+
+    def average(self, arrays, lrate=None, broadcast=False):
+        """Replaces arrays with their averages over the workers in-place
+        and sets self.lrate to the learning rate of rank 0, which should
+        give its lrate. If broadcast is True, arrays are replaced with the
+        ones of rank 0 instead, every worker should then give broadcast.
+        Returns False if training is stopped by rank 0."""
+        size = sum(arr.size for arr in arrays)
+        if self.buf is None or self.buf.size != size:
+            self.buf = np.empty(size, dtype=FLOAT)
+
+        offset = 0
+        for arr in arrays:
+            self.buf[offset:offset + arr.size] = arr.ravel()
+            offset += arr.size
+
+        start = time.time()
+        if broadcast:
+            payload = self.buf if self.rank == 0 else None
+            send_msg(self.sock, BROADCAST, self.rank, self.round, payload, lrate)
+        else:
+            send_msg(self.sock, 0, self.rank, self.round, self.buf, lrate)
+        sent = time.time()
+
+        flags, _, self.round, nbytes, lrate = recv_header(self.sock)
+        arrived = time.time()
+        if flags & STOP:
+            return False
+
+        recv_exact(self.sock, self.buf[:nbytes // self.buf.itemsize])
+        self.lrate = None if np.isnan(lrate) else lrate
+        self.timings = (sent - start, arrived - sent, time.time() - arrived)
+
+        offset = 0
+        for arr in arrays:
+            np.copyto(arr, self.buf[offset:offset + arr.size].reshape(arr.shape))
+            offset += arr.size
+
+        return True
+
+    def stop(self):
+        """Called by rank 0 to stop the other workers."""
+        send_msg(self.sock, STOP, self.rank, self.round)
+        self.close()
+
+    def close(self):
+        self.sock.close()
+
+class Coordinator(object):
+    """Averages the parameters sent by the workers in rounds."""
+    def __init__(self, port, n_workers, timeout=60., host='', logger=None):
+        self.n_workers  = n_workers
+        self.timeout    = timeout
+        self.__log      = logger
+
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind((host, port))
+        self.server.listen(n_workers)
+
+        # rank -> socket of connected workers
+        self.workers    = {}
+        self.round      = 0
+        self.stopped    = False
+
+        # Received parameters of each rank and the last average
+        self.bufs       = {}
+        self.avg        = None
+
+        # Last learning rate sent by rank 0
+        self.lrate      = None
+
+    def __print(self, msg):
+        if self.__log:
+            self.__log.info(msg)
+
+    def __accept(self):
+        """Waits for every worker to connect."""
+        while len(self.workers) < self.n_workers:
+            sock, addr = self.server.accept()
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            _, rank, _, _, _ = recv_header(sock)
+            self.workers[rank] = sock
+            self.__print('Worker %d connected from %s:%d' % (rank, addr[0], addr[1]))
+
+    def __drop(self, sel, rank):
+        """Forgets about a disconnected worker."""
+        sock = self.workers.pop(rank)
+        sel.unregister(sock)
+        sock.close()
+        self.__print('Worker %d disconnected' % rank)
+
+    def __reply(self, ranks):
+        """Sends the average or the stop signal to ranks."""
+        for rank in ranks:
+            if rank in self.workers:
+                if self.stopped:
+                    send_msg(self.workers[rank], STOP, rank, self.round)
+                else:
+                    send_msg(self.workers[rank], 0, rank, self.round, self.avg, self.lrate)
+
+    def __average(self, ranks):
+        """Averages the parameters of ranks."""
+        if self.avg is None:
+            self.avg = np.empty_like(self.bufs[ranks[0]])
+
+        np.copyto(self.avg, self.bufs[ranks[0]])
+        for rank in ranks[1:]:
+            self.avg += self.bufs[rank]
+        self.avg /= len(ranks)
+
+    def __broadcast(self):
+        """Takes the parameters of rank 0 as the average."""
+        self.avg = self.bufs[0].copy()
+
+    def serve(self):
+        """Runs averaging rounds until every worker disconnects."""
+        self.__accept()
+
+        sel = selectors.DefaultSelector()
+        for rank, sock in self.workers.items():
+            sel.register(sock, selectors.EVENT_READ, rank)
+
+        # Ranks that sent their parameters for the current round
+        pending = []
+        first = None
+        broadcast = False
+
+        while self.workers:
+            # A broadcast round can not be closed before rank 0 arrives
+            if first is None or (broadcast and 0 not in pending):
+                timeout = None
+            else:
+                timeout = max(first + self.timeout - time.time(), 0)
+            for key, _ in sel.select(timeout):
+                rank = key.data
+                try:
+                    flags, _, rnd, nbytes, lrate = recv_header(key.fileobj)
+                    if nbytes > 0:
+                        buf = self.bufs.get(rank, None)
+                        if buf is None or buf.nbytes != nbytes:
+                            buf = self.bufs[rank] = np.empty(nbytes // np.dtype(FLOAT).itemsize, dtype=FLOAT)
+                        recv_exact(key.fileobj, buf)
+                except ConnectionError:
+                    self.__drop(sel, rank)
+                    continue
+
+                if rank == 0 and not np.isnan(lrate):
+                    self.lrate = lrate
+
+                if flags & STOP:
+                    self.__print('Worker %d stopped the training at round %d' % (rank, self.round))
+                    self.stopped = True
+                    self.__drop(sel, rank)
+                elif self.stopped:
+                    self.__reply([rank])
+                elif rnd < self.round:
+                    # A straggler of a closed round gets the last average
+                    self.__print('Worker %d was late for round %d, sending average of round %d' % (
+                                 rank, rnd + 1, self.round))
+                    self.__reply([rank])
+                else:
+                    if first is None:
+                        first = time.time()
+                    pending.append(rank)
+                    broadcast |= bool(flags & BROADCAST)
+
+            if broadcast and 0 not in pending and 0 not in self.workers:
+                self.__print('Worker 0 disconnected before broadcasting its parameters')
+                self.stopped = True
+
+            if self.stopped:
+                # Release the workers waiting for this round
+                self.__reply(pending)
+                pending, first, broadcast = [], None, False
+                continue
+
+            # Close the round if every worker arrived or on timeout
+            if pending and (set(pending) >= set(self.workers) or time.time() >= first + self.timeout) \
+                    and (not broadcast or 0 in pending):
+                waited = time.time() - first
+                start = time.time()
+                if broadcast:
+                    self.__broadcast()
+                else:
+                    self.__average(pending)
+                avg_time = time.time() - start
+
+                self.round += 1
+                start = time.time()
+                self.__reply(pending)
+                send_time = time.time() - start
+
+                stragglers = sorted(set(self.workers) - set(pending))
+                self.__print('Round %d: %d/%d workers, waited %.3f sec, %s in %.3f sec, sent in %.3f sec%s' % (
+                             self.round, len(pending), len(self.workers), waited,
+                             'broadcasted' if broadcast else 'averaged', avg_time, send_time,
+                             (', stragglers: %s' % stragglers) if stragglers else ''))
+                pending, first, broadcast = [], None, False
+
+        sel.close()
+        self.server.close()
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+import csv
+from collections import OrderedDict
+
+import numpy as np
+
+# Decoding statistics collected by beam_search() when it is given a stats
+# dict, enabled by -B/--beam-stats of nmt-translate. For every sentence:
+#   src_len     : Number of source timesteps
+#   maxlen      : Maximum number of decoding steps
+#   init_time   : Seconds spent in f_init() of all models
+#   next_times  : Seconds spent in f_next() of all models, for each step
+#   step_times  : Seconds of Python overhead, i.e. candidate selection and
+#                 building of the new hypotheses, for each step
+#   live_beams  : Number of live hypotheses fed to f_next(), for each step
+#   maxlen_hit  : True if decoding stopped with unfinished hypotheses
+# For a given prefix, the following reports are written:
+#   <prefix>.csv : One row of summarized statistics per sentence
+#   <prefix>.txt : Aggregate report, also printed by nmt-translate
+
+# Columns of the per-sentence CSV file
+FIELDS = ['idx', 'src_len', 'n_steps', 'maxlen', 'maxlen_hit', 'init_ms',
+          'next_ms', 'next_ms_per_step', 'overhead_ms', 'overhead_ms_per_step',
+          'mean_live_beam']
+
+# Steps at which the mean live beam size is reported
+BEAM_STEPS = [1, 2, 4, 8, 16, 32, 64, 128]
+
+def sentence_row(idx, stats):
+    """Returns the CSV row of a sentence's statistics."""
+    n_steps = len(stats['next_times'])
+    next_ms = 1000 * sum(stats['next_times'])
+    overhead_ms = 1000 * sum(stats['step_times'])
+    return OrderedDict([
+        ('idx', idx),
+        ('src_len', stats['src_len']),
+        ('n_steps', n_steps),
+        ('maxlen', stats['maxlen']),
+        ('maxlen_hit', int(stats['maxlen_hit'])),
+        ('init_ms', '%.3f' % (1000 * stats['init_time'])),
+        ('next_ms', '%.3f' % next_ms),
+        ('next_ms_per_step', '%.3f' % (next_ms / max(n_steps, 1))),
+        ('overhead_ms', '%.3f' % overhead_ms),
+        ('overhead_ms_per_step', '%.3f' % (overhead_ms / max(n_steps, 1))),
+        ('mean_live_beam', '%.2f' % np.mean(stats['live_beams'])),
+        ])
+
+def write_csv(fname, all_stats):
+    """Writes a row for each sentence, all_stats being a list of stats dicts
+    in sentence order. Sentences without statistics are skipped."""
+    with open(fname, 'w', newline='') as f:
+        writer = csv.DictWriter(f, FIELDS)
+        writer.writeheader()
+        for idx, stats in enumerate(all_stats):
+            if stats:
+                writer.writerow(sentence_row(idx, stats))
+
+def summarize(all_stats):
+    """Returns the lines of the aggregate report of a list of stats dicts."""
+    all_stats = [s for s in all_stats if s]
+    if len(all_stats) == 0:
+        return ['No beam search statistics were collected.']
+
+    init_ms     = 1000 * np.array([s['init_time'] for s in all_stats])
+    next_ms     = 1000 * np.concatenate([s['next_times'] for s in all_stats])
+    step_ms     = 1000 * np.concatenate([s['step_times'] for s in all_stats])
+    live_beams  = np.concatenate([s['live_beams'] for s in all_stats])
+    src_lens    = np.array([s['src_len'] for s in all_stats], dtype='float64')
+    n_steps     = np.array([len(s['next_times']) for s in all_stats], dtype='float64')
+    n_hits      = sum(int(s['maxlen_hit']) for s in all_stats)
+
+    init_total  = init_ms.sum()
+    next_total  = next_ms.sum()
+    step_total  = step_ms.sum()
+    total       = max(init_total + next_total + step_total, 1e-9)
+
+    def timing(name, values):
+        return '%-14s mean %8.3f ms, median %8.3f ms, p90 %8.3f ms, p99 %8.3f ms, max %8.3f ms' % (
+                name, values.mean(), np.median(values), np.percentile(values, 90),
+                np.percentile(values, 99), values.max())
+
+    lines = []
+    lines.append('Sentences: %d, decoding steps: %d' % (len(all_stats), len(next_ms)))
+    lines.append(timing('f_init', init_ms))
+    lines.append(timing('f_next', next_ms))
+    lines.append(timing('overhead/step', step_ms))
+    lines.append('Time share: f_init %.1f%%, f_next %.1f%%, overhead %.1f%%' % (
+                 100 * init_total / total, 100 * next_total / total, 100 * step_total / total))
+    lines.append('f_next per live hypothesis: %.3f ms' % (next_total / max(live_beams.sum(), 1)))
+
+    # Live beam size over decoding steps
+    beams = []
+    for step in BEAM_STEPS:
+        sizes = [s['live_beams'][step - 1] for s in all_stats if len(s['live_beams']) >= step]
+        if sizes:
+            beams.append('%d: %.2f (%d)' % (step, np.mean(sizes), len(sizes)))
+    lines.append('Mean live beam (sentences) at step %s' % ', '.join(beams))
+    lines.append('Mean live beam over all steps: %.2f' % live_beams.mean())
+
+    # Number of steps versus source length
+    ratios = n_steps / np.maximum(src_lens, 1)
+    lines.append('Steps: mean %.1f, max %d; steps/source length: mean %.2f, min %.2f, max %.2f' % (
+                 n_steps.mean(), n_steps.max(), ratios.mean(), ratios.min(), ratios.max()))
+    for low in range(0, int(src_lens.max()) + 1, 10):
+        mask = (src_lens >= low) & (src_lens < low + 10)
+        if mask.any():
+            lines.append('  source length %3d-%-3d: %5d sentences, mean steps %6.1f, mean steps/src %.2f' % (
+                         low, low + 9, mask.sum(), n_steps[mask].mean(), ratios[mask].mean()))
+    lines.append('maxlen hits: %d (%.2f%%)' % (n_hits, 100. * n_hits / len(all_stats)))
+    return lines
+
+def write_report(prefix, all_stats):
+    """Writes both reports and returns the lines of the aggregate one."""
+    write_csv('%s.csv' % prefix, all_stats)
+    lines = summarize(all_stats)
+    with open('%s.txt' % prefix, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+    return lines
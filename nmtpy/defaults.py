@@ -10,6 +10,8 @@ MODEL_DEFAULTS = {
         'optimizer':          'adam',         # adadelta, sgd, rmsprop, adam
         'lrate':              None,           # Initial learning rate. Defaults for each optimizer is different so value
                                               # will be initialized when building optimizer if None.
+        'bucket_batches':     50,             # shuffle_mode bucket: # of minibatches sorted together by length
+        'bucket_max_pad':     0.2,            # shuffle_mode bucket: Maximum ratio of padded target positions in a minibatch
         }
 
 TRAIN_DEFAULTS = {
@@ -17,7 +19,19 @@ TRAIN_DEFAULTS = {
         'device_id':          'auto',         #
         'seed':               1234,           # RNG seed
         'clip_c':             5.,             # Clip gradients above clip_c
+        'grad_accum':         1,              # Accumulate gradients of this many minibatches per update
+        'n_workers':          1,              # Data-parallel CPU worker processes, each training on a shard of minibatches
+        'avg_coordinator':    None,           # host:port of nmt-coordinator for multi-node parameter averaging
+        'avg_workers':        1,              # Number of nodes whose parameters are averaged
+        'avg_rank':           0,              # Rank of this node, rank 0 validates and saves models
+        'avg_freq':           100,            # Average parameters after each avg_freq updates
         'decay_c':            0.,             # L2 penalty factor
+        'lr_decay':           None,           # Learning rate scheduler: noam, step, plateau (None: constant)
+        'lr_warmup':          4000,           # noam: # of updates to linearly increase the lrate
+        'lr_decay_factor':    0.5,            # step, plateau: Multiply the lrate by this factor when decaying
+        'lr_decay_freq':      10000,          # step: Decay the lrate after each lr_decay_freq updates
+        'lr_patience':        2,              # plateau: Decay the lrate after this many validations without improvement
+        'lr_min':             0.,             # Do not decay the lrate below this value
         'patience':           10,             # Early stopping patience
         'patience_delta':     0.,             # Absolute difference that will be taken into account as improvement for valid metric
         'max_epochs':         100,            # Max number of epochs to train
@@ -28,8 +42,10 @@ TRAIN_DEFAULTS = {
         'valid_beam':         12,             # Allow changing beam size during validation
         'valid_freq':         0,              # 0: End of epochs
         'valid_save_hyp':     False,          # Save each output of validation to separate files
-        'snapshot_freq':      0,              # Checkpoint frequency for resuming in terms of number of iterations
+        'snapshot_freq':      0,              # Resumable snapshot frequency in terms of number of iterations (0: disabled)
         'disp_freq':          10,             # Display training statistics after each disp_freq minibatches
+        'stats_sink':         None,           # Write training statistics as jsonl and/or csv (comma separated, None: disabled)
         'save_best_n':        4,              # Always keep a set of 4 best validation models on disk
         'save_timestamp':     False,          # Creates a subfolder for each experiment with timestamp prefix
+        'profile':            False,          # Profile compiled functions into <model>.profile.{theano,calls}.txt at exit
         }
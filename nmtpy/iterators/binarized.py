@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+import array
+import hashlib
+import itertools
+import multiprocessing
+
+import numpy as np
+
+from ..sysutils import fopen
+
+# Binarized corpora: each stream (i.e. a text file numericalized with its
+# vocabulary) is stored as a flat int32 array of token idxs and an int64
+# array of n_samples + 1 offsets such that the i'th sentence is
+# tokens[offsets[i]:offsets[i+1]]. The files are named as:
+#   <prefix>.json       : Metadata (# of samples, tokens and unknowns)
+#   <prefix>.<N>.tok.npy: Token idxs of the N'th stream
+#   <prefix>.<N>.off.npy: Sentence offsets of the N'th stream
+# where <prefix> contains a checksum of the text files, the vocabularies
+# and the short-list sizes so that a stale cache is never reused.
+
+def file_checksum(fname, blocksize=2**20):
+    """Returns the MD5 checksum of a file's content."""
+    md5 = hashlib.md5()
+    with open(fname, 'rb') as f:
+        for block in iter(lambda: f.read(blocksize), b''):
+            md5.update(block)
+    return md5.hexdigest()
+
+def vocab_checksum(vocab):
+    """Returns the MD5 checksum of a token->idx dictionary."""
+    md5 = hashlib.md5()
+    for word, idx in sorted(vocab.items(), key=lambda x: x[1]):
+        md5.update(('%s %d\n' % (word, idx)).encode('utf-8'))
+    return md5.hexdigest()
+
+def get_cache_prefix(cache_dir, files, vocabs, limits):
+    """Returns the file prefix of the binarized corpus for given streams."""
+    md5 = hashlib.md5()
+    for fname, vocab, limit in zip(files, vocabs, limits):
+        md5.update(file_checksum(fname).encode('utf-8'))
+        md5.update(vocab_checksum(vocab).encode('utf-8'))
+        md5.update(str(limit).encode('utf-8'))
+    return os.path.join(cache_dir, '%s.%s' % (os.path.basename(files[0]), md5.hexdigest()[:16]))
+
+# Vocabularies, short-lists and pre-split sentences are set before
+# forking the numericalization workers which inherit them for free.
+_vocabs = None
+_limits = None
+_sents  = None
+
+def _numericalize_lines(chunk):
+    """Numericalizes a chunk of samples, i.e. tuples of parallel lines."""
+    tokens  = [array.array('i') for _ in _vocabs]
+    lengths = [array.array('i') for _ in _vocabs]
+    n_unks  = [0] * len(_vocabs)
+
+    for lines in chunk:
+        lines = [l.strip() for l in lines]
+
+        # Skip the sample if empty line found
+        if "" in lines:
+            continue
+
+        for i, (line, vocab, limit) in enumerate(zip(lines, _vocabs, _limits)):
+            seq = [vocab.get(w, 1) for w in line.split(' ')]
+
+            # if given limit vocabulary
+            if limit > 0:
+                seq = [w if w < limit else 1 for w in seq]
+
+            n_unks[i] += seq.count(1)
+            tokens[i].extend(seq)
+            lengths[i].append(len(seq))
+
+    return tokens, lengths, n_unks
+
+def _numericalize_sents(span):
+    """Numericalizes the pre-split sentences _sents[start:end]."""
+    vocab, limit = _vocabs[0], _limits[0]
+    tokens  = array.array('i')
+    lengths = array.array('i')
+
+    for sent in _sents[span[0]:span[1]]:
+        seq = [vocab.get(w, 1) for w in sent]
+
+        # if given limit vocabulary
+        if limit > 0:
+            seq = [w if w < limit else 1 for w in seq]
+
+        tokens.extend(seq)
+        lengths.append(len(seq))
+
+    return [tokens], [lengths], [tokens.count(1)]
+
+def _run_chunks(func, chunks, n_streams, n_jobs):
+    """Applies func to chunks with n_jobs processes and merges the results
+    into flat int32 token and int64 offset arrays for each stream."""
+    if n_jobs > 1:
+        pool = multiprocessing.get_context('fork').Pool(n_jobs)
+        results = pool.imap(func, chunks)
+    else:
+        pool = None
+        results = map(func, chunks)
+
+    tokens  = [[] for _ in range(n_streams)]
+    lengths = [[] for _ in range(n_streams)]
+    n_unks  = [0] * n_streams
+
+    for c_tokens, c_lengths, c_unks in results:
+        for i in range(n_streams):
+            tokens[i].append(np.frombuffer(c_tokens[i], dtype=np.int32))
+            lengths[i].append(np.frombuffer(c_lengths[i], dtype=np.int32))
+            n_unks[i] += c_unks[i]
+
+    if pool:
+        pool.close()
+        pool.join()
+
+    offsets = []
+    for i in range(n_streams):
+        tokens[i] = np.concatenate(tokens[i]) if tokens[i] else np.zeros(0, dtype=np.int32)
+        lens = np.concatenate(lengths[i]) if lengths[i] else np.zeros(0, dtype=np.int32)
+        offsets.append(np.concatenate(([0], np.cumsum(lens, dtype=np.int64))))
+
+    return tokens, offsets, n_unks
+
+def numericalize(files, vocabs, limits, n_jobs=1, chunk_size=10000):
+    """Numericalizes parallel text files into token and offset arrays using
+    n_jobs processes. A sample is skipped if any of its sentences is empty."""
+    global _vocabs, _limits
+    _vocabs, _limits = vocabs, limits
+
+    fhs = [fopen(f, 'r') for f in files]
+    samples = zip(*fhs)
+    chunks = iter(lambda: list(itertools.islice(samples, chunk_size)), [])
+
+    result = _run_chunks(_numericalize_lines, chunks, len(files), n_jobs)
+
+    for fh in fhs:
+        fh.close()
+
+    return result
+
+def numericalize_sents(sents, vocab, limit, n_jobs=1, chunk_size=10000):
+    """Numericalizes a list of pre-split sentences into token and offset
+    arrays using n_jobs processes."""
+    global _vocabs, _limits, _sents
+    _vocabs, _limits, _sents = [vocab], [limit], sents
+
+    spans = [(i, i + chunk_size) for i in range(0, len(sents), chunk_size)]
+    tokens, offsets, n_unks = _run_chunks(_numericalize_sents, spans, 1, n_jobs)
+
+    _sents = None
+    return tokens[0], offsets[0], n_unks[0]
+
+def binarize(prefix, files, vocabs, limits, n_jobs=1):
+    """Numericalizes parallel text files into a binarized corpus.
+    A sample is skipped if any of its sentences is empty."""
+    tokens, offsets, n_unks = numericalize(files, vocabs, limits, n_jobs)
+
+    meta = {
+            'files'     : files,
+            'limits'    : limits,
+            'n_samples' : len(offsets[0]) - 1,
+            'n_tokens'  : [len(t) for t in tokens],
+            'n_unks'    : n_unks,
+           }
+
+    # Write into temporary files first and rename them so that
+    # concurrent runs never see a partially written corpus
+    for i in range(len(files)):
+        for suffix, arr in [('tok', tokens[i]), ('off', offsets[i])]:
+            fname = '%s.%d.%s.npy' % (prefix, i, suffix)
+            with open(fname + '.tmp', 'wb') as f:
+                np.save(f, arr)
+            os.rename(fname + '.tmp', fname)
+
+    # Metadata is written last as it marks the corpus as complete
+    with open(prefix + '.json.tmp', 'w') as f:
+        json.dump(meta, f)
+    os.rename(prefix + '.json.tmp', prefix + '.json')
+
+class BinarizedStream(object):
+    """Read-only list-like view over a single binarized stream."""
+    def __init__(self, tokens, offsets):
+        self.tokens = tokens
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, idx):
+        return self.tokens[self.offsets[idx]:self.offsets[idx + 1]]
+
+    def lengths(self):
+        """Returns sentence lengths without touching the tokens."""
+        return np.diff(self.offsets)
+
+class BinarizedCorpus(object):
+    """Read-only list-like view of samples over parallel binarized streams."""
+    def __init__(self, tokens, offsets, n_unks, prefix=None):
+        # prefix is None for in-memory corpora
+        self.prefix     = prefix
+        self.n_samples  = len(offsets[0]) - 1
+        self.n_unks     = n_unks
+        self.n_tokens   = [len(t) for t in tokens]
+        self.streams    = [BinarizedStream(t, o) for t, o in zip(tokens, offsets)]
+
+    def __len__(self):
+        return self.n_samples
+
+    def __getitem__(self, idx):
+        return tuple(s[idx] for s in self.streams)
+
+def open_binarized(prefix, mmap=True):
+    """Opens the binarized corpus written by binarize() under prefix."""
+    with open(prefix + '.json') as f:
+        meta = json.load(f)
+
+    mmap_mode = 'r' if mmap else None
+    tokens, offsets = [], []
+    for i in range(len(meta['n_unks'])):
+        tokens.append(np.load('%s.%d.tok.npy' % (prefix, i), mmap_mode=mmap_mode))
+        offsets.append(np.load('%s.%d.off.npy' % (prefix, i), mmap_mode=mmap_mode))
+
+    return BinarizedCorpus(tokens, offsets, meta['n_unks'], prefix=prefix)
+
+def load_binarized(cache_dir, files, vocabs, limits, n_jobs=1, print_func=None):
+    """Returns a BinarizedCorpus for the given streams, binarizing them if
+    they are not found in cache_dir."""
+    limits = [int(l) for l in limits]
+    prefix = get_cache_prefix(cache_dir, files, vocabs, limits)
+
+    if not os.path.exists(prefix + '.json'):
+        if print_func:
+            print_func('Binarizing corpus into %s' % prefix)
+        os.makedirs(cache_dir, exist_ok=True)
+        binarize(prefix, files, vocabs, limits, n_jobs)
+    elif print_func:
+        print_func('Using binarized corpus %s' % prefix)
+
+    return open_binarized(prefix)
@@ -3,7 +3,8 @@ import numpy as np
 
 from ..sysutils   import fopen
 from .iterator    import Iterator
-from .homogeneous import HomogeneousData
+from .binarized   import load_binarized, numericalize, BinarizedCorpus
+from .homogeneous import HomogeneousData, BucketedData
 
 """Parallel text iterator for translation data."""
 class BiTextIterator(Iterator):
@@ -26,6 +27,20 @@ class BiTextIterator(Iterator):
         self.n_words_src = kwargs.get('n_words_src', 0)
         self.n_words_trg = kwargs.get('n_words_trg', 0)
 
+        # Number of minibatches sorted together and maximum padding ratio
+        # of a minibatch for the 'bucket' shuffle mode
+        self.bucket_batches = kwargs.get('bucket_batches', 50)
+        self.bucket_max_pad = kwargs.get('bucket_max_pad', 0.2)
+
+        # Optional .npz file to persist the length index of 'trglen' mode
+        self.index_file = kwargs.get('index_file', None)
+
+        # Optional folder for binarized, memory-mapped corpora
+        self.cache_dir = kwargs.get('cache_dir', None)
+
+        # Number of processes for numericalizing the corpora
+        self.n_jobs = kwargs.get('n_jobs', 1)
+
         self.src_name = kwargs.get('src_name', 'x')
         self.trg_name = kwargs.get('trg_name', 'y')
 
@@ -38,6 +53,63 @@ class BiTextIterator(Iterator):
             self._keys.append("%s_mask" % self.trg_name)
 
     def read(self):
+        if self.cache_dir:
+            self.read_binarized()
+        elif self.n_jobs > 1:
+            self.read_parallel()
+        else:
+            self.read_text()
+
+        # Number of training samples
+        self.n_samples = len(self._seqs)
+
+        # Set batch processor function
+        self._process_batch = (lambda idxs: self.mask_seqs(idxs))
+
+        # Lengths are readily available for binarized corpora
+        src_lengths, lengths = None, None
+        if isinstance(self._seqs, BinarizedCorpus):
+            src_lengths = self._seqs.streams[0].lengths()
+            lengths = self._seqs.streams[1].lengths()
+            if self.index_file is None and self._seqs.prefix:
+                # Persist the length index together with the corpus
+                self.index_file = self._seqs.prefix + '.lenidx.npz'
+
+        if self.shuffle_mode == 'trglen':
+            # Homogeneous batches ordered by target sequence length
+            # Get an iterator over sample idxs
+            self._iter = HomogeneousData(self._seqs, self.batch_size, trg_pos=1,
+                                         lengths=lengths, index_file=self.index_file)
+        elif self.shuffle_mode == 'bucket':
+            # Length-sorted batches inside shuffled mega-batches
+            self._iter = BucketedData(self._seqs, self.batch_size, trg_pos=1,
+                                      src_pos=0, print_func=self._print,
+                                      lengths=lengths, src_lengths=src_lengths,
+                                      n_batches=self.bucket_batches,
+                                      max_pad_ratio=self.bucket_max_pad)
+        else:
+            self.rewind()
+
+    def read_binarized(self):
+        """Memory-map the binarized corpus, creating it if necessary."""
+        self._seqs = load_binarized(self.cache_dir,
+                                    [self.srcfile, self.trgfile],
+                                    [self.srcdict, self.trgdict],
+                                    [self.n_words_src, self.n_words_trg],
+                                    n_jobs=self.n_jobs, print_func=self._print)
+        self.n_unks_src, self.n_unks_trg = self._seqs.n_unks
+
+    def read_parallel(self):
+        """Numericalize the corpora with n_jobs processes into compact arrays."""
+        self._print('Numericalizing corpora with %d processes' % self.n_jobs)
+        tokens, offsets, n_unks = numericalize([self.srcfile, self.trgfile],
+                                               [self.srcdict, self.trgdict],
+                                               [self.n_words_src, self.n_words_trg],
+                                               n_jobs=self.n_jobs)
+        self._seqs = BinarizedCorpus(tokens, offsets, n_unks)
+        self.n_unks_src, self.n_unks_trg = n_unks
+
+    def read_text(self):
         seqs = []
         sf = fopen(self.srcfile, 'r')
         tf = fopen(self.trgfile, 'r')
@@ -78,21 +150,8 @@ class BiTextIterator(Iterator):
         self.n_unks_src = src_unks
         self.n_unks_trg = trg_unks
 
-        # Number of training samples
-        self.n_samples = len(self._seqs)
-
-        # Set batch processor function
-        self._process_batch = (lambda idxs: self.mask_seqs(idxs))
-
-        if self.shuffle_mode == 'trglen':
-            # Homogeneous batches ordered by target sequence length
-            # Get an iterator over sample idxs
-            self._iter = HomogeneousData(self._seqs, self.batch_size, trg_pos=1)
-        else:
-            self.rewind()
-
     def rewind(self):
-        if self.shuffle_mode != 'trglen':
+        if self.shuffle_mode not in ('trglen', 'bucket'):
             # Fill in the _idxs list for sample order
             if self.shuffle_mode == 'simple':
                 # Simple shuffle
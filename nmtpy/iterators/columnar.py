@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+import os
+import glob
+import json
+import hashlib
+
+import numpy as np
+
+from .binarized import vocab_checksum
+
+# Columnar replacement of the multimodal .pkl corpora whose rows are
+#   [src_split_idx, trg_split_idx, imgid, imgname, src_words, trg_words]
+# Each column is a separate .npy file that is memory-mapped:
+#   <prefix>.json             : Metadata, word lists and image names
+#   <prefix>.ssplit.npy       : int32 source split idxs (-1 if None)
+#   <prefix>.tsplit.npy       : int32 target split idxs (-1 if None)
+#   <prefix>.imgid.npy        : int32 image idxs
+#   <prefix>.<side>.sent.npy  : int32 sentence idx of each sample
+#   <prefix>.<side>.tok.npy   : int32 token idxs of unique sentences
+#   <prefix>.<side>.off.npy   : int64 sentence offsets into tokens
+# where <side> is src or trg. Tokens are idxs into the word list of the
+# corpus. They are mapped to a model vocabulary once with a lookup table
+# and the result is saved as <prefix>.<side>.<checksum>.tok.npy so that
+# later runs and concurrent processes share it through the page cache.
+# The checksum covers the vocabulary, the short-list size and the size and
+# modification time of <prefix>.<side>.tok.npy so that a rewritten corpus
+# never reuses them. write_columnar() also removes them.
+
+def is_columnar(fname):
+    """Returns True if fname is the metadata file of a columnar corpus."""
+    return fname.endswith('.json')
+
+def _save(fname, arr):
+    """Saves arr through a temporary file and rename."""
+    with open(fname + '.tmp', 'wb') as f:
+        np.save(f, arr)
+    os.rename(fname + '.tmp', fname)
+
+def write_columnar(prefix, rows):
+    """Writes a list of .pkl corpus rows as a columnar corpus."""
+    split = lambda x: -1 if x is None else x
+    meta = {'n_samples' : len(rows)}
+
+    _save(prefix + '.ssplit.npy', np.array([split(r[0]) for r in rows], dtype=np.int32))
+    _save(prefix + '.tsplit.npy', np.array([split(r[1]) for r in rows], dtype=np.int32))
+    _save(prefix + '.imgid.npy', np.array([r[2] for r in rows], dtype=np.int32))
+
+    # Image names by image idx
+    imgnames = [''] * (max([r[2] for r in rows]) + 1)
+    for r in rows:
+        imgnames[r[2]] = r[3]
+    meta['imgnames'] = imgnames
+
+    for side, pos in [('src', 4), ('trg', 5)]:
+        if rows[0][pos] is None:
+            meta['%s_words' % side] = None
+            continue
+
+        # Remove the mapped tokens of a previous corpus with this prefix
+        for fname in glob.glob('%s.%s.*.tok.npy' % (glob.escape(prefix), side)):
+            os.remove(fname)
+
+        # Keep each unique sentence once
+        words, sents, sent_idxs = {}, {}, []
+        tokens, offsets = [], [0]
+        for r in rows:
+            key = tuple(r[pos])
+            if key not in sents:
+                sents[key] = len(sents)
+                tokens.extend([words.setdefault(w, len(words)) for w in key])
+                offsets.append(len(tokens))
+            sent_idxs.append(sents[key])
+
+        _save('%s.%s.sent.npy' % (prefix, side), np.array(sent_idxs, dtype=np.int32))
+        _save('%s.%s.tok.npy' % (prefix, side), np.array(tokens, dtype=np.int32))
+        _save('%s.%s.off.npy' % (prefix, side), np.array(offsets, dtype=np.int64))
+        meta['%s_words' % side] = sorted(words, key=words.get)
+
+    # Metadata is written last as it marks the corpus as complete
+    with open(prefix + '.json.tmp', 'w') as f:
+        json.dump(meta, f)
+    os.rename(prefix + '.json.tmp', prefix + '.json')
+
+class ColumnarCorpus(object):
+    """Memory-mapped columnar corpus written by write_columnar()."""
+    def __init__(self, fname, mmap=True):
+        self.prefix = fname[:-len('.json')]
+        self.mmap_mode = 'r' if mmap else None
+
+        with open(fname) as f:
+            self.meta = json.load(f)
+
+        self.n_samples  = self.meta['n_samples']
+        self.imgnames   = self.meta['imgnames']
+        self.has_src    = self.meta['src_words'] is not None
+        self.has_trg    = self.meta['trg_words'] is not None
+
+        self.ssplit     = self.load('ssplit')
+        self.tsplit     = self.load('tsplit')
+        self.imgid      = self.load('imgid')
+
+    def load(self, name):
+        return np.load('%s.%s.npy' % (self.prefix, name), mmap_mode=self.mmap_mode)
+
+    def sentences(self, side, vocab, limit=0):
+        """Returns the unique sentences of side numericalized with vocab as
+        token and offset arrays along with the sentence idx of each sample."""
+        st = os.stat('%s.%s.tok.npy' % (self.prefix, side))
+        md5 = hashlib.md5(('%s %d %d %d' % (vocab_checksum(vocab), limit,
+                                            st.st_size, st.st_mtime_ns)).encode('utf-8'))
+        fname = '%s.%s.%s.tok.npy' % (self.prefix, side, md5.hexdigest()[:16])
+
+        if not os.path.exists(fname):
+            # Map corpus word idxs to vocabulary idxs with a lookup table
+            lut = np.array([vocab.get(w, 1) for w in self.meta['%s_words' % side]], dtype=np.int32)
+            # if given limit vocabulary
+            if limit > 0:
+                lut[lut >= limit] = 1
+            _save(fname, lut[self.load('%s.tok' % side)])
+
+        tokens = np.load(fname, mmap_mode=self.mmap_mode)
+        return tokens, self.load('%s.off' % side), self.load('%s.sent' % side)
+
+class ColumnarSamples(object):
+    """Read-only list-like view of the rows of a columnar corpus with
+    numericalized sentences, given as (tokens, offsets, sent_idxs)."""
+    def __init__(self, corpus, src=None, trg=None):
+        self.corpus = corpus
+        self.sides = [src, trg]
+
+    def __len__(self):
+        return self.corpus.n_samples
+
+    def sentence(self, side, idx):
+        if side is None:
+            return None
+        tokens, offsets, sents = side
+        sent = sents[idx]
+        return tokens[offsets[sent]:offsets[sent + 1]]
+
+    def __getitem__(self, idx):
+        c = self.corpus
+        ssplit, tsplit = int(c.ssplit[idx]), int(c.tsplit[idx])
+        return (ssplit if ssplit >= 0 else None, tsplit if tsplit >= 0 else None,
+                int(c.imgid[idx]), c.imgnames[c.imgid[idx]],
+                self.sentence(self.sides[0], idx), self.sentence(self.sides[1], idx))
+
+    def lengths(self, side):
+        """Returns the sentence lengths of samples for side 0 (src) or 1 (trg)."""
+        tokens, offsets, sents = self.sides[side]
+        return np.diff(offsets)[sents]
+
+    def n_unks(self, side):
+        """Returns the number of UNKs of samples for side 0 (src) or 1 (trg)."""
+        tokens, offsets, sents = self.sides[side]
+        n_unks = np.concatenate(([0], np.cumsum(tokens == 1)))
+        return (n_unks[offsets[1:]] - n_unks[offsets[:-1]])[sents]
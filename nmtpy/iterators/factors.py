@@ -3,7 +3,8 @@ import numpy as np
 
 from ..sysutils   import fopen
 from .iterator    import Iterator
-from .homogeneous import HomogeneousData
+from .homogeneous import HomogeneousData, BucketedData
+from .binarized import load_binarized
 from ..defaults import INT, FLOAT
 
 #from six.moves import range
@@ -33,6 +34,14 @@ class FactorsIterator(Iterator):
         self.srcfile = kwargs['srcfile']
         self.srcdict = kwargs['srcdict']
 
+        # Optional folder for binarized, memory-mapped corpora
+        self.cache_dir = kwargs.get('cache_dir', None)
+
+        # Number of minibatches sorted together and maximum padding ratio
+        # of a minibatch for the 'bucket' shuffle mode
+        self.bucket_batches = kwargs.get('bucket_batches', 50)
+        self.bucket_max_pad = kwargs.get('bucket_max_pad', 0.2)
+
         # 2 input source
         if 'srcfactfile' in kwargs:
             self.srcfact = True
@@ -93,7 +102,60 @@ class FactorsIterator(Iterator):
             if self.mask:
                 self._keys.append("%s_mask" % self.trg_name)
 
+    def get_streams(self):
+        """Returns files, dicts and short-list sizes in sample order."""
+        if self.srcfact and self.trgfact:
+            return ([self.srcfile, self.srcfactfile, self.trglemfile, self.trgfactfile],
+                    [self.srcdict, self.srcfactdict, self.trglemdict, self.trgfactdict],
+                    [self.n_words_src, self.n_words_srcfact, self.n_words_trglem, self.n_words_trgfact])
+        elif self.srcfact:
+            return ([self.srcfile, self.srcfactfile, self.trgfile],
+                    [self.srcdict, self.srcfactdict, self.trgdict],
+                    [self.n_words_src, self.n_words_srcfact, self.n_words_trg])
+        elif self.trgfact:
+            return ([self.srcfile, self.trglemfile, self.trgfactfile],
+                    [self.srcdict, self.trglemdict, self.trgfactdict],
+                    [self.n_words_src, self.n_words_trglem, self.n_words_trgfact])
+
     def read(self):
+        if self.cache_dir:
+            # Memory-map the binarized corpus, creating it if necessary
+            files, dicts, limits = self.get_streams()
+            self._seqs = load_binarized(self.cache_dir, files, dicts, limits,
+                                        print_func=self._print)
+        else:
+            self._seqs = self.read_text()
+
+        # Number of training samples
+        self.n_samples = len(self._seqs)
+        # TODO statistics
+
+        # Target lengths are readily available for binarized corpora
+        lengths = self._seqs.streams[1].lengths() if self.cache_dir else None
+
+        if self.shuffle_mode == 'trglen':
+            # Homogeneous batches ordered by target sequence length
+            # Get an iterator over sample idxs
+            self._iter = HomogeneousData(self._seqs, self.batch_size, trg_pos=1,
+                                         lengths=lengths)
+            self._process_batch = (lambda idxs: self.mask_seqs(idxs))
+        elif self.shuffle_mode == 'bucket':
+            # Length-sorted batches inside shuffled mega-batches
+            self._iter = BucketedData(self._seqs, self.batch_size, trg_pos=1,
+                                      lengths=lengths,
+                                      n_batches=self.bucket_batches,
+                                      max_pad_ratio=self.bucket_max_pad)
+            self._process_batch = (lambda idxs: self.mask_seqs(idxs))
+        else:
+            if self.shuffle_mode == 'simple':
+                # Simple shuffle
+                self._idxs = np.random.permutation(self.n_samples)
+            else:
+                # Ordered
+                self._idxs = np.arange(self.n_samples)
+            self.prepare_batches()
+
+    def read_text(self):
         seqs = []
         # 2 inputs and 2 outputs
         if self.srcfact and self.trgfact:
@@ -206,26 +268,7 @@ class FactorsIterator(Iterator):
             tlf.close()
             tff.close()
 
-        # Save sequences
-        self._seqs = seqs
-
-        # Number of training samples
-        self.n_samples = len(self._seqs)
-        # TODO statistics
-
-        if self.shuffle_mode == 'trglen':
-            # Homogeneous batches ordered by target sequence length
-            # Get an iterator over sample idxs
-            self._iter = HomogeneousData(self._seqs, self.batch_size, trg_pos=1)
-            self._process_batch = (lambda idxs: self.mask_seqs(idxs))
-        else:
-            if self.shuffle_mode == 'simple':
-                # Simple shuffle
-                self._idxs = np.random.permutation(self.n_samples)
-            else:
-                # Ordered
-                self._idxs = np.arange(self.n_samples)
-            self.prepare_batches()
+        return seqs
 
 
     # this method is required for the 2 masks for target because we do not want EOS in the second output
@@ -276,5 +319,5 @@ class FactorsIterator(Iterator):
         self.rewind()
 
     def rewind(self):
-        if self.shuffle_mode != 'trglen':
+        if self.shuffle_mode not in ('trglen', 'bucket'):
             self._iter = iter(self._minibatches)
@@ -3,15 +3,19 @@ import pickle
 import numpy as np
 
 from ..sysutils     import listify
-from ..nmtutils     import sent_to_idx
+from .binarized     import numericalize_sents
 from .iterator      import Iterator
-from .homogeneous   import HomogeneousData
+from .imgfeats      import ImageFeatures
+from .columnar      import is_columnar, ColumnarCorpus, ColumnarSamples
+from .homogeneous   import HomogeneousData, BucketedData
 from ..defaults     import INT, FLOAT
 
 # This is an iterator specifically to be used by the .pkl
 # corpora files created for WMT17 Shared Task on Multimodal Machine Translation
 # Each element of the list that is pickled is in the following format:
 # [src_split_idx, trg_split_idx, imgid, imgname, src_words, trg_words]
+# pklfile can also be the .json file of a columnar corpus written by
+# columnar.write_columnar() which is memory-mapped instead of unpickled.
 
 # Shorthand for positional access
 SSPLIT, TSPLIT, IMGID, IMGNAME, STOKENS, TTOKENS = range(6)
@@ -44,14 +48,29 @@ class FusionIterator(Iterator):
         self.n_words_src = kwargs.get('n_words_src', 0)
         self.n_words_trg = kwargs.get('n_words_trg', 0)
 
+        # Number of minibatches sorted together and maximum padding ratio
+        # of a minibatch for the 'bucket' shuffle mode
+        self.bucket_batches = kwargs.get('bucket_batches', 50)
+        self.bucket_max_pad = kwargs.get('bucket_max_pad', 0.2)
+
         # How do we refer to symbolic data variables?
         self.src_name = kwargs.get('src_name', 'x')
         self.trg_name = kwargs.get('trg_name', 'y')
 
+        # Number of processes for numericalizing the corpora
+        self.n_jobs = kwargs.get('n_jobs', 1)
+
         # Image features file
         #   (n_samples, flattened_spatial, n_maps)
         self.imgfile = kwargs.get('imgfile', None)
 
+        # Number of hot images to keep in memory
+        self.img_cache = kwargs.get('img_cache', 0)
+
+        # Feed the unique images of a minibatch along with the idxs of
+        # samples into them (not for single samples, i.e. translation)
+        self.img_dedup = kwargs.get('img_dedup', False) and self.batch_size > 1
+
         if self.srcdict:
             self._keys = [self.src_name]
             if self.mask:
@@ -60,6 +79,8 @@ class FusionIterator(Iterator):
         # We have images in the middle
         if self.imgfile:
             self._keys.append("%s_img" % self.src_name)
+            if self.img_dedup:
+                self._keys.append("%s_img_idx" % self.src_name)
 
         if self.trgdict:
             self._keys.append(self.trg_name)
@@ -69,18 +90,44 @@ class FusionIterator(Iterator):
     def read(self):
         # Load image features file if any
         if self.imgfile is not None:
-            self._print('Loading image file...')
-            self.img_feats = np.load(self.imgfile)
+            self._print('Memory-mapping image file...')
+            self.img_feats = ImageFeatures(self.imgfile, cache_size=self.img_cache)
 
-            # Move n_samples to middle dimension
+            # Minibatches will have n_samples in the middle dimension
             # -> 196 x n_samples x 1024 for res4f_relu
-            self.img_feats = self.img_feats.transpose(1, 0, 2)
-
             # (w*h, n, c)
-            self.img_shape = tuple((self.img_feats.shape[0], -1, self.img_feats.shape[-1]))
+            self.img_shape = tuple((self.img_feats.shape[1], -1, self.img_feats.shape[-1]))
             self._print('Done.')
 
         # Load the corpora
+        if is_columnar(self.pklfile):
+            self.read_columnar()
+        else:
+            self.read_pkl()
+
+        # Set batch processor function
+        # idxs can be a list of single element as well
+        self._process_batch = (lambda idxs: self.mask_seqs(idxs))
+
+        # Homogeneous batches ordered by target sequence length
+        # Get an iterator over sample idxs
+        if self.batch_size > 1 and self.shuffle_mode == 'bucket':
+            # Length-sorted batches inside shuffled mega-batches
+            self._iter = BucketedData(self._seqs, self.batch_size, trg_pos=TTOKENS,
+                                      src_pos=STOKENS, print_func=self._print,
+                                      lengths=self.trg_lens, src_lengths=self.src_lens,
+                                      n_batches=self.bucket_batches,
+                                      max_pad_ratio=self.bucket_max_pad)
+        elif self.batch_size > 1:
+            # Training
+            self._iter = HomogeneousData(self._seqs, self.batch_size, trg_pos=TTOKENS,
+                                         lengths=self.trg_lens)
+        else:
+            # Test-set
+            self._iter = iter([[i] for i in np.arange(self.n_samples)])
+
+    def read_pkl(self):
+        """Unpickle the corpus and numericalize its sentences."""
         with open(self.pklfile, 'rb') as f:
             self._print('Loading pkl file...')
             self._seqs = pickle.load(f)
@@ -106,38 +153,50 @@ class FusionIterator(Iterator):
         # n_unique_samples <= n_samples
         self.n_unique_images = len(set([s[IMGNAME] for s in self._seqs]))
 
-        # Some statistics
-        total_src_words = []
-        total_trg_words = []
-
         # Let's map the sentences once to idx's
-        for sample in self._seqs:
-            if self.src_avail:
-                sample[STOKENS] = sent_to_idx(self.srcdict, sample[STOKENS], self.n_words_src)
-                total_src_words.extend(sample[STOKENS])
-            if self.trg_avail:
-                sample[TTOKENS] = sent_to_idx(self.trgdict, sample[TTOKENS], self.n_words_trg)
-                total_trg_words.extend(sample[TTOKENS])
-
         if self.src_avail:
-            self.unk_src = total_src_words.count(1)
-            self.total_src_words = len(total_src_words)
+            self.unk_src, self.total_src_words = self.map_sentences(STOKENS, self.srcdict, self.n_words_src)
         if self.trg_avail:
-            self.unk_trg = total_trg_words.count(1)
-            self.total_trg_words = len(total_trg_words)
+            self.unk_trg, self.total_trg_words = self.map_sentences(TTOKENS, self.trgdict, self.n_words_trg)
 
-        # Set batch processor function
-        # idxs can be a list of single element as well
-        self._process_batch = (lambda idxs: self.mask_seqs(idxs))
+        # Lengths are computed by the samplers
+        self.src_lens, self.trg_lens = None, None
 
-        # Homogeneous batches ordered by target sequence length
-        # Get an iterator over sample idxs
-        if self.batch_size > 1:
-            # Training
-            self._iter = HomogeneousData(self._seqs, self.batch_size, trg_pos=TTOKENS)
-        else:
-            # Test-set
-            self._iter = iter([[i] for i in np.arange(self.n_samples)])
+    def read_columnar(self):
+        """Memory-map a columnar corpus and its numericalized sentences."""
+        self._print('Memory-mapping columnar corpus...')
+        corpus = ColumnarCorpus(self.pklfile)
+
+        # we may not have them in corpus or we may not
+        # want to use target sentences by giving its vocab None
+        self.trg_avail = corpus.has_trg and self.trgdict is not None
+        self.src_avail = corpus.has_src and self.srcdict is not None
+
+        src = corpus.sentences('src', self.srcdict, self.n_words_src) if self.src_avail else None
+        trg = corpus.sentences('trg', self.trgdict, self.n_words_trg) if self.trg_avail else None
+        self._seqs = ColumnarSamples(corpus, src, trg)
+        self._print('Done.')
+
+        # We now have a list of samples
+        self.n_samples = len(self._seqs)
+        self.n_unique_images = len(np.unique(corpus.imgid))
+
+        # Statistics and lengths without touching the tokens
+        self.src_lens, self.trg_lens = None, None
+        if self.src_avail:
+            self.src_lens = self._seqs.lengths(0)
+            self.unk_src, self.total_src_words = int(self._seqs.n_unks(0).sum()), int(self.src_lens.sum())
+        if self.trg_avail:
+            self.trg_lens = self._seqs.lengths(1)
+            self.unk_trg, self.total_trg_words = int(self._seqs.n_unks(1).sum()), int(self.trg_lens.sum())
+
+    def map_sentences(self, pos, vocab, limit):
+        """Numericalize the sentences at pos into views of a compact array."""
+        tokens, offsets, n_unks = numericalize_sents([s[pos] for s in self._seqs],
+                                                     vocab, limit, n_jobs=self.n_jobs)
+        for sample, start, end in zip(self._seqs, offsets[:-1], offsets[1:]):
+            sample[pos] = tokens[start:end]
+        return n_unks, len(tokens)
 
     def mask_seqs(self, idxs):
         """Pad if necessary and return padded batches or single samples."""
@@ -151,11 +210,16 @@ class FusionIterator(Iterator):
 
         # Source image features
         if self.imgfile is not None:
-            x_img = self.img_feats[:, [b[IMGID] for b in batch], :]
+            if self.img_dedup:
+                x_img, img_idx = self.img_feats.gather_unique([b[IMGID] for b in batch], time_major=True)
+            else:
+                x_img = self.img_feats.gather([b[IMGID] for b in batch], time_major=True)
 
             # Reshape accordingly
             x_img.shape = self.img_shape
             data += [x_img]
+            if self.img_dedup:
+                data += [img_idx]
 
         if self.trg_avail:
             data += Iterator.mask_data([b[TTOKENS] for b in batch], get_mask=self.mask)
@@ -1,56 +1,111 @@
 # -*- coding: utf-8 -*-
+import os
+
 import numpy as np
-import copy
 
 # Iterator that randomly fetches samples with same target
 # length to be efficient in terms of RNN underlyings.
 # Code from https://github.com/kelvinxu/arctic-captions
+# The length index is a single int32 array of sample idxs sorted by
+# target length where each unique length owns a contiguous slice.
 class HomogeneousData(object):
-    def __init__(self, data, batch_size, trg_pos):
+    def __init__(self, data, batch_size, trg_pos, lengths=None, index_file=None):
         self.batch_size = batch_size
         self.data = data
         self.trg_pos = trg_pos
 
-        self.prepare()
+        # find all target sequence lengths if not given
+        if lengths is None:
+            lengths = [len(cc[self.trg_pos]) for cc in self.data]
+
+        # Reuse the length index persisted along with the corpus if any
+        if not (index_file and os.path.exists(index_file) and self.load(index_file, lengths)):
+            self.prepare(lengths)
+            if index_file:
+                self.save(index_file)
+
         self.reset()
 
-    def prepare(self):
-        # find all target sequence lengths
-        self.lengths = [len(cc[self.trg_pos]) for cc in self.data]
+    def prepare(self, lengths):
+        self.lengths = np.asarray(lengths, dtype=np.int32)
 
-        # Compute unique lengths
-        self.len_unique = np.unique(self.lengths)
+        # Small integer keys are radix sorted by numpy, i.e. linear time
+        keys = self.lengths
+        if len(keys) > 0 and keys.max() < 2**16:
+            keys = keys.astype(np.uint16)
 
-        # indices of unique lengths
-        self.len_indices = dict()
-        self.len_counts = dict()
+        # A single stable sort groups the sample idxs of each length
+        self.idxs = np.argsort(keys, kind='mergesort').astype(np.int32)
+        self.build_slices()
 
-        # For each length, find the sample idxs and their counts
-        for ll in self.len_unique:
-            self.len_indices[ll] = np.where(self.lengths == ll)[0]
-            self.len_counts[ll] = len(self.len_indices[ll])
+    def build_slices(self):
+        # Compute unique lengths and their slices over self.idxs
+        # An empty corpus has no lengths at all
+        sorted_lens = self.lengths[self.idxs]
+        starts = np.flatnonzero(np.diff(sorted_lens)) + 1
+        first = [0] if len(sorted_lens) > 0 else []
+        self.len_starts = np.concatenate((first, starts)).astype(np.int64)
+        self.len_counts = np.diff(np.append(self.len_starts, len(self.idxs)))
+        self.len_unique = sorted_lens[self.len_starts]
+
+    def save(self, fname):
+        """Save the length index to be reused by load()."""
+        np.savez(fname, lengths=self.lengths, idxs=self.idxs)
+
+    def load(self, fname, lengths):
+        """Restore a length index saved by save(), returns False if its
+        lengths differ from the actual ones, e.g. for an edited corpus."""
+        index = np.load(fname)
+        if not np.array_equal(index['lengths'], np.asarray(lengths, dtype=np.int32)):
+            return False
+        self.lengths = index['lengths']
+        self.idxs = index['idxs']
+        self.build_slices()
+        return True
 
     def reset(self):
-        self.len_curr_counts = copy.copy(self.len_counts)
+        self.len_curr_counts = self.len_counts.copy()
+
+        # Set initial position for each length to its slice start
+        self.len_indices_pos = self.len_starts.copy()
 
         # Randomize length order
-        self.len_unique = np.random.permutation(self.len_unique)
-        self.len_indices_pos = dict()
-        for ll in self.len_unique:
-            # Randomize sample order for a specific length
-            self.len_indices[ll] = np.random.permutation(self.len_indices[ll])
-            # Set initial position for this length to 0
-            self.len_indices_pos[ll] = 0
+        self.len_order = np.random.permutation(len(self.len_unique))
+
+        # Randomize sample order for each length in place
+        for start, count in zip(self.len_starts, self.len_counts):
+            np.random.shuffle(self.idxs[start:start + count])
 
         self.len_idx = -1
 
+    def get_state(self):
+        """Returns the sample order and the position in the current pass."""
+        return {
+                'idxs'              : self.idxs.copy(),
+                'len_order'         : self.len_order,
+                'len_curr_counts'   : self.len_curr_counts.copy(),
+                'len_indices_pos'   : self.len_indices_pos.copy(),
+                'len_idx'           : np.array(self.len_idx),
+               }
+
+    def set_state(self, state):
+        """Restores a state returned by get_state()."""
+        self.idxs = state['idxs'].astype(np.int32)
+        self.len_order = state['len_order']
+        self.len_curr_counts = state['len_curr_counts'].copy()
+        self.len_indices_pos = state['len_indices_pos'].copy()
+        self.len_idx = int(state['len_idx'])
+
     def __next__(self):
+        if len(self.len_unique) == 0:
+            raise StopIteration()
+
         fin_unique_len = 0
         while True:
             # What is the length idx for this batch?
             self.len_idx = (self.len_idx + 1) % len(self.len_unique)
             # Current candidate length
-            self.cur_len = self.len_unique[self.len_idx]
+            self.cur_len = self.len_order[self.len_idx]
             # Do we have samples left for this length?
             if self.len_curr_counts[self.cur_len] > 0:
                 break
@@ -68,12 +123,12 @@ class HomogeneousData(object):
             raise StopIteration()
 
         # batch_size or what is left for this length
-        curr_batch_size = np.minimum(self.batch_size, self.len_curr_counts[self.cur_len])
+        curr_batch_size = min(self.batch_size, self.len_curr_counts[self.cur_len])
         # Get current position for the batch
         curr_pos = self.len_indices_pos[self.cur_len]
 
         # get the indices for the current batch
-        curr_indices = self.len_indices[self.cur_len][curr_pos:curr_pos+curr_batch_size]
+        curr_indices = self.idxs[curr_pos:curr_pos+curr_batch_size]
 
         # Increment next position
         self.len_indices_pos[self.cur_len] += curr_batch_size
@@ -85,3 +140,137 @@ class HomogeneousData(object):
 
     def __iter__(self):
         return self
+
+# Iterator that sorts samples by target length inside shuffled
+# mega-batches of 'n_batches * batch_size' samples and chops them
+# into minibatches. Neighbouring lengths are thus merged into the same
+# minibatch which avoids the tiny remainder batches of HomogeneousData.
+class BucketedData(object):
+    def __init__(self, data, batch_size, trg_pos, src_pos=None,
+                 n_batches=50, max_pad_ratio=0.2, print_func=None,
+                 lengths=None, src_lengths=None):
+        self.batch_size = batch_size
+        self.data = data
+        self.trg_pos = trg_pos
+        self.src_pos = src_pos
+
+        # How many minibatches are sorted together
+        self.n_batches = n_batches
+
+        # Maximum ratio of padded target positions in a minibatch
+        self.max_pad_ratio = max_pad_ratio
+
+        # Used to dump batch fill statistics at the end of epochs
+        self.print_func = print_func
+
+        self.prepare(lengths, src_lengths)
+        self.reset()
+
+    def prepare(self, lengths=None, src_lengths=None):
+        # find all sequence lengths if not given
+        if lengths is None:
+            lengths = [len(cc[self.trg_pos]) for cc in self.data]
+        if src_lengths is None and self.src_pos is not None:
+            src_lengths = [len(cc[self.src_pos]) for cc in self.data]
+
+        # +1 for <eos> which is part of the mask as well
+        self.lengths = np.asarray(lengths, dtype=np.int32) + 1
+        if self.src_pos is not None:
+            self.src_lengths = np.asarray(src_lengths, dtype=np.int32)
+
+    def __chop(self, idxs):
+        """Greedily chops length-sorted idxs into batches with bounded padding."""
+        lens = self.lengths[idxs]
+        csum = np.cumsum(lens)
+        batches = []
+        start = 0
+        while start < len(idxs):
+            end = min(start + self.batch_size, len(idxs))
+            # Padding ratio of every candidate batch [start, j) where the
+            # longest sample is the last one as lens are sorted
+            size = np.arange(1, end - start + 1)
+            real = csum[start:end] - (csum[start - 1] if start > 0 else 0)
+            pad_ratio = 1. - real / (lens[start:end] * size).astype('float64')
+            # Take the largest batch satisfying the bound (at least 1 sample)
+            ok = np.where(pad_ratio <= self.max_pad_ratio)[0]
+            end = start + (ok[-1] + 1 if len(ok) > 0 else 1)
+            batches.append(idxs[start:end])
+            start = end
+        return batches
+
+    def reset(self):
+        mega_size = self.n_batches * self.batch_size
+        perm = np.random.permutation(len(self.lengths))
+
+        self.batches = []
+        for i in range(0, len(perm), mega_size):
+            mega = perm[i:i + mega_size]
+            # Sort by target length, then by source length if available
+            if self.src_pos is not None:
+                order = np.lexsort((self.src_lengths[mega], self.lengths[mega]))
+            else:
+                order = np.argsort(self.lengths[mega], kind='mergesort')
+            mega = mega[order]
+
+            self.batches.extend(self.__chop(mega))
+
+        # Randomize minibatch order
+        self.batch_order = np.random.permutation(len(self.batches))
+        self.batch_idx = 0
+
+    def get_state(self):
+        """Returns the minibatches and the position in the current pass."""
+        idxs = np.concatenate(self.batches) if self.batches else np.zeros(0)
+        return {
+                'sizes'         : np.array([len(b) for b in self.batches], dtype=np.int64),
+                'idxs'          : idxs.astype(np.int64),
+                'batch_order'   : self.batch_order,
+                'batch_idx'     : np.array(self.batch_idx),
+               }
+
+    def set_state(self, state):
+        """Restores a state returned by get_state()."""
+        if len(state['sizes']) > 0:
+            self.batches = np.split(state['idxs'], np.cumsum(state['sizes'])[:-1])
+        else:
+            self.batches = []
+        self.batch_order = state['batch_order']
+        self.batch_idx = int(state['batch_idx'])
+
+    def stats(self):
+        """Returns batch fill statistics for the current epoch."""
+        if len(self.batches) == 0:
+            return {'n_batches': 0, 'mean_size': 0., 'fill': 0., 'n_small': 0, 'trg_efficiency': 0.}
+
+        sizes = np.array([len(b) for b in self.batches])
+        real = sum([self.lengths[b].sum() for b in self.batches])
+        padded = sum([self.lengths[b].max() * len(b) for b in self.batches])
+        return {
+                'n_batches'     : len(self.batches),
+                'mean_size'     : sizes.mean(),
+                'fill'          : sizes.mean() / self.batch_size,
+                'n_small'       : int((sizes < (self.batch_size / 2.)).sum()),
+                'trg_efficiency': real / float(padded),
+               }
+
+    def __next__(self):
+        # All data consumed
+        if self.batch_idx == len(self.batches):
+            if self.print_func:
+                st = self.stats()
+                self.print_func(
+                    '--> %d batches (mean size %.1f, %.1f%% full, %d under half), '
+                    '%.1f%% real target tokens' % (st['n_batches'], st['mean_size'],
+                                                   100 * st['fill'], st['n_small'],
+                                                   100 * st['trg_efficiency']))
+            self.reset()
+            raise StopIteration()
+
+        curr_indices = self.batches[self.batch_order[self.batch_idx]]
+        self.batch_idx += 1
+
+        # Return batch indices from here
+        return curr_indices
+
+    def __iter__(self):
+        return self
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+import os
+from collections import OrderedDict
+
+import numpy as np
+
+from ..defaults import INT, FLOAT
+
+# Image features are kept on disk as (n_images, ...) .npy files, e.g.
+# (n, 196, 1024) for res4f_relu, which stores each image as a contiguous
+# block. They are memory-mapped so that only the images of a minibatch are
+# read from disk (or the page cache shared by all processes) and the full
+# array is never loaded, copied or transposed in memory.
+#
+# Compact stores created by convert_features() are either float16 or
+# per-channel quantized uint8 codes in which case <fname>.quant.npz holds
+# the float32 scale and offset of each channel (last dimension). They are
+# upcast to FLOAT only when a minibatch is assembled.
+
+class ImageFeatures(object):
+    """Lazily loaded image features with an optional LRU cache of images."""
+    def __init__(self, fname, cache_size=0, mmap=True):
+        self.fname = fname
+
+        # Number of images to keep in memory, 0 disables the cache
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+
+        feats = np.load(fname, mmap_mode='r' if mmap else None)
+        if isinstance(feats, np.lib.npyio.NpzFile):
+            # .npz archives can not be memory-mapped, load the first array
+            feats = feats[feats.files[0]]
+
+        self.feats = feats
+        self.shape = self.feats.shape
+        self.dtype = self.feats.dtype
+
+        # Per-channel dequantization parameters if any
+        self.scale, self.offset = None, None
+        if os.path.exists(fname + '.quant.npz'):
+            quant = np.load(fname + '.quant.npz')
+            self.scale, self.offset = quant['scale'], quant['offset']
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __read(self, idxs):
+        """Reads the given unique image idxs from disk or the cache."""
+        if self.cache_size == 0:
+            return self.feats[idxs]
+
+        rows = np.empty((len(idxs), ) + self.shape[1:], dtype=self.dtype)
+        missing = []
+        for i, idx in enumerate(idxs):
+            row = self.cache.get(idx, None)
+            if row is None:
+                missing.append(i)
+            else:
+                self.cache.move_to_end(idx)
+                rows[i] = row
+
+        if missing:
+            rows[missing] = self.feats[idxs[missing]]
+            for i in missing:
+                self.cache[idxs[i]] = rows[i].copy()
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+
+        return rows
+
+    def __assemble(self, rows, time_major):
+        """Upcasts read rows into a minibatch tensor."""
+        if time_major:
+            # Only the minibatch is transposed
+            rows = rows.swapaxes(0, 1)
+
+        # Upcast (a no-op for FLOAT stores)
+        rows = np.ascontiguousarray(rows, dtype=FLOAT)
+        if self.scale is not None:
+            rows *= self.scale
+            rows += self.offset
+        return rows
+
+    def gather(self, idxs, time_major=False):
+        """Returns the features of idxs as (len(idxs), ...) or as
+        (w*h, len(idxs), c) if time_major is True."""
+        # Read each image once and in disk order
+        uniq, inverse = np.unique(np.asarray(idxs, dtype=np.int64), return_inverse=True)
+        return self.__assemble(self.__read(uniq)[inverse], time_major)
+
+    def gather_unique(self, idxs, time_major=False):
+        """Returns the features of the unique images in idxs and the
+        position of each sample's image among them."""
+        uniq, inverse = np.unique(np.asarray(idxs, dtype=np.int64), return_inverse=True)
+        return self.__assemble(self.__read(uniq), time_major), inverse.astype(INT)
+
+def convert_features(infile, outfile, quantize=False, chunk_size=1000):
+    """Converts float32 image features to a float16 or, if quantize is
+    True, to a per-channel quantized uint8 store."""
+    feats = np.load(infile, mmap_mode='r')
+    n_images = feats.shape[0]
+    chunks = [(i, min(i + chunk_size, n_images)) for i in range(0, n_images, chunk_size)]
+
+    if quantize:
+        # Find the range of each channel
+        axes = tuple(range(feats.ndim - 1))
+        vmin = np.full(feats.shape[-1], np.inf, dtype=np.float32)
+        vmax = np.full(feats.shape[-1], -np.inf, dtype=np.float32)
+        for start, end in chunks:
+            vmin = np.minimum(vmin, feats[start:end].min(axis=axes))
+            vmax = np.maximum(vmax, feats[start:end].max(axis=axes))
+
+        # Constant channels are mapped to code 0
+        scale = (vmax - vmin) / 255.
+        scale[scale == 0] = 1.
+        np.savez(outfile + '.quant.npz', scale=scale, offset=vmin)
+        dtype = np.uint8
+    else:
+        dtype = np.float16
+        if os.path.exists(outfile + '.quant.npz'):
+            # Stale parameters of a previous quantized store
+            os.remove(outfile + '.quant.npz')
+
+    out = np.lib.format.open_memmap(outfile, mode='w+', dtype=dtype, shape=feats.shape)
+    for start, end in chunks:
+        if quantize:
+            out[start:end] = np.rint((feats[start:end] - vmin) / scale)
+        else:
+            out[start:end] = feats[start:end]
+    out.flush()
+    del out
+
+def validate_features(infile, outfile, chunk_size=1000):
+    """Compares a converted store against the original features and
+    returns a dictionary of numeric error statistics."""
+    orig = np.load(infile, mmap_mode='r')
+    conv = ImageFeatures(outfile)
+
+    max_err, sum_err, sum_sqerr, sum_sq = 0., 0., 0., 0.
+    for start in range(0, len(conv), chunk_size):
+        idxs = np.arange(start, min(start + chunk_size, len(conv)))
+        ref = np.asarray(orig[start:idxs[-1] + 1], dtype=np.float64)
+        err = np.abs(conv.gather(idxs) - ref)
+        max_err = max(max_err, err.max())
+        sum_err += err.sum()
+        sum_sqerr += (err ** 2).sum()
+        sum_sq += (ref ** 2).sum()
+
+    return {
+            'orig_bytes'    : os.path.getsize(infile),
+            'conv_bytes'    : os.path.getsize(outfile),
+            'max_abs_err'   : max_err,
+            'mean_abs_err'  : sum_err / orig.size,
+            'rel_rms_err'   : np.sqrt(sum_sqerr / max(sum_sq, 1e-12)),
+           }
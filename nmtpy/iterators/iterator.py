@@ -45,6 +45,13 @@ class Iterator(object, metaclass=ABCMeta):
         self._iter     = None
         self._minibatches = []
 
+        # Number of minibatches consumed in the current pass
+        self._n_batches = 0
+
+        # Shard of the minibatches returned for data-parallel training
+        self._shard     = 0
+        self._n_shards  = 1
+
         self.shuffle_mode = shuffle_mode
         if self.shuffle_mode:
             # Set random seed
@@ -61,17 +68,69 @@ class Iterator(object, metaclass=ABCMeta):
     def __iter__(self):
         return self
 
+    def shard(self, shard, n_shards):
+        """Only returns the minibatches of the given shard. Every shard takes
+        a minibatch out of each n_shards minibatches and an incomplete last
+        round is dropped so that shards of the same pass are equally long.
+        Shuffling should be seeded identically for every shard."""
+        self._shard = shard
+        self._n_shards = n_shards
+
     def __next__(self):
         """Returns the next set of data from the iterator."""
         try:
-            data = self._process_batch(next(self._iter))
+            if self._n_shards > 1:
+                batches = [next(self._iter) for _ in range(self._n_shards)]
+                data = self._process_batch(batches[self._shard])
+            else:
+                data = self._process_batch(next(self._iter))
         except StopIteration as si:
+            self._n_batches = 0
             self.rewind()
             raise
         else:
+            self._n_batches += self._n_shards
             # Lookup the keys and return an ordered dict of the current minibatch
             return OrderedDict([(k, data[i]) for i,k in enumerate(self._keys)])
 
+    def get_state(self):
+        """Returns the position in the current pass as a dict of numpy arrays
+        or None if it can not be restored."""
+        if hasattr(self._iter, 'get_state'):
+            # Shuffling samplers keep their own state
+            state = self._iter.get_state()
+        elif self._minibatches:
+            # Prepared minibatches are rebuilt from the sample order
+            state = {'idxs': np.asarray(self._idxs)}
+        else:
+            # Remaining minibatches of sample idxs
+            batches = list(self._iter)
+            self._iter = iter(batches)
+            state = {
+                    'sizes' : np.array([len(b) for b in batches], dtype=np.int64),
+                    'idxs'  : np.concatenate(batches).astype(np.int64) if batches \
+                              else np.zeros(0, dtype=np.int64),
+                    }
+
+        state['n_batches'] = np.array(self._n_batches)
+        return state
+
+    def set_state(self, state):
+        """Restores the position saved by get_state() after read()."""
+        self._n_batches = int(state['n_batches'])
+        if hasattr(self._iter, 'set_state'):
+            self._iter.set_state(state)
+        elif self._minibatches:
+            self._idxs = state['idxs']
+            self.prepare_batches()
+            self._iter = iter(self._minibatches)
+            # Skip the consumed minibatches
+            for _ in range(self._n_batches):
+                next(self._iter)
+        else:
+            splits = np.cumsum(state['sizes'])[:-1]
+            self._iter = iter(np.split(state['idxs'], splits) if len(state['sizes']) else [])
+
     # May or may not be used.
     def prepare_batches(self):
         """Prepare self.__iter."""
@@ -3,15 +3,19 @@ import pickle
 import numpy as np
 
 from ..sysutils     import listify
-from ..nmtutils     import sent_to_idx
+from .binarized     import numericalize_sents
 from .iterator      import Iterator
-from .homogeneous   import HomogeneousData
+from .imgfeats      import ImageFeatures
+from .columnar      import is_columnar, ColumnarCorpus, ColumnarSamples
+from .homogeneous   import HomogeneousData, BucketedData
 from ..defaults     import INT, FLOAT
 
 # This is an iterator specifically to be used by the .pkl
 # corpora files created for WMT17 Shared Task on Multimodal Machine Translation
 # Each element of the list that is pickled is in the following format:
 # [src_split_idx, trg_split_idx, imgid, imgname, src_words, trg_words]
+# pklfile can also be the .json file of a columnar corpus written by
+# columnar.write_columnar() which is memory-mapped instead of unpickled.
 
 # Shorthand for positional access
 SSPLIT, TSPLIT, IMGID, IMGNAME, STOKENS, TTOKENS = range(6)
@@ -46,36 +50,40 @@ class MNMTIterator(Iterator):
         self.n_words_src = kwargs.get('n_words_src', 0)
         self.n_words_trg = kwargs.get('n_words_trg', 0)
 
+        # Number of minibatches sorted together and maximum padding ratio
+        # of a minibatch for the 'bucket' shuffle mode
+        self.bucket_batches = kwargs.get('bucket_batches', 50)
+        self.bucket_max_pad = kwargs.get('bucket_max_pad', 0.2)
+
         # How do we refer to symbolic data variables?
         self.src_name = kwargs.get('src_name', 'x')
         self.trg_name = kwargs.get('trg_name', 'y')
 
+        # Number of processes for numericalizing the corpora
+        self.n_jobs = kwargs.get('n_jobs', 1)
+
         # Image features file
         #   (n_samples, flattened_spatial, n_maps)
         self.imgfile = kwargs.get('imgfile', None)
 
+        # Number of hot images to keep in memory
+        self.img_cache = kwargs.get('img_cache', 0)
+
+        # Feed the unique images of a minibatch along with the idxs of
+        # samples into them (not for single samples, i.e. translation)
+        self.img_dedup = kwargs.get('img_dedup', False) and self.batch_size > 1
+
     def read(self):
         # Load image features file if any
         if self.imgfile is not None:
-            self._print('Loading image file...')
-            self.img_feats = np.load(self.imgfile)
+            self._print('Memory-mapping image file...')
+            self.img_feats = ImageFeatures(self.imgfile, cache_size=self.img_cache)
 
         # Load the corpora
-        with open(self.pklfile, 'rb') as f:
-            self._print('Loading pkl file...')
-            self._seqs = pickle.load(f)
-
-        # Introspect the pickle by looking the first sample
-        ss = self._seqs[0]
-
-        # we may not have them in pickle or we may not
-        # want to use target sentences by giving its vocab None
-        if ss[TTOKENS] is not None and self.trgdict:
-            self.trg_avail = True
-
-        # Same for source side
-        if ss[STOKENS] is not None and self.srcdict:
-            self.src_avail = True
+        if is_columnar(self.pklfile):
+            self.read_columnar()
+        else:
+            self.read_pkl()
 
         if self.src_avail:
             self._keys = [self.src_name]
@@ -85,40 +93,14 @@ class MNMTIterator(Iterator):
         # We have images in the middle
         if self.imgfile:
             self._keys.append("%s_img" % self.src_name)
+            if self.img_dedup:
+                self._keys.append("%s_img_idx" % self.src_name)
 
         if self.trg_avail:
             self._keys.append(self.trg_name)
             if self.mask:
                 self._keys.append("%s_mask" % self.trg_name)
 
-        # We now have a list of samples
-        self.n_samples = len(self._seqs)
-
-        # Depending on mode, we can have multiple sentences per image so
-        # let's store the number of actual images as well.
-        # n_unique_samples <= n_samples
-        self.n_unique_images = len(set([s[IMGNAME] for s in self._seqs]))
-
-        # Some statistics
-        total_src_words = []
-        total_trg_words = []
-
-        # Let's map the sentences once to idx's
-        for sample in self._seqs:
-            if self.src_avail:
-                sample[STOKENS] = sent_to_idx(self.srcdict, sample[STOKENS], self.n_words_src)
-                total_src_words.extend(sample[STOKENS])
-            if self.trg_avail:
-                sample[TTOKENS] = sent_to_idx(self.trgdict, sample[TTOKENS], self.n_words_trg)
-                total_trg_words.extend(sample[TTOKENS])
-
-        if self.src_avail:
-            self.n_unks_src = total_src_words.count(1)
-            self.total_src_words = len(total_src_words)
-        if self.trg_avail:
-            self.n_unks_trg = total_trg_words.count(1)
-            self.total_trg_words = len(total_trg_words)
-
         # Set batch processor function
         # idxs can be a list of single element as well
         self._process_batch = (lambda idxs: self.mask_seqs(idxs))
@@ -127,7 +109,15 @@ class MNMTIterator(Iterator):
         # Get an iterator over sample idxs
         if self.batch_size > 1 and self.shuffle_mode == 'trglen':
             # Training
-            self._iter = HomogeneousData(self._seqs, self.batch_size, trg_pos=TTOKENS)
+            self._iter = HomogeneousData(self._seqs, self.batch_size, trg_pos=TTOKENS,
+                                         lengths=self.trg_lens)
+        elif self.batch_size > 1 and self.shuffle_mode == 'bucket':
+            # Length-sorted batches inside shuffled mega-batches
+            self._iter = BucketedData(self._seqs, self.batch_size, trg_pos=TTOKENS,
+                                      src_pos=STOKENS, print_func=self._print,
+                                      lengths=self.trg_lens, src_lengths=self.src_lens,
+                                      n_batches=self.bucket_batches,
+                                      max_pad_ratio=self.bucket_max_pad)
         else:
             # Handles both bsize = 1 and > 1. Test-set mode
             self._idxs = np.arange(self.n_samples)
@@ -136,6 +126,77 @@ class MNMTIterator(Iterator):
                 self._iter.append(self._idxs[i:i + self.batch_size])
             self._iter = iter(self._iter)
 
+    def read_pkl(self):
+        """Unpickle the corpus and numericalize its sentences."""
+        with open(self.pklfile, 'rb') as f:
+            self._print('Loading pkl file...')
+            self._seqs = pickle.load(f)
+
+        # Introspect the pickle by looking the first sample
+        ss = self._seqs[0]
+
+        # we may not have them in pickle or we may not
+        # want to use target sentences by giving its vocab None
+        if ss[TTOKENS] is not None and self.trgdict:
+            self.trg_avail = True
+
+        # Same for source side
+        if ss[STOKENS] is not None and self.srcdict:
+            self.src_avail = True
+
+        # We now have a list of samples
+        self.n_samples = len(self._seqs)
+
+        # Depending on mode, we can have multiple sentences per image so
+        # let's store the number of actual images as well.
+        # n_unique_samples <= n_samples
+        self.n_unique_images = len(set([s[IMGNAME] for s in self._seqs]))
+
+        # Let's map the sentences once to idx's
+        if self.src_avail:
+            self.n_unks_src, self.total_src_words = self.map_sentences(STOKENS, self.srcdict, self.n_words_src)
+        if self.trg_avail:
+            self.n_unks_trg, self.total_trg_words = self.map_sentences(TTOKENS, self.trgdict, self.n_words_trg)
+
+        # Lengths are computed by the samplers
+        self.src_lens, self.trg_lens = None, None
+
+    def read_columnar(self):
+        """Memory-map a columnar corpus and its numericalized sentences."""
+        self._print('Memory-mapping columnar corpus...')
+        corpus = ColumnarCorpus(self.pklfile)
+
+        # we may not have them in corpus or we may not
+        # want to use target sentences by giving its vocab None
+        self.trg_avail = corpus.has_trg and self.trgdict is not None
+        self.src_avail = corpus.has_src and self.srcdict is not None
+
+        src = corpus.sentences('src', self.srcdict, self.n_words_src) if self.src_avail else None
+        trg = corpus.sentences('trg', self.trgdict, self.n_words_trg) if self.trg_avail else None
+        self._seqs = ColumnarSamples(corpus, src, trg)
+        self._print('Done.')
+
+        # We now have a list of samples
+        self.n_samples = len(self._seqs)
+        self.n_unique_images = len(np.unique(corpus.imgid))
+
+        # Statistics and lengths without touching the tokens
+        self.src_lens, self.trg_lens = None, None
+        if self.src_avail:
+            self.src_lens = self._seqs.lengths(0)
+            self.n_unks_src, self.total_src_words = int(self._seqs.n_unks(0).sum()), int(self.src_lens.sum())
+        if self.trg_avail:
+            self.trg_lens = self._seqs.lengths(1)
+            self.n_unks_trg, self.total_trg_words = int(self._seqs.n_unks(1).sum()), int(self.trg_lens.sum())
+
+    def map_sentences(self, pos, vocab, limit):
+        """Numericalize the sentences at pos into views of a compact array."""
+        tokens, offsets, n_unks = numericalize_sents([s[pos] for s in self._seqs],
+                                                     vocab, limit, n_jobs=self.n_jobs)
+        for sample, start, end in zip(self._seqs, offsets[:-1], offsets[1:]):
+            sample[pos] = tokens[start:end]
+        return n_unks, len(tokens)
+
     def mask_seqs(self, idxs):
         """Pad if necessary and return padded batches or single samples."""
         data = []
@@ -148,8 +209,12 @@ class MNMTIterator(Iterator):
 
         # Source image features
         if self.imgfile is not None:
-            x_img = self.img_feats[[b[IMGID] for b in batch], ...]
-            data += [x_img]
+            if self.img_dedup:
+                # n_unique_images x n_feats and bsize idxs into it
+                data += list(self.img_feats.gather_unique([b[IMGID] for b in batch]))
+            else:
+                x_img = self.img_feats.gather([b[IMGID] for b in batch])
+                data += [x_img]
 
         if self.trg_avail:
             data += Iterator.mask_data([b[TTOKENS] for b in batch], get_mask=self.mask)
@@ -157,7 +222,7 @@ class MNMTIterator(Iterator):
         return data
 
     def rewind(self):
-        if self.shuffle_mode != 'trglen':
+        if self.shuffle_mode not in ('trglen', 'bucket'):
             # Handles both bsize = 1 and > 1. Test-set mode
             self._idxs = np.arange(self.n_samples)
             self._iter = []
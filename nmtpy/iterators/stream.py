@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+import random
+
+from ..sysutils   import fopen, listify
+from .iterator    import Iterator
+from .bitext      import BiTextIterator
+
+"""Streaming parallel text iterator for corpora larger than RAM."""
+class StreamingBiTextIterator(BiTextIterator):
+    def __init__(self, batch_size, seed=1234, mask=True, shuffle_mode=None, logger=None, **kwargs):
+        super(StreamingBiTextIterator, self).__init__(batch_size, seed, mask, shuffle_mode, logger, **kwargs)
+
+        # srcfile and trgfile can be lists of aligned (compressed) shards
+        self.srcfiles = listify(self.srcfile)
+        self.trgfiles = listify(self.trgfile)
+        assert len(self.srcfiles) == len(self.trgfiles), "Number of src and trg shards differ"
+
+        # Maximum number of samples kept in memory for shuffling
+        self.buffer_size = kwargs.get('buffer_size', 100000)
+
+        # Number of minibatches that are sorted together by length
+        self.n_batches = kwargs.get('n_batches', 50)
+        self.window = self.batch_size * self.n_batches
+
+        # These are only known after a full pass over the data
+        self.n_samples  = 0
+        self.n_unks_src = 0
+        self.n_unks_trg = 0
+        self._counted   = False
+
+        # Shard order, sampling from the buffer and minibatch order all
+        # follow this RNG so that a pass only depends on the seed
+        self._rng = random.Random(self.seed)
+
+    def read(self):
+        """Nothing is read here, shards are streamed during iteration."""
+        self._print('Streaming from %d shard(s) with a buffer of %d samples' % (len(self.srcfiles), self.buffer_size))
+
+        # Set batch processor function
+        self._process_batch = (lambda batch: self.mask_seqs(batch))
+        self.rewind()
+
+    def __samples(self):
+        """Yields numericalized samples by reading shards one by one."""
+        shard_order = list(range(len(self.srcfiles)))
+        if self.shuffle_mode:
+            # Randomize shard order
+            self._rng.shuffle(shard_order)
+
+        if not self._counted:
+            # Discard the counts of an interrupted pass
+            self.n_unks_src = 0
+            self.n_unks_trg = 0
+
+        n_samples = 0
+        for shard in shard_order:
+            sf = fopen(self.srcfiles[shard], 'r')
+            tf = fopen(self.trgfiles[shard], 'r')
+
+            for sline, tline in zip(sf, tf):
+                sline = sline.strip()
+                tline = tline.strip()
+
+                # Exception if empty line found
+                if sline == "" or tline == "":
+                    continue
+
+                sseq = [self.srcdict.get(w, 1) for w in sline.split(' ')]
+                tseq = [self.trgdict.get(w, 1) for w in tline.split(' ')]
+
+                # if given limit vocabulary
+                if self.n_words_src > 0:
+                    sseq = [w if w < self.n_words_src else 1 for w in sseq]
+
+                # if given limit vocabulary
+                if self.n_words_trg > 0:
+                    tseq = [w if w < self.n_words_trg else 1 for w in tseq]
+
+                if not self._counted:
+                    self.n_unks_src += sseq.count(1)
+                    self.n_unks_trg += tseq.count(1)
+
+                n_samples += 1
+                yield (sseq, tseq)
+
+            sf.close()
+            tf.close()
+
+        # A full pass is done, statistics are now known
+        self.n_samples = n_samples
+        self._counted = True
+
+    def __windows(self, samples):
+        """Yields windows of samples randomly drawn from a bounded buffer."""
+        buf = []
+        exhausted = False
+
+        while True:
+            # Refill the buffer
+            while not exhausted and len(buf) < self.buffer_size:
+                try:
+                    buf.append(next(samples))
+                except StopIteration:
+                    exhausted = True
+
+            if len(buf) == 0:
+                return
+
+            n = min(self.window, len(buf))
+            if self.shuffle_mode:
+                # Draw n random samples by swapping them to the end
+                for i in range(n):
+                    j = self._rng.randrange(len(buf) - i)
+                    buf[j], buf[-1 - i] = buf[-1 - i], buf[j]
+                window = buf[-n:]
+                del buf[-n:]
+            else:
+                # Keep the corpus order
+                window = buf[:n]
+                del buf[:n]
+
+            yield window
+
+    def __batches(self):
+        """Yields minibatches of samples bucketed inside sliding windows."""
+        for window in self.__windows(self.__samples()):
+            if self.shuffle_mode in ('trglen', 'bucket'):
+                # Sort by target length, then by source length
+                window.sort(key=lambda s: (len(s[1]), len(s[0])))
+
+            batches = [window[i:i + self.batch_size] for i in range(0, len(window), self.batch_size)]
+            if self.shuffle_mode:
+                # Randomize minibatch order inside the window
+                self._rng.shuffle(batches)
+
+            for batch in batches:
+                yield batch
+
+    def get_state(self):
+        """Streamed passes can not be restored, they restart from scratch."""
+        return None
+
+    def rewind(self):
+        """Restart streaming from the beginning of the corpus."""
+        self._iter = self.__batches()
+
+    def mask_seqs(self, batch):
+        """Prepares a list of padded tensors with their masks for the given samples."""
+        src, src_mask = Iterator.mask_data([s[0] for s in batch])
+        trg, trg_mask = Iterator.mask_data([s[1] for s in batch])
+        return (src, src_mask, trg, trg_mask)
@@ -3,6 +3,7 @@ import numpy as np
 
 from ..sysutils import fopen
 from .iterator import Iterator
+from .binarized import load_binarized
 
 """Text iterator for monolingual data."""
 class TextIterator(Iterator):
@@ -17,11 +18,31 @@ class TextIterator(Iterator):
         self.__n_words = kwargs.get('n_words', 0)
         self.name = kwargs.get('name', 'x')
 
+        # Optional folder for binarized, memory-mapped corpora
+        self.cache_dir = kwargs.get('cache_dir', None)
+
         self._keys = [self.name]
         if self.mask:
             self._keys.append('%s_mask' % self.name)
 
     def read(self):
+        if self.cache_dir:
+            # Memory-map the binarized corpus, creating it if necessary
+            corpus = load_binarized(self.cache_dir, [self.__file], [self.__dict],
+                                    [self.__n_words], print_func=self._print)
+            seqs = corpus.streams[0]
+        else:
+            seqs = self.read_text()
+
+        self._seqs = seqs
+        self.n_samples = len(self._seqs)
+        self._idxs = np.arange(self.n_samples)
+
+        if not self._minibatches:
+            self.prepare_batches()
+        self.rewind()
+
+    def read_text(self):
         seqs = []
         with fopen(self.__file, 'r') as f:
             for idx, line in enumerate(f):
@@ -41,13 +62,7 @@ class TextIterator(Iterator):
                     # Append the sequence
                     seqs += [seq]
 
-        self._seqs = seqs
-        self.n_samples = len(self._seqs)
-        self._idxs = np.arange(self.n_samples)
-
-        if not self._minibatches:
-            self.prepare_batches()
-        self.rewind()
+        return seqs
 
     def prepare_batches(self):
         self._minibatches = []
@@ -2,14 +2,53 @@
 import pickle
 import numpy as np
 
-from ..nmtutils     import sent_to_idx
+from .binarized     import numericalize_sents
 from .iterator      import Iterator
-from .homogeneous   import HomogeneousData
+from .imgfeats      import ImageFeatures
+from .columnar      import is_columnar, ColumnarCorpus
+from .homogeneous   import HomogeneousData, BucketedData
 
 # This is an iterator specifically to be used by the .pkl
 # corpora files created for WMT16 Shared Task on Multimodal Machine Translation
 # Each element of the list that is pickled is in the following format:
 # [src_split_idx, trg_split_idx, imgid, imgname, src_words, trg_words]
+#
+# The rows of 'all' and 'pairs' modes are combinations of the sentences of
+# splits describing the same image. Each sentence is kept once and samples
+# are virtual idxs over (src_split, trg_split, image) which are decoded
+# arithmetically when a minibatch is assembled. Virtual idxs follow the row
+# order of the files written by 02-prepare.py, i.e. splits first and images
+# inside each split, otherwise the rows' virtual idxs are kept explicitly.
+#
+# pklfile can also be the .json file of a columnar corpus written by
+# columnar.write_columnar() which is memory-mapped instead of unpickled.
+
+class SplitSentences(object):
+    """Numericalized sentences of splits addressed by (split, image) idxs."""
+    def __init__(self, tokens, offsets, slots, n_images, n_splits, sents=None):
+        self.tokens = tokens
+        self.offsets = offsets
+        self.n_images = n_images
+
+        # Sentence idx of each (split, image) slot, -1 if not available
+        # By default, the sentences are in the order of slots
+        self.sent_idxs = np.full(n_splits * n_images, -1, dtype=np.int64)
+        self.sent_idxs[slots] = np.arange(len(slots)) if sents is None else sents
+        if sents is not None:
+            assert (self.sent_idxs[slots] == sents).all(), \
+                    "Different sentences for a (split, image) slot"
+
+    def get(self, split, img):
+        """Returns the sentences for the given split and image idx arrays."""
+        sents = self.sent_idxs[split * self.n_images + img]
+        return [self.tokens[self.offsets[i]:self.offsets[i + 1]] for i in sents]
+
+    def stats(self, split, img):
+        """Returns the lengths and the number of UNKs of the given sentences."""
+        sents = self.sent_idxs[split * self.n_images + img]
+        n_unks = np.concatenate(([0], np.cumsum(self.tokens == 1)))
+        n_unks = n_unks[self.offsets[1:]] - n_unks[self.offsets[:-1]]
+        return np.diff(self.offsets)[sents], n_unks[sents]
 
 class WMTIterator(Iterator):
     def __init__(self, batch_size, seed=1234, mask=True, shuffle_mode=None, logger=None, **kwargs):
@@ -24,6 +63,11 @@ class WMTIterator(Iterator):
         self.n_words_src = kwargs.get('n_words_src', 0)
         self.n_words_trg = kwargs.get('n_words_trg', 0)
 
+        # Number of minibatches sorted together and maximum padding ratio
+        # of a minibatch for the 'bucket' shuffle mode
+        self.bucket_batches = kwargs.get('bucket_batches', 50)
+        self.bucket_max_pad = kwargs.get('bucket_max_pad', 0.2)
+
         # How do we refer to symbolic data variables?
         self.src_name = kwargs.get('src_name', 'x')
         self.trg_name = kwargs.get('trg_name', 'y')
@@ -36,10 +80,21 @@ class WMTIterator(Iterator):
 
         # pkl file which contains a list of samples
         self.pklfile = kwargs['pklfile']
+
+        # Number of processes for numericalizing the corpora
+        self.n_jobs = kwargs.get('n_jobs', 1)
+
         # Resnet-50 image features file
         self.imgfile = kwargs.get('imgfile', None)
         self.img_avail = self.imgfile is not None
 
+        # Number of hot images to keep in memory
+        self.img_cache = kwargs.get('img_cache', 0)
+
+        # Feed the unique images of a minibatch along with the idxs of
+        # samples into them (not for single samples, i.e. translation)
+        self.img_dedup = kwargs.get('img_dedup', False) and self.batch_size > 1
+
         self.trg_avail = False
 
         # Source word dictionary and short-list limit
@@ -60,6 +115,8 @@ class WMTIterator(Iterator):
         # We have images in the middle
         if self.imgfile:
             self._keys.append("%s_img" % self.src_name)
+            if self.img_dedup:
+                self._keys.append("%s_img_idx" % self.src_name)
 
         # Target may not be available during validation
         if self.trgdict:
@@ -70,60 +127,96 @@ class WMTIterator(Iterator):
     def read(self):
         # Load image features file if any
         if self.img_avail:
-            self._print('Loading image file...')
-            self.img_feats = np.load(self.imgfile)
+            self._print('Memory-mapping image file...')
+            self.img_feats = ImageFeatures(self.imgfile, cache_size=self.img_cache)
             self._print('Done.')
 
-        # Load the corpora
-        with open(self.pklfile, 'rb') as f:
-            self._print('Loading pkl file...')
-            self._seqs = pickle.load(f)
-            self._print('Done.')
+        # Load the corpora, missing split idxs are -1
+        rows, corpus = None, None
+        if is_columnar(self.pklfile):
+            self._print('Memory-mapping columnar corpus...')
+            corpus = ColumnarCorpus(self.pklfile)
+            ssplit = corpus.ssplit.astype(np.int64)
+            tsplit = corpus.tsplit.astype(np.int64)
+            imgid  = corpus.imgid.astype(np.int64)
+            has_trg = corpus.has_trg
+        else:
+            with open(self.pklfile, 'rb') as f:
+                self._print('Loading pkl file...')
+                rows = pickle.load(f)
+            ssplit = np.array([-1 if s[0] is None else s[0] for s in rows], dtype=np.int64)
+            tsplit = np.array([-1 if s[1] is None else s[1] for s in rows], dtype=np.int64)
+            imgid  = np.array([s[2] for s in rows], dtype=np.int64)
+            has_trg = rows[0][5] is not None
+        self._print('Done.')
 
         # Check for what is available
-        ss = self._seqs[0]
+        has_tsplit = tsplit[0] >= 0
         # If no split idxs are found, its Task 1, set mode to 'all'
-        if ss[0] is None and ss[1] is None:
+        if ssplit[0] < 0 and not has_tsplit:
             self.mode = 'all'
 
-        if ss[5] is not None and self.trgdict:
+        if has_trg and self.trgdict:
             self.trg_avail = True
 
+        # Missing split idxs are taken as 0
+        ssplit = np.maximum(ssplit, 0)
+        tsplit = np.maximum(tsplit, 0)
+
+        # Keep a single copy of each split's sentences
+        self.n_images = int(imgid.max()) + 1
+        self.n_ssplits = int(ssplit.max()) + 1
+        self.n_tsplits = int(tsplit.max()) + 1
+        if corpus is not None:
+            self.src_sents = self.map_columnar(corpus, 'src', ssplit, imgid, self.srcdict, self.n_words_src)
+            if self.trg_avail:
+                self.trg_sents = self.map_columnar(corpus, 'trg', tsplit, imgid, self.trgdict, self.n_words_trg)
+        else:
+            self.src_sents = self.map_sentences(rows, 4, ssplit, imgid, self.srcdict, self.n_words_src)
+            if self.trg_avail:
+                self.trg_sents = self.map_sentences(rows, 5, tsplit, imgid, self.trgdict, self.n_words_trg)
+
         if self.mode == 'single':
             # Just take the first src-trg pair. Useful for validation
-            if ss[1] is not None:
-                self._seqs = [s for s in self._seqs if (s[0] == s[1] == 0)]
-            else:
-                self._seqs = [s for s in self._seqs if (s[0] == 0)]
-
-        elif ss[1] is not None and self.mode == 'pairs':
+            keep = (ssplit == 0) & (tsplit == 0)
+        elif has_tsplit and self.mode == 'pairs':
             # Take the pairs with split idx's equal
-            self._seqs = [s for s in self._seqs if s[0] == s[1]]
+            keep = (ssplit == tsplit)
+        else:
+            self.mode = 'all'
+            keep = np.ones(len(imgid), dtype=bool)
+
+        # Samples are virtual idxs over (src_split, trg_split, image) in row
+        # order. Explicit idxs are only kept if some combinations were
+        # filtered or if the rows are not in the order of virtual idxs.
+        vidxs = self.encode(imgid[keep], ssplit[keep], tsplit[keep])
+        assert len(np.unique(vidxs)) == len(vidxs), \
+                "%s has duplicate (split, image) samples" % self.pklfile
+        if len(vidxs) == self.n_virtual() and (vidxs == np.arange(len(vidxs))).all():
+            self._vidxs = None
+        else:
+            self._vidxs = vidxs
+        del rows, corpus
+
+        # We now have the number of samples
+        self.n_samples = len(vidxs)
 
-        # We now have a list of samples
-        self.n_samples = len(self._seqs)
+        # Decode all samples once for statistics and length indices
+        img, src, trg = self.decode(np.arange(self.n_samples))
 
         # Depending on mode, we can have multiple sentences per image so
         # let's store the number of actual images as well.
         # n_unique_samples <= n_samples
-        self.n_unique_images = len(set([s[3] for s in self._seqs]))
-
-        # Some statistics
-        total_src_words = []
-        total_trg_words = []
-
-        # Let's map the sentences once to idx's
-        for sample in self._seqs:
-            sample[4] = sent_to_idx(self.srcdict, sample[4], self.n_words_src)
-            total_src_words.extend(sample[4])
-            if self.trg_avail:
-                sample[5] = sent_to_idx(self.trgdict, sample[5], self.n_words_trg)
-                total_trg_words.extend(sample[5])
+        self.n_unique_images = len(np.unique(img))
 
-        self.unk_src = total_src_words.count(1)
-        self.unk_trg = total_trg_words.count(1)
-        self.total_src_words = len(total_src_words)
-        self.total_trg_words = len(total_trg_words)
+        # Source/target statistics over samples
+        src_lens, src_unks = self.src_sents.stats(src, img)
+        self.unk_src, self.total_src_words = int(src_unks.sum()), int(src_lens.sum())
+        self.unk_trg, self.total_trg_words = 0, 0
+        trg_lens = None
+        if self.trg_avail:
+            trg_lens, trg_unks = self.trg_sents.stats(trg, img)
+            self.unk_trg, self.total_trg_words = int(trg_unks.sum()), int(trg_lens.sum())
 
         #########################
         # Prepare iteration stuff
@@ -137,7 +230,14 @@ class WMTIterator(Iterator):
         if self.shuffle_mode == 'trglen':
             # Homogeneous batches ordered by target sequence length
             # Get an iterator over sample idxs
-            self._iter = HomogeneousData(self._seqs, self.batch_size, trg_pos=5)
+            self._iter = HomogeneousData(self, self.batch_size, trg_pos=5, lengths=trg_lens)
+        elif self.shuffle_mode == 'bucket':
+            # Length-sorted batches inside shuffled mega-batches
+            self._iter = BucketedData(self, self.batch_size, trg_pos=5,
+                                      src_pos=4, print_func=self._print,
+                                      lengths=trg_lens, src_lengths=src_lens,
+                                      n_batches=self.bucket_batches,
+                                      max_pad_ratio=self.bucket_max_pad)
         else:
             # For once keep it ordered
             self._idxs = np.arange(self.n_samples).tolist()
@@ -146,35 +246,90 @@ class WMTIterator(Iterator):
                 self._iter.append(self._idxs[i:i + self.batch_size])
             self._iter = iter(self._iter)
 
+    def n_virtual(self):
+        """Returns the size of the virtual sample space of the mode."""
+        if self.mode == 'single':
+            return self.n_images
+        elif self.mode == 'pairs':
+            return self.n_images * self.n_ssplits
+        return self.n_images * self.n_ssplits * self.n_tsplits
+
+    def encode(self, img, src, trg):
+        """Maps (image, src_split, trg_split) arrays to virtual idxs."""
+        if self.mode == 'single':
+            return img
+        elif self.mode == 'pairs':
+            return src * self.n_images + img
+        return (src * self.n_tsplits + trg) * self.n_images + img
+
+    def decode(self, idxs):
+        """Maps sample idxs to (image, src_split, trg_split) arrays."""
+        vidxs = np.asarray(idxs, dtype=np.int64)
+        if self._vidxs is not None:
+            vidxs = self._vidxs[vidxs]
+
+        if self.mode == 'single':
+            zeros = np.zeros_like(vidxs)
+            return vidxs, zeros, zeros
+        elif self.mode == 'pairs':
+            split = vidxs // self.n_images
+            return vidxs % self.n_images, split, split
+
+        splits = vidxs // self.n_images
+        return vidxs % self.n_images, splits // self.n_tsplits, splits % self.n_tsplits
+
+    def map_sentences(self, rows, pos, split, imgid, vocab, limit):
+        """Numericalize each (split, image) sentence once into a compact array.
+        Rows sharing a slot, e.g. the combinations of a sentence with the
+        sentences of the other side's splits, should have the same sentence."""
+        slots = split * self.n_images + imgid
+        uniq, first, inverse = np.unique(slots, return_index=True, return_inverse=True)
+        for i, j in enumerate(first[inverse]):
+            assert rows[i][pos] == rows[j][pos], \
+                    "%s has different sentences for a (split, image) slot" % self.pklfile
+        tokens, offsets, _ = numericalize_sents([rows[i][pos] for i in first],
+                                                vocab, limit, n_jobs=self.n_jobs)
+        return SplitSentences(tokens, offsets, uniq, self.n_images, split.max() + 1)
+
+    def map_columnar(self, corpus, side, split, imgid, vocab, limit):
+        """Map the unique sentences of a columnar corpus to (split, image) slots."""
+        tokens, offsets, sents = corpus.sentences(side, vocab, limit)
+        return SplitSentences(tokens, offsets, split * self.n_images + imgid,
+                              self.n_images, split.max() + 1, sents=sents)
+
     def process_single(self, idx):
-        data, _ = Iterator.mask_data([self._seqs[idx][4]])
+        img, src, trg = self.decode([idx])
+        data, _ = Iterator.mask_data(self.src_sents.get(src, img))
         data = [data]
         if self.img_avail:
             # Do this 196 x 1024
-            data += [self.img_feats[self._seqs[idx][2]][:, None, :]]
+            data += [self.img_feats.gather(img, time_major=True)]
         if self.trg_avail:
-            trg, _ = Iterator.mask_data([self._seqs[idx][5]])
+            trg, _ = Iterator.mask_data(self.trg_sents.get(trg, img))
             data.append(trg)
         return data
 
     def mask_seqs(self, idxs):
         """Prepares a list of padded tensors with their masks for the given sample idxs."""
-        data = list(Iterator.mask_data([self._seqs[i][4] for i in idxs]))
+        img, src, trg = self.decode(idxs)
+        data = list(Iterator.mask_data(self.src_sents.get(src, img)))
         # Source image features
         if self.img_avail:
-            img_idxs = [self._seqs[i][2] for i in idxs]
-
-            # Do this 196 x bsize x 1024
-            x_img = self.img_feats[img_idxs].transpose(1, 0, 2)
-            data += [x_img]
+            if self.img_dedup:
+                # 196 x n_unique_images x 1024 and bsize idxs into it
+                data += list(self.img_feats.gather_unique(img, time_major=True))
+            else:
+                # Do this 196 x bsize x 1024
+                x_img = self.img_feats.gather(img, time_major=True)
+                data += [x_img]
 
         if self.trg_avail:
-            data += list(Iterator.mask_data([self._seqs[i][5] for i in idxs]))
+            data += list(Iterator.mask_data(self.trg_sents.get(trg, img)))
 
         return data
 
     def rewind(self):
-        if self.shuffle_mode != 'trglen':
+        if self.shuffle_mode not in ('trglen', 'bucket'):
             # Fill in the _idxs list for sample order
             if self.shuffle_mode == 'simple':
                 # Simple shuffle
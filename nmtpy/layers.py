@@ -33,6 +33,8 @@ def get_new_layer(name):
                 'conv'              : ('param_init_conv'        , 'conv_layer'),
                 # Feedforward Layer
                 'ff'                : ('param_init_fflayer'     , 'fflayer'),
+                # Adaptive softmax output layer
+                'adaptive_softmax'  : ('param_init_adaptive_softmax', 'adaptive_softmax_layer'),
                 # GRU
                 'gru'               : ('param_init_gru'         , 'gru_layer'),
                 # Conditional GRU
@@ -209,6 +211,58 @@ def hiwaylayer(tparams, x, prefix='hw', activ='tanh'):
 
     return out
 
+#####################################################################
+# Adaptive softmax (Grave et al., 2017)
+# https://arxiv.org/abs/1609.04309
+# The vocabulary should be sorted by decreasing frequency which is the
+# case for nmt-build-dict vocabularies. The head predicts the cutoffs[0]
+# most frequent words and a token for each tail cluster of words in
+# [cutoffs[i], cutoffs[i+1]). Tail clusters are predicted from a
+# projection of the input whose size is divided by div for each cluster.
+#####################################################################
+def param_init_adaptive_softmax(params, nin, n_words, cutoffs, div=4, scale=0.01, prefix='adasoft'):
+    bounds = list(cutoffs) + [n_words]
+    params = param_init_fflayer(params, nin, cutoffs[0] + len(cutoffs), scale=scale, ortho=False, prefix=pp(prefix, 'head'))
+
+    for i in range(len(cutoffs)):
+        dim = max(nin // (div ** (i + 1)), 1)
+        params[pp(prefix, 'P%d' % i)] = norm_weight(nin, dim, scale=scale, ortho=False)
+        params = param_init_fflayer(params, dim, bounds[i + 1] - bounds[i], scale=scale, ortho=False, prefix=pp(prefix, 'tail%d' % i))
+
+    return params
+
+def adaptive_softmax_layer(tparams, state_below, n_words, cutoffs, prefix='adasoft', targets=None):
+    """state_below is a matrix of n_rows x nin. Returns the log-probabilities
+    of the whole vocabulary for each row or if a vector of targets is given,
+    the negative log-likelihoods of the targets, computing the tail clusters
+    only for the rows whose targets belong to them."""
+    bounds = list(cutoffs) + [n_words]
+    head = tensor.nnet.logsoftmax(fflayer(tparams, state_below, prefix=pp(prefix, 'head'), activ='linear'))
+
+    def tail(i, x):
+        proj = tensor.dot(x, tparams[pp(prefix, 'P%d' % i)])
+        return tensor.nnet.logsoftmax(fflayer(tparams, proj, prefix=pp(prefix, 'tail%d' % i), activ='linear'))
+
+    if targets is None:
+        log_probs = [head[:, :cutoffs[0]]]
+        for i in range(len(cutoffs)):
+            log_probs.append(head[:, cutoffs[0] + i][:, None] + tail(i, state_below))
+        return tensor.concatenate(log_probs, axis=1)
+
+    # Head output of each target: the word itself or its cluster token
+    head_idxs = targets
+    for i in range(len(cutoffs)):
+        head_idxs = tensor.switch(targets >= bounds[i], cutoffs[0] + i, head_idxs)
+
+    cost = -head[tensor.arange(targets.shape[0]), head_idxs]
+
+    for i in range(len(cutoffs)):
+        rows = tensor.nonzero((targets >= bounds[i]) & (targets < bounds[i + 1]))[0]
+        log_probs = tail(i, state_below[rows])
+        cost = tensor.inc_subtensor(cost[rows], -log_probs[tensor.arange(rows.shape[0]), targets[rows] - bounds[i]])
+
+    return cost
+
 ###########
 # GRU layer
 ###########
@@ -15,7 +15,7 @@ class Logger(object):
     def __init__(self):
         pass
 
-    def setup(self, log_file=None, timestamp=True):
+    def setup(self, log_file=None, timestamp=True, append=False):
         _format = '%(message)s'
         if timestamp:
             _format = '%(asctime)s ' + _format
@@ -28,7 +28,8 @@ class Logger(object):
         self._logger.addHandler(self._ch)
 
         if log_file:
-            self._fh = logging.FileHandler(log_file, mode='w')
+            # Resumed trainings continue their log file
+            self._fh = logging.FileHandler(log_file, mode='a' if append else 'w')
             self._fh.setFormatter(self.formatter)
             self._logger.addHandler(self._fh)
 
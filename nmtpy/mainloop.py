@@ -4,26 +4,40 @@ from shutil import copy
 
 from nmtpy.metrics import is_last_best, find_best, comparators
 from nmtpy.sysutils import force_symlink
+from nmtpy.snapshot import pack_snapshot, CheckpointWriter
+from nmtpy.schedulers import get_scheduler
+from nmtpy.parallel import TrainingStopped
+from nmtpy.throughput import Throughput
+from nmtpy.statsink import StatsWriter, get_rss
 
 import numpy as np
+import random
 import time
 import os
 
 class MainLoop(object):
-    def __init__(self, model, logger, train_args):
+    def __init__(self, model, logger, train_args, comm=None, averager=None):
         self.model          = model                         # The model instance that is trained
         self.__log          = logger                        # logger instance
 
+        # Data-parallel training, only rank 0 validates and saves
+        self.comm           = comm                          # SharedAllReduce instance or None
+        self.averager       = averager                      # AveragingClient instance or None
+        self.f_average      = train_args.avg_freq           # Average parameters across nodes each 'f_average' updates
+        self.rank           = comm.rank if comm else (averager.rank if averager else 0)
+
         # Counters
         self.uctr           = 0                             # update ctr
         self.ectr           = 0                             # epoch ctr
         self.vctr           = 0                             # validation ctr
         self.early_bad      = 0                             # early-stop counter
 
-        self.f_snapshot     = train_args.snapshot_freq      # TODO: Modify this for periodic saving
+        self.f_snapshot     = train_args.snapshot_freq      # Save a resumable snapshot each 'f_snapshot' updates
         self.save_best_n    = train_args.save_best_n        # Keep N best validation models on disk
         self.max_updates    = train_args.max_iteration      # Training stops if uctr hits 'max_updates'
         self.max_epochs     = train_args.max_epochs         # Training stops if ectr hits 'max_epochs'
+        self.accum_steps    = train_args.grad_accum         # Number of minibatches per update
+        self.__n_accum      = 0                             # Minibatches accumulated for the next update
 
         # Validation related parameters
         self.patience       = train_args.patience           # Stop training if no improvement after this validations
@@ -37,6 +51,28 @@ class MainLoop(object):
         self.f_verbose      = train_args.disp_freq          # Print frequency
 
         self.epoch_losses   = []
+        self.batch_losses   = []                            # Losses of the current epoch
+
+        # Tokens/sec, padding efficiency and time spent in each phase
+        self.throughput     = Throughput()
+
+        # Learning rate scheduler
+        self.lr_scheduler   = None
+        if train_args.lr_decay:
+            self.lr_scheduler = get_scheduler(train_args.lr_decay)(self.model.lrate,
+                                                                   warmup=train_args.lr_warmup,
+                                                                   factor=train_args.lr_decay_factor,
+                                                                   decay_freq=train_args.lr_decay_freq,
+                                                                   patience=train_args.lr_patience,
+                                                                   min_lr=train_args.lr_min,
+                                                                   min_delta=train_args.patience_delta)
+
+        # Resumable snapshot of the training
+        self.snapshot_file  = '%s.snapshot.npz' % self.model.save_path
+        self.__resumed      = False                         # Continue the epoch of the snapshot
+
+        # Checkpoints and snapshots are written in the background
+        self.__writer       = CheckpointWriter()
 
         # Multiple comma separated metrics are supported
         # Each key is a metric name, values are metrics so far.
@@ -67,29 +103,19 @@ class MainLoop(object):
             # Best N checkpoint saver
             self.best_models = []
 
-        # FIXME: Disable TB support for now
-        self.__tb = None
-        ####################
-        ## Tensorboard setup
-        ####################
-#        try:
-            #from tensorboard import SummaryWriter
-        #except ImportError as ie:
-            #self.__tb = None
-        #else:
-            ## FIXME: This should be a global folder with subfolder
-            ## for each training so that we can follow many systems on TB
-            #self.__print('Will log training progress to TensorBoard')
-            #self.__tb = SummaryWriter(os.path.dirname(self.model.save_path))
-
-    def __send_stats(self, step, **kwargs):
-        """Send statistics to TensorBoard."""
-        if self.__tb:
+        # Training statistics as JSON lines and/or CSV files
+        self.__stats = None
+        if train_args.stats_sink and self.rank == 0:
+            self.__stats = StatsWriter(self.model.save_path, train_args.stats_sink.split(','))
+
+    def __send_stats(self, kind, step, **kwargs):
+        """Send statistics to the stats sinks."""
+        if self.__stats:
             for name, value in kwargs.items():
                 if isinstance(value, tuple):
                     # Metric tuple, pass float value
-                    value = value[-1]
-                self.__tb.add_scalar(name, value, global_step=step)
+                    kwargs[name] = value[-1]
+            self.__stats.add(kind, step, **kwargs)
 
     def __print(self, msg, footer=False):
         """Pretty prints message with optional separator."""
@@ -107,19 +133,25 @@ class MainLoop(object):
             cur_fname = "%s-val%3.3d-%s_%.3f.npz" % (self.model.save_path, self.vctr, self.early_metric, cur_score)
 
             # Stack is empty, save the model whatsoever
+            prune_fname = None
             if len(self.best_models) < self.save_best_n:
                 self.best_models.append((cur_score, cur_fname))
 
             # Stack is full, replace the worst model
             else:
-                os.unlink(self.best_models[self.next_prune_idx][1])
+                prune_fname = self.best_models[self.next_prune_idx][1]
                 self.best_models[self.next_prune_idx] = (cur_score, cur_fname)
 
-            self.__print('Saving model with best validation %s' % self.early_metric.upper())
-            self.model.save(cur_fname)
+            def on_saved():
+                # Create a .BEST symlink once the file is complete
+                force_symlink(cur_fname, ('%s.BEST.npz' % self.model.save_path), relative=True)
+                if prune_fname:
+                    os.unlink(prune_fname)
 
-            # Create a .BEST symlink
-            force_symlink(cur_fname, ('%s.BEST.npz' % self.model.save_path), relative=True)
+            self.__print('Saving model with best validation %s' % self.early_metric.upper())
+            with self.throughput.timer('io'):
+                self.__writer.write(cur_fname, self.model.get_save_dict(borrow=True),
+                                    kind='model', callback=on_saved)
 
             # In the next best, we'll remove the following idx from the list/disk
             # Metric specific comparator stuff
@@ -127,32 +159,167 @@ class MainLoop(object):
             self.next_prune_idx = sorted(range(len(self.best_models)),
                                          key=self.best_models.__getitem__)[where]
 
+    def __save_snapshot(self):
+        """Saves a snapshot to resume training from the current update."""
+        state = {
+                'uctr'          : self.uctr,
+                'ectr'          : self.ectr,
+                'vctr'          : self.vctr,
+                'early_bad'     : self.early_bad,
+                'epoch_losses'  : self.epoch_losses,
+                'batch_losses'  : self.batch_losses,
+                'valid_metrics' : self.valid_metrics,
+                'best_models'   : getattr(self, 'best_models', []),
+                'next_prune_idx': getattr(self, 'next_prune_idx', 0),
+                'np_rng'        : np.random.get_state(),
+                'py_rng'        : random.getstate(),
+                'lrate'         : self.model.get_lrate(),
+                'lr_scheduler'  : self.lr_scheduler.get_state() if self.lr_scheduler else None,
+                }
+
+        start = time.time()
+        params = self.model.get_save_dict(borrow=True)
+        opts = params.pop('opts')
+        arrays = pack_snapshot(opts, state, params, self.model.get_opt_history(borrow=True),
+                               self.model.get_trng_state(), self.model.train_iterator.get_state())
+        self.__writer.write(self.snapshot_file, arrays, kind='snapshot')
+        self.throughput.add_time('io', time.time() - start)
+        self.__print('Saving snapshot at update %d (blocked for %.2f seconds)' % (self.uctr, time.time() - start))
+
+    def resume(self, snapshot):
+        """Restores the training state from a snapshot returned by load_snapshot().
+        Parameters and optimizer history are restored before building the optimizer."""
+        state = snapshot['state']
+        self.uctr           = state['uctr']
+        self.ectr           = state['ectr']
+        self.vctr           = state['vctr']
+        self.early_bad      = state['early_bad']
+        self.epoch_losses   = state['epoch_losses']
+        self.batch_losses   = state['batch_losses']
+        self.valid_metrics  = state['valid_metrics']
+        self.best_models    = state['best_models']
+        self.next_prune_idx = state['next_prune_idx']
+
+        self.model.update_lrate(state['lrate'])
+        if self.lr_scheduler and state.get('lr_scheduler') is not None:
+            self.lr_scheduler.set_state(state['lr_scheduler'])
+        self.model.set_trng_state(snapshot['trng_state'])
+
+        if snapshot['iter_state'] is None:
+            # The interrupted epoch will start over
+            self.__print('Training iterator can not be restored, epoch %d will restart' % self.ectr)
+            self.ectr -= 1
+        else:
+            # Continue the interrupted epoch
+            self.model.train_iterator.set_state(snapshot['iter_state'])
+            self.__resumed = True
+
+        # Restore the RNGs last as restoring the iterator may use them
+        np.random.set_state(state['np_rng'])
+        random.setstate(state['py_rng'])
+
+        self.__print('Resuming from update %d (epoch %d, validation %d)' % (self.uctr, self.ectr, self.vctr))
+
     def __update_lrate(self):
         """Update learning rate by annealing it."""
-        pass
+        if self.lr_scheduler:
+            lrate = self.lr_scheduler.get_lrate(self.uctr)
+            if lrate != self.model.get_lrate():
+                self.model.update_lrate(lrate)
+
+    def __all_reduce(self):
+        """Sums the accumulated gradients of all workers and takes the
+        learning rate of rank 0. Returns False if rank 0 stopped training."""
+        grads = self.model.get_accum_grads()
+        try:
+            with self.throughput.timer('sync'):
+                lrate = self.comm.all_reduce(grads, self.model.get_lrate())
+        except TrainingStopped:
+            return False
+
+        self.model.set_accum_grads(grads)
+        if self.rank > 0:
+            self.__follow_lrate(lrate)
+        return True
+
+    def __follow_lrate(self, lrate):
+        """Applies the learning rate of rank 0 on the other workers."""
+        if self.lr_scheduler:
+            # Keep validation-driven decays across the next updates
+            self.lr_scheduler.follow(lrate)
+        if lrate != self.model.get_lrate():
+            self.model.update_lrate(lrate)
+
+    def __average(self, broadcast=False):
+        """Replaces the parameters with their averages over all nodes, or
+        with the ones of rank 0 if broadcast is True, and takes the learning
+        rate of rank 0. Returns False if rank 0 stopped training."""
+        with self.throughput.timer('sync'):
+            params = self.model.get_save_dict(borrow=True)
+            params.pop('opts')
+            lrate = self.model.get_lrate() if self.rank == 0 else None
+            if not self.averager.average(list(params.values()), lrate, broadcast):
+                self.__print('Training stopped by rank 0')
+                return False
+
+            self.model.update_shared_variables(params)
+
+        if self.rank > 0 and self.averager.lrate is not None:
+            self.__follow_lrate(self.averager.lrate)
+        self.__print('%s round %d: send %.3f sec, wait %.3f sec, receive %.3f sec' % (
+                     ('Broadcast' if broadcast else 'Averaging', self.averager.round) + self.averager.timings))
+        return True
 
     def __train_epoch(self):
         """Train a full epoch."""
-        self.ectr += 1
+        if self.__resumed:
+            self.__resumed = False
+            self.__print('Resuming Epoch %d' % self.ectr, True)
+        else:
+            self.ectr += 1
+            self.batch_losses = []
+            self.__print('Starting Epoch %d' % self.ectr, True)
 
         start = time.time()
         start_uctr = self.uctr
-        self.__print('Starting Epoch %d' % self.ectr, True)
-
-        batch_losses = []
+        batch_losses = self.batch_losses
+        self.throughput.new_epoch()
 
         # Iterate over batches
-        for data in self.model.train_iterator:
-            self.uctr += 1
+        for data in self.throughput.timed(self.model.train_iterator):
+            self.throughput.add_batch(data)
 
             # Forward/backward and get loss
-            loss = self.model.train_batch(*list(data.values()))
+            with self.throughput.timer('train'):
+                loss = self.model.train_batch(*list(data.values()))
             batch_losses.append(loss)
-            self.__send_stats(self.uctr, train_loss=loss)
+
+            if self.accum_steps > 1 or self.comm:
+                # Update once every accum_steps minibatches, leftovers
+                # of an epoch are carried over to the next one
+                self.__n_accum += 1
+                if self.__n_accum < self.accum_steps:
+                    continue
+                self.__n_accum = 0
+                if self.comm and not self.__all_reduce():
+                    return False
+                with self.throughput.timer('train'):
+                    self.model.apply_grads()
+
+            self.uctr += 1
+            self.__send_stats('update', self.uctr, loss=loss, lrate=self.model.get_lrate())
 
             # Verbose
             if self.uctr % self.f_verbose == 0:
-                self.__print("Epoch: %6d, update: %7d, cost: %10.6f" % (self.ectr, self.uctr, loss))
+                msg = "Epoch: %6d, update: %7d, cost: %10.6f" % (self.ectr, self.uctr, loss)
+                if self.lr_scheduler:
+                    msg += ", lrate: %.3e" % self.model.get_lrate()
+                self.__print(msg)
+                stats = self.throughput.interval.summary()
+                for line in self.throughput.format(stats):
+                    self.__print('  %s' % line)
+                self.__send_stats('interval', self.uctr, epoch=self.ectr, rss=get_rss(), **stats)
+                self.throughput.new_interval()
 
             # Should we stop
             if self.uctr == self.max_updates:
@@ -162,13 +329,29 @@ class MainLoop(object):
             # Update learning rate if requested
             self.__update_lrate()
 
+            # Average parameters across nodes
+            if self.averager and self.uctr % self.f_average == 0 and not self.__average():
+                return False
+
+            # Other workers follow rank 0
+            if self.rank > 0:
+                continue
+
             # Do validation
             if not self.epoch_valid and self.f_valid > 0 and self.uctr % self.f_valid == 0:
                 self.__do_validation()
 
+            # Save a resumable snapshot
+            if self.f_snapshot > 0 and self.uctr % self.f_snapshot == 0:
+                self.__save_snapshot()
+
             # Check stopping conditions
             if self.early_bad == self.patience:
                 self.__print("Early stopped.")
+                if self.comm:
+                    self.comm.stop()
+                if self.averager:
+                    self.averager.stop()
                 return False
 
         # An epoch is finished
@@ -179,7 +362,7 @@ class MainLoop(object):
         self.__dump_epoch_summary(batch_losses, epoch_time, up_ctr)
 
         # Do validation
-        if self.epoch_valid:
+        if self.epoch_valid and self.rank == 0:
             self.__do_validation()
 
         # Check whether maximum epoch is reached
@@ -196,7 +379,8 @@ class MainLoop(object):
 
             # Compute validation loss
             self.model.set_dropout(False)
-            cur_loss = self.model.val_loss()
+            with self.throughput.timer('valid'):
+                cur_loss = self.model.val_loss()
             self.model.set_dropout(True)
 
             # Add val_loss
@@ -217,19 +401,24 @@ class MainLoop(object):
                     f_valid_out = "{0}.{1:03d}".format(self.valid_save_prefix, self.vctr)
 
                 self.__print('Calling beam-search process')
-                beam_time = time.time()
+                beam_time, timings = time.time(), {}
                 beam_results = self.model.run_beam_search(beam_size=self.beam_size,
                                                           n_jobs=self.njobs,
                                                           metric=self.beam_metrics,
-                                                          f_valid_out=f_valid_out)
+                                                          f_valid_out=f_valid_out,
+                                                          timings=timings)
                 beam_time = time.time() - beam_time
                 self.__print('Beam-search ended, took %.5f minutes.' % (beam_time / 60.))
 
+                # nmt-translate reports the time spent for computing metrics
+                scoring_time = timings.get('scoring', 0.)
+                self.throughput.add_time('beam', beam_time - scoring_time)
+                self.throughput.add_time('scoring', scoring_time)
+
                 if beam_results:
                     # beam_results: {name: (metric_str, metric_float)}
                     # names are as defined in metrics/*.py like BLEU, METEOR
                     # but we use lowercase names in conf files.
-                    self.__send_stats(self.vctr, **beam_results)
                     for name, (metric_str, metric_value) in beam_results.items():
                         self.__print("Validation %2d - %s" % (self.vctr, metric_str))
                         self.valid_metrics[name.lower()].append(metric_value)
@@ -247,6 +436,14 @@ class MainLoop(object):
                 self.early_bad += 1
                 self.__print("Early stopping patience: %d validation left" % (self.patience - self.early_bad))
 
+            # Let the scheduler decay the lrate based on validation history
+            if self.lr_scheduler and self.lr_scheduler.on_validation(self.early_metric,
+                                                                     self.valid_metrics[self.early_metric]):
+                self.__update_lrate()
+                self.__print("Learning rate decayed to %.3e" % self.model.get_lrate())
+
+            self.__send_stats('valid', self.vctr, update=self.uctr, epoch=self.ectr,
+                              **{m: h[-1] for m, h in self.valid_metrics.items() if h})
             self.__dump_val_summary()
 
     def __dump_val_summary(self):
@@ -267,23 +464,44 @@ class MainLoop(object):
 
     def __dump_epoch_summary(self, losses, epoch_time, up_ctr):
         """Print epoch summary."""
-        update_time = epoch_time / float(up_ctr)
+        # A resumed epoch may have no updates left
+        update_time = epoch_time / float(max(up_ctr, 1))
         mean_loss = np.array(losses).mean()
         self.epoch_losses.append(mean_loss)
 
         self.__print("--> Epoch %d finished with mean loss %.5f (PPL: %4.5f)" % (self.ectr, mean_loss, np.exp(mean_loss)))
         self.__print("--> Epoch took %.3f minutes, %.3f sec/update" % ((epoch_time / 60.0), update_time))
+        stats = self.throughput.epoch.summary()
+        for line in self.throughput.format(stats):
+            self.__print("--> Epoch %s" % line)
+        self.__send_stats('epoch', self.ectr, update=self.uctr, loss=mean_loss,
+                          sec_update=update_time, rss=get_rss(), **stats)
 
     def run(self):
         """Run training loop."""
         self.model.set_dropout(True)
-        while self.__train_epoch():
-            pass
 
-        # Final summary
-        if self.f_valid >= 0:
-            self.__dump_val_summary()
-        else:
-            # No validation data used, save the final model
-            self.__print('Saving final model.')
-            self.model.save("%s.npz" % self.model.save_path)
+        # Set the learning rate of the first (or resumed) update
+        self.__update_lrate()
+
+        # Start every node from the parameters of rank 0
+        if self.averager is None or self.__average(broadcast=True):
+            while self.__train_epoch():
+                pass
+
+        if self.averager:
+            self.averager.close()
+
+        # Final summary, replicas of other workers are identical
+        if self.rank == 0:
+            if self.f_valid >= 0:
+                self.__dump_val_summary()
+            else:
+                # No validation data used, save the final model
+                self.__print('Saving final model.')
+                self.__writer.write("%s.npz" % self.model.save_path, self.model.get_save_dict(borrow=True))
+
+        # Wait for the checkpoints in progress
+        self.__writer.close()
+        if self.__stats:
+            self.__stats.close()
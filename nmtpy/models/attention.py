@@ -1,4 +1,5 @@
 # -*- coding: utf-8 -*-
+import time
 from collections import OrderedDict
 
 import numpy as np
@@ -6,11 +7,14 @@ import numpy as np
 import theano
 import theano.tensor as tensor
 
+from theano.tensor.extra_ops import Unique
+
 from ..layers import dropout, tanh, get_new_layer
 from ..defaults import INT, FLOAT
-from ..nmtutils import norm_weight, invert_dictionary, load_dictionary
+from ..nmtutils import norm_weight, invert_dictionary, load_dictionary, pp
 from ..iterators.text import TextIterator
 from ..iterators.bitext import BiTextIterator
+from ..iterators.stream import StreamingBiTextIterator
 from .basemodel import BaseModel
 
 class Model(BaseModel):
@@ -46,6 +50,21 @@ class Model(BaseModel):
         # Shuffle mode (default: trglen (ordered by target len))
         self.shuffle_mode = kwargs.pop('shuffle_mode', 'trglen')
 
+        # Number of minibatches sorted together and maximum padding ratio
+        # of a minibatch for shuffle_mode: bucket
+        self.bucket_batches = kwargs.pop('bucket_batches', 50)
+        self.bucket_max_pad = kwargs.pop('bucket_max_pad', 0.2)
+
+        # Folder for binarized training corpora (see nmt-binarize)
+        self.corpus_cache = kwargs.pop('corpus_cache', None)
+
+        # Number of processes for numericalizing training corpora
+        self.load_jobs = kwargs.pop('load_jobs', 1)
+
+        # If > 0, stream (sharded) training corpora using a shuffle
+        # buffer of this many samples instead of loading them in memory
+        self.stream_buffer = kwargs.pop('stream_buffer', 0)
+
         # How to initialize CGRU: text (default), zero (initialize with zero)
         self.init_cgru = kwargs.pop('init_cgru', 'text')
 
@@ -53,6 +72,20 @@ class Model(BaseModel):
         # the target probability instead of dl4mt style 3-way fusion.
         self.simple_output = kwargs.pop('simple_output', False)
 
+        # If > 0, train with a sampled softmax (Jean et al., 2015) over the
+        # target words of each minibatch and this many randomly drawn words.
+        # Validation loss and beam search always use the full softmax.
+        self.sampled_softmax = kwargs.pop('sampled_softmax', 0)
+
+        # Cutoffs of an adaptive softmax output layer, e.g. 2000,10000 for
+        # a head of the 2000 most frequent words and two tail clusters.
+        # None (default) uses a flat softmax over the target vocabulary.
+        self.adaptive_softmax = kwargs.pop('adaptive_softmax', None)
+        if isinstance(self.adaptive_softmax, int):
+            self.adaptive_softmax = [self.adaptive_softmax]
+        elif self.adaptive_softmax:
+            self.adaptive_softmax = list(self.adaptive_softmax)
+
         # Get dropout parameters
         self.emb_dropout = kwargs.pop('emb_dropout', 0.)
         self.ctx_dropout = kwargs.pop('ctx_dropout', 0.)
@@ -116,6 +149,15 @@ class Model(BaseModel):
             # Use a single name for all embeddings
             self.src_emb_name = self.trg_emb_name = 'Wemb'
 
+        # Sanity check for adaptive softmax
+        if self.adaptive_softmax:
+            assert self.tied_emb is False and self.sampled_softmax == 0, \
+                    "adaptive_softmax can not be used with tied_emb or sampled_softmax."
+
+            assert self.adaptive_softmax == sorted(set(self.adaptive_softmax)) and \
+                    0 < self.adaptive_softmax[0] and self.adaptive_softmax[-1] < self.n_words_trg, \
+                    "adaptive_softmax cutoffs should be increasing and smaller than n_words_trg."
+
         # Set options: the variables until here will be saved
         # to model checkpoints and snapshots as 'opts' dict.
         self.set_options(self.__dict__)
@@ -154,6 +196,15 @@ class Model(BaseModel):
         alphas          = [None] * n_models
         aux_ctxs        = [[] for i in range(n_models)]
 
+        # Target vocabulary subset of f_next() if a shortlist is given (see shortlist.py)
+        shortlist       = kwargs.get('shortlist', None)
+        vocab           = [] if shortlist is None else [shortlist]
+
+        # Decoding statistics are collected if a dict is given (see beamstats.py)
+        stats           = kwargs.get('stats', None)
+        if stats is not None:
+            start = time.time()
+
         for i, f_init in enumerate(f_inits):
             # Get next_state and initial contexts and save them
             # text_ctx: the set of textual annotations
@@ -162,6 +213,12 @@ class Model(BaseModel):
             next_states[i], text_ctxs[i], aux_ctxs[i] = result[0], result[1], result[2:]
             tiled_ctxs[i] = np.tile(text_ctxs[i], [1, 1])
 
+        if stats is not None:
+            stats['init_time']  = time.time() - start
+            stats['next_times'] = []
+            stats['step_times'] = []
+            stats['live_beams'] = []
+
         # Beginning-of-sentence indicator is -1
         next_w = -1 * np.ones((1,), dtype=INT)
 
@@ -172,6 +229,10 @@ class Model(BaseModel):
         live_beam = beam_size
 
         for t in range(maxlen):
+            if stats is not None:
+                stats['live_beams'].append(next_w.shape[0])
+                start = time.time()
+
             # Get next states
             # In the first iteration, we provide -1 and obtain the log_p's for the
             # first word. In the following iterations tiled_ctx becomes a batch
@@ -182,11 +243,15 @@ class Model(BaseModel):
 
             # We do this for each model
             for m, f_next in enumerate(f_nexts):
-                next_log_ps[m], next_states[m], alphas[m] = f_next(*([next_w, next_states[m], tiled_ctxs[m]] + aux_ctxs[m]))
+                next_log_ps[m], next_states[m], alphas[m] = f_next(*([next_w, next_states[m], tiled_ctxs[m]] + aux_ctxs[m] + vocab))
 
                 if suppress_unks:
                     next_log_ps[m][:, 1] = -np.inf
 
+            if stats is not None:
+                start_step = time.time()
+                stats['next_times'].append(start_step - start)
+
             # Compute sum of log_p's for the current hypotheses
             cand_scores = hyp_scores[:, None] - sum(next_log_ps)
 
@@ -218,6 +283,10 @@ class Model(BaseModel):
             trans_idxs  = ranks_flat // next_log_ps[0].shape[1]
             word_idxs   = ranks_flat % next_log_ps[0].shape[1]
 
+            if shortlist is not None:
+                # Map the subset positions back to target vocabulary idxs
+                word_idxs = shortlist[word_idxs]
+
             # Iterate over the hypotheses and add them to new_* lists
             for idx, [ti, wi] in enumerate(zip(trans_idxs, word_idxs)):
                 # Form the new hypothesis by appending new word to the left hyp
@@ -244,6 +313,8 @@ class Model(BaseModel):
             hyp_alignments = new_hyp_alignments
 
             if live_beam == 0:
+                if stats is not None:
+                    stats['step_times'].append(time.time() - start_step)
                 break
 
             # Take the idxs of each hyp's last word
@@ -251,6 +322,14 @@ class Model(BaseModel):
             next_states = [np.array(st, dtype=FLOAT) for st in zip(*hyp_states)]
             tiled_ctxs  = [np.tile(ctx, [live_beam, 1]) for ctx in text_ctxs]
 
+            if stats is not None:
+                stats['step_times'].append(time.time() - start_step)
+
+        if stats is not None:
+            stats['src_len']    = inputs[0].shape[0]
+            stats['maxlen']     = maxlen
+            stats['maxlen_hit'] = live_beam > 0
+
         # dump every remaining hypotheses
         for idx in range(live_beam):
             final_sample.append(hyp_samples[idx])
@@ -268,12 +347,19 @@ class Model(BaseModel):
 
         self._logger.info('Source vocabulary size: %d', self.n_words_src)
         self._logger.info('Target vocabulary size: %d', self.n_words_trg)
-        self._logger.info('%d training samples' % self.train_iterator.n_samples)
-        self._logger.info('  %d src UNKs, %d trg UNKs' % (self.train_iterator.n_unks_src, self.train_iterator.n_unks_trg))
+        if self.stream_buffer > 0:
+            self._logger.info('Training samples are streamed, statistics are not available')
+        else:
+            self._logger.info('%d training samples' % self.train_iterator.n_samples)
+            self._logger.info('  %d src UNKs, %d trg UNKs' % (self.train_iterator.n_unks_src, self.train_iterator.n_unks_trg))
         if 'valid_src' in self.data:
             self._logger.info('%d validation samples' % self.valid_iterator.n_samples)
             self._logger.info('  %d src UNKs, %d trg UNKs' % (self.valid_iterator.n_unks_src, self.valid_iterator.n_unks_trg))
         self._logger.info('dropout (emb,ctx,out): %.2f, %.2f, %.2f' % (self.emb_dropout, self.ctx_dropout, self.out_dropout))
+        if self.sampled_softmax > 0:
+            self._logger.info('Sampled softmax with %d additional words per minibatch' % self.sampled_softmax)
+        if self.adaptive_softmax:
+            self._logger.info('Adaptive softmax with cutoffs %s' % self.adaptive_softmax)
 
     def load_valid_data(self, from_translate=False):
         """Loads validation data."""
@@ -301,14 +387,30 @@ class Model(BaseModel):
     def load_data(self):
         """Loads training data and validation data if any."""
 
-        self.train_iterator = BiTextIterator(
-                                batch_size=self.batch_size,
-                                shuffle_mode=self.shuffle_mode,
-                                logger=self._logger,
-                                srcfile=self.data['train_src'], srcdict=self.src_dict,
-                                trgfile=self.data['train_trg'], trgdict=self.trg_dict,
-                                n_words_src=self.n_words_src,
-                                n_words_trg=self.n_words_trg)
+        if self.stream_buffer > 0:
+            # train_src and train_trg can be lists of shards
+            self.train_iterator = StreamingBiTextIterator(
+                                    batch_size=self.batch_size,
+                                    shuffle_mode=self.shuffle_mode,
+                                    logger=self._logger,
+                                    srcfile=self.data['train_src'], srcdict=self.src_dict,
+                                    trgfile=self.data['train_trg'], trgdict=self.trg_dict,
+                                    n_words_src=self.n_words_src,
+                                    n_words_trg=self.n_words_trg,
+                                    buffer_size=self.stream_buffer)
+        else:
+            self.train_iterator = BiTextIterator(
+                                    batch_size=self.batch_size,
+                                    shuffle_mode=self.shuffle_mode,
+                                    logger=self._logger,
+                                    srcfile=self.data['train_src'], srcdict=self.src_dict,
+                                    trgfile=self.data['train_trg'], trgdict=self.trg_dict,
+                                    n_words_src=self.n_words_src,
+                                    n_words_trg=self.n_words_trg,
+                                    cache_dir=self.corpus_cache,
+                                    bucket_batches=self.bucket_batches,
+                                    bucket_max_pad=self.bucket_max_pad,
+                                    n_jobs=self.load_jobs)
 
         # Prepare batches
         self.train_iterator.read()
@@ -363,11 +465,43 @@ class Model(BaseModel):
         if not self.simple_output:
             params = get_new_layer('ff')[0](params, prefix='ff_logit_prev' , nin=self.embedding_dim , nout=self.embedding_dim, scale=self.weight_init, ortho=False)
             params = get_new_layer('ff')[0](params, prefix='ff_logit_ctx'  , nin=self.ctx_dim       , nout=self.embedding_dim, scale=self.weight_init, ortho=False)
-        if self.tied_emb is False:
+        if self.adaptive_softmax:
+            params = get_new_layer('adaptive_softmax')[0](params, prefix='adasoft', nin=self.embedding_dim,
+                                                          n_words=self.n_words_trg, cutoffs=self.adaptive_softmax,
+                                                          scale=self.weight_init)
+        elif self.tied_emb is False:
             params = get_new_layer('ff')[0](params, prefix='ff_logit'  , nin=self.embedding_dim , nout=self.n_words_trg, scale=self.weight_init)
 
         self.initial_params = params
 
+    def get_sampled_cost(self, logit, y, y_mask):
+        """Returns the per-sample training cost of a sampled softmax where
+        logit is the input of the output layer. The softmax is normalized over
+        the target words of the minibatch and sampled_softmax words drawn
+        uniformly from the vocabulary so that every candidate has the same
+        proposal probability and no correction term is needed."""
+        y_flat = y.flatten()
+
+        # Draw the sampled words
+        samples = self._trng.uniform((self.sampled_softmax,)) * self.n_words_trg
+        samples = tensor.minimum(tensor.cast(samples, INT), self.n_words_trg - 1)
+
+        # Sorted candidate vocabulary and the positions of the targets in it
+        vocab, y_idx = Unique(return_inverse=True)(tensor.concatenate([y_flat, samples]))
+        y_idx = y_idx[:y_flat.shape[0]]
+
+        if self.tied_emb is False:
+            logit = get_new_layer('ff')[1](self.tparams, logit, prefix='ff_logit', activ='linear', col_idxs=vocab)
+        else:
+            logit = tensor.dot(logit, self.tparams[self.trg_emb_name][vocab].T)
+
+        logit_shp = logit.shape
+        log_probs = -tensor.nnet.logsoftmax(logit.reshape([logit_shp[0]*logit_shp[1], logit_shp[2]]))
+
+        cost = log_probs[tensor.arange(y_flat.shape[0]), y_idx]
+        cost = cost.reshape([y.shape[0], y.shape[1]])
+        return (cost * y_mask).sum(0)
+
     def build(self):
         """Builds the computation graph for training."""
 
@@ -454,30 +588,64 @@ class Model(BaseModel):
 
         logit = dropout(tanh(logit), self._trng, self.out_dropout, self._use_dropout)
 
-        if self.tied_emb is False:
-            logit = get_new_layer('ff')[1](self.tparams, logit, prefix='ff_logit', activ='linear')
+        if self.sampled_softmax > 0:
+            # Training cost over a subset of the target vocabulary
+            sampled_cost = self.get_sampled_cost(logit, y, y_mask)
+
+        if self.adaptive_softmax:
+            logit_shp = logit.shape
+
+            # Negative log-likelihoods of the targets
+            cost = get_new_layer('adaptive_softmax')[1](self.tparams,
+                                                        logit.reshape([logit_shp[0]*logit_shp[1], logit_shp[2]]),
+                                                        self.n_words_trg, self.adaptive_softmax,
+                                                        prefix='adasoft', targets=y.flatten())
         else:
-            logit = tensor.dot(logit, self.tparams[self.trg_emb_name].T)
+            if self.tied_emb is False:
+                logit = get_new_layer('ff')[1](self.tparams, logit, prefix='ff_logit', activ='linear')
+            else:
+                logit = tensor.dot(logit, self.tparams[self.trg_emb_name].T)
 
-        logit_shp = logit.shape
+            logit_shp = logit.shape
 
-        # Apply logsoftmax (stable version)
-        log_probs = -tensor.nnet.logsoftmax(logit.reshape([logit_shp[0]*logit_shp[1], logit_shp[2]]))
+            # Apply logsoftmax (stable version)
+            log_probs = -tensor.nnet.logsoftmax(logit.reshape([logit_shp[0]*logit_shp[1], logit_shp[2]]))
 
-        # cost
-        y_flat = y.flatten()
-        y_flat_idx = tensor.arange(y_flat.shape[0]) * self.n_words_trg + y_flat
+            # cost
+            y_flat = y.flatten()
+            y_flat_idx = tensor.arange(y_flat.shape[0]) * self.n_words_trg + y_flat
+
+            cost = log_probs.flatten()[y_flat_idx]
 
-        cost = log_probs.flatten()[y_flat_idx]
         cost = cost.reshape([n_timesteps_trg, n_samples])
         cost = (cost * y_mask).sum(0)
 
         self.f_log_probs = theano.function(list(self.inputs.values()), cost)
 
+        if self.sampled_softmax > 0:
+            # Validation loss still uses the full softmax through f_log_probs
+            return sampled_cost
+
         return cost
 
-    def build_sampler(self):
-        """Builds the computation graph for beam search."""
+    def get_prev_logits(self, y, prefix='ff_logit_prev', emb_name=None):
+        """Returns the outputs of the linear layer prefix for the embeddings of
+        the previous target words y in beam search. As they only depend on the
+        word idxs, they are gathered from a table precomputed once for the whole
+        target vocabulary instead of being projected at each step. The first
+        step (y < 0) has a zero embedding, i.e. only the bias. The table is
+        computed from the current weights so the model should be loaded first."""
+        emb = self.tparams[emb_name or self.trg_emb_name].get_value()
+        W   = self.tparams[pp(prefix, 'W')].get_value()
+        b   = self.tparams[pp(prefix, 'b')]
+
+        table = theano.shared((np.dot(emb, W) + b.get_value()).astype(FLOAT), name=pp(prefix, 'table'))
+        return tensor.switch(y[:, None] < 0, b[None, :], table[y])
+
+    def build_sampler(self, shortlist=False):
+        """Builds the computation graph for beam search. If shortlist is True,
+        f_next takes an additional vector of target word idxs and computes
+        the log-probabilities of these words only."""
 
         x           = tensor.matrix('x', dtype=INT)
         xr          = x[::-1]
@@ -540,22 +708,34 @@ class Model(BaseModel):
         logit = get_new_layer('ff')[1](self.tparams, next_state, prefix='ff_logit_gru', activ='linear')
 
         if not self.simple_output:
-            logit += get_new_layer('ff')[1](self.tparams, emb, prefix='ff_logit_prev',activ='linear')
+            logit += self.get_prev_logits(y)
             logit += get_new_layer('ff')[1](self.tparams, ctxs, prefix='ff_logit_ctx', activ='linear')
 
         logit = tanh(logit)
 
-        if self.tied_emb is False:
-            logit = get_new_layer('ff')[1](self.tparams, logit, prefix='ff_logit', activ='linear')
+        # Target vocabulary subset
+        vocab = tensor.vector('vocab', dtype=INT) if shortlist else None
+
+        if self.adaptive_softmax:
+            assert not shortlist, "Shortlists are not supported with adaptive_softmax."
+            next_log_probs = get_new_layer('adaptive_softmax')[1](self.tparams, logit, self.n_words_trg,
+                                                                  self.adaptive_softmax, prefix='adasoft')
         else:
-            logit = tensor.dot(logit, self.tparams[self.trg_emb_name].T)
+            if self.tied_emb is False:
+                logit = get_new_layer('ff')[1](self.tparams, logit, prefix='ff_logit', activ='linear', col_idxs=vocab)
+            elif shortlist:
+                logit = tensor.dot(logit, self.tparams[self.trg_emb_name][vocab].T)
+            else:
+                logit = tensor.dot(logit, self.tparams[self.trg_emb_name].T)
 
-        # compute the logsoftmax
-        next_log_probs = tensor.nnet.logsoftmax(logit)
+            # compute the logsoftmax
+            next_log_probs = tensor.nnet.logsoftmax(logit)
 
         # compile a function to do the whole thing above
         # next hidden state to be used
         inputs = [y, init_state, ctx]
+        if shortlist:
+            inputs.append(vocab)
 
         outs = [next_log_probs, next_state, alphas]
         self.f_next = theano.function(inputs, outs, name='f_next')
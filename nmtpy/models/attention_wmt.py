@@ -14,6 +14,9 @@ class Model(Attention):
 
         self.data_mode = kwargs.pop('data_mode', 'pairs')
 
+        # Number of hot images whose features are kept in memory
+        self.img_cache = kwargs.pop('img_cache', 0)
+
     def load_valid_data(self, from_translate=False, data_mode='single'):
         if from_translate:
             self.valid_ref_files = self.data['valid_trg']
@@ -40,7 +43,11 @@ class Model(Attention):
     def load_data(self):
         self.train_iterator = FusionIterator(
                 batch_size=self.batch_size,
+                n_jobs=self.load_jobs,
+                img_cache=self.img_cache,
                 shuffle_mode=self.shuffle_mode,
+                bucket_batches=self.bucket_batches,
+                bucket_max_pad=self.bucket_max_pad,
                 logger=self._logger,
                 pklfile=self.data['train_src'],
                 trgdict=self.trg_dict, srcdict=self.src_dict,
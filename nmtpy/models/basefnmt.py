@@ -39,6 +39,14 @@ class Model(BaseModel):
         # Shuffle mode (default: No shuffle)
         self.shuffle_mode = kwargs.pop('shuffle_mode', 'simple')
 
+        # Number of minibatches sorted together and maximum padding ratio
+        # of a minibatch for shuffle_mode: bucket
+        self.bucket_batches = kwargs.pop('bucket_batches', 50)
+        self.bucket_max_pad = kwargs.pop('bucket_max_pad', 0.2)
+
+        # Folder for binarized training corpora (see nmt-binarize)
+        self.corpus_cache = kwargs.pop('corpus_cache', None)
+
         # How to initialize CGRU
         self.init_cgru = kwargs.pop('init_cgru', 'text')
 
@@ -118,8 +126,10 @@ class Model(BaseModel):
         # We call this once to setup dropout mechanism correctly
         self.set_dropout(False)
 
-    def run_beam_search(self, beam_size=12, n_jobs=8, metric='bleu', mode='beamsearch', valid_mode='single', f_valid_out=None):
-        """Save model under /tmp for passing it to nmt-translate-factors."""
+    def run_beam_search(self, beam_size=12, n_jobs=8, metric='bleu', mode='beamsearch', valid_mode='single',
+                        f_valid_out=None, timings=None):
+        """Save model under /tmp for passing it to nmt-translate-factors, which
+        does not report the scoring time in timings."""
         # Save model temporarily
         with get_temp_file(suffix=".npz", delete=True) as tmpf:
             self.save(tmpf.name)
@@ -408,7 +418,10 @@ class Model(BaseModel):
                                 trglemfile=self.data['train_trg1'], trglemdict=self.trg_dict,
                                 trgfactfile=self.data['train_trg2'], trgfactdict=self.trgfact_dict,
                                 n_words_src=self.n_words_src,
-                                n_words_trglem=self.n_words_trg1, n_words_trgfact=self.n_words_trg2)
+                                n_words_trglem=self.n_words_trg1, n_words_trgfact=self.n_words_trg2,
+                                cache_dir=self.corpus_cache,
+                                bucket_batches=self.bucket_batches,
+                                bucket_max_pad=self.bucket_max_pad)
 
         # Prepare batches
         self.train_iterator.read()
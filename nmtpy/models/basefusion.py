@@ -1,4 +1,5 @@
 # -*- coding: utf-8 -*-
+import hashlib
 from collections import OrderedDict
 
 # 3rd party
@@ -10,7 +11,7 @@ import theano.tensor as tensor
 # Ours
 from ..layers import dropout, get_new_layer, tanh
 from ..defaults import INT, FLOAT
-from ..nmtutils import norm_weight
+from ..nmtutils import norm_weight, pp
 from ..iterators.fusion import FusionIterator
 
 from .attention import Model as Attention
@@ -23,11 +24,52 @@ from .attention import Model as Attention
 # NOTE: This is 'not' a model on its own, do not set this
 # as your model_type in configuration files!
 
+class ImageContextCache(object):
+    """Wraps the text and image parts of f_init so that the image outputs,
+    e.g. the adapted image context and its attention projection, are
+    computed once per image and reused by the sentences describing it."""
+    def __init__(self, f_text, f_img, cache_size=32):
+        self.f_text = f_text
+        self.f_img = f_img
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+
+    def __call__(self, x, x_img):
+        # f_init only sees the features, use their digest as image id
+        key = hashlib.sha1(np.ascontiguousarray(x_img)).digest()
+        img_outs = self.cache.get(key, None)
+        if img_outs is None:
+            img_outs = self.f_img(x_img)
+            if self.cache_size > 0:
+                self.cache[key] = img_outs
+                if len(self.cache) > self.cache_size:
+                    self.cache.popitem(last=False)
+        else:
+            self.cache.move_to_end(key)
+
+        return list(self.f_text(x, x_img)) + list(img_outs)
+
 class Model(Attention):
     def __init__(self, seed, logger, **kwargs):
         # Call Attention's __init__
         super(Model, self).__init__(seed, logger, **kwargs)
 
+        # The decoders of this model only implement the full softmax
+        assert not self.adaptive_softmax, \
+                "adaptive_softmax is not supported by this model."
+
+        # Feed unique images of minibatches with sample->image idxs
+        self.img_dedup = kwargs.pop('img_dedup', False)
+
+        # Number of hot images whose features are kept in memory
+        self.img_cache = kwargs.pop('img_cache', 0)
+
+        # Number of images whose contexts are cached during decoding
+        self.img_ctx_cache = kwargs.pop('img_ctx_cache', 32)
+
+        # How the sentences of the splits are combined, see WMTIterator
+        self.data_mode = kwargs.pop('data_mode', 'pairs')
+
         # These should be set by child models depending
         # on their specific decoder implementations
         self.init_gru_decoder   = None
@@ -49,14 +91,19 @@ class Model(Attention):
         # Load training data
         self.train_iterator = FusionIterator(
                 batch_size=self.batch_size,
+                n_jobs=self.load_jobs,
+                img_cache=self.img_cache,
+                img_dedup=self.img_dedup,
                 shuffle_mode=self.shuffle_mode,
+                bucket_batches=self.bucket_batches,
+                bucket_max_pad=self.bucket_max_pad,
                 logger=self._logger,
                 pklfile=self.data['train_src'],
                 imgfile=self.data['train_img'],
                 trgdict=self.trg_dict,
                 srcdict=self.src_dict,
                 n_words_trg=self.n_words_trg, n_words_src=self.n_words_src,
-                mode=self._options.get('data_mode', 'pairs'))
+                mode=self.data_mode)
         self.train_iterator.read()
         self.load_valid_data()
 
@@ -79,6 +126,7 @@ class Model(Attention):
             # Just for loss computation
             self.valid_iterator = FusionIterator(
                     batch_size=self.batch_size,
+                    img_dedup=self.img_dedup,
                     pklfile=self.data['valid_src'],
                     imgfile=self.data['valid_img'],
                     trgdict=self.trg_dict, srcdict=self.src_dict,
@@ -151,10 +199,18 @@ class Model(Attention):
         # Image: 196 (n_annotations) x n_samples x 1024 (conv_dim)
         x_img   = tensor.tensor3('x_img', dtype=FLOAT)
 
+        # Image idxs of samples if x_img only has unique images
+        x_img_idx = tensor.vector('x_img_idx', dtype=INT)
+
         # Target sentences: n_timesteps, n_samples
         y       = tensor.matrix('y', dtype=INT)
         y_mask  = tensor.matrix('y_mask', dtype=FLOAT)
 
+        # Mean of image features: n_samples x conv_dim
+        img_mean = x_img.mean(axis=0)
+        if self.img_dedup:
+            img_mean = img_mean[x_img_idx]
+
         # Reverse stuff
         xr      = x[::-1]
         xr_mask = x_mask[::-1]
@@ -169,6 +225,8 @@ class Model(Attention):
         self.inputs['x']        = x         # Source words
         self.inputs['x_mask']   = x_mask    # Source mask
         self.inputs['x_img']    = x_img     # Image features
+        if self.img_dedup:
+            self.inputs['x_img_idx'] = x_img_idx    # Sample -> image idxs
         self.inputs['y']        = y         # Target labels
         self.inputs['y_mask']   = y_mask    # Target mask
 
@@ -203,10 +261,10 @@ class Model(Attention):
             # -> n_samples x rnn_dim (last dim shrinked down by this FF to rnn_dim)
         elif self.init_cgru == 'img':
             # Reduce to nb_samples x conv_dim and transform
-            init_state = get_new_layer('ff')[1](self.tparams, x_img.mean(axis=0), prefix='ff_img_state_init', activ='tanh')
+            init_state = get_new_layer('ff')[1](self.tparams, img_mean, prefix='ff_img_state_init', activ='tanh')
         elif self.init_cgru == 'textimg':
             # n_samples x conv_dim
-            img_ctx_mean  = x_img.mean(axis=0)
+            img_ctx_mean  = img_mean
             # n_samples x ctx_dim
             text_ctx_mean = (text_ctx * x_mask[:, :, None]).sum(0) / x_mask.sum(0)[:, None]
             # n_samples x (conv_dim + ctx_dim)
@@ -223,6 +281,10 @@ class Model(Attention):
         img_ctx = get_new_layer('ff')[1](self.tparams, x_img, prefix='ff_img_adaptor', activ='linear')
         # -> 196 x n_samples x ctx_dim
 
+        if self.img_dedup:
+            # Image features are projected once per unique image
+            img_ctx = img_ctx[:, x_img_idx]
+
         ####################
         # Target embeddings
         ####################
@@ -263,6 +325,10 @@ class Model(Attention):
         # Dropout
         logit = dropout(tanh(logit_gru + emb_trg + logit_ctx), self._trng, self.out_dropout, self._use_dropout)
 
+        if self.sampled_softmax > 0:
+            # Training cost over a subset of the target vocabulary
+            sampled_cost = self.get_sampled_cost(logit, y, y_mask)
+
         if self.tied_emb is False:
             logit = get_new_layer('ff')[1](self.tparams, logit, prefix='ff_logit', activ='linear')
         else:
@@ -283,6 +349,10 @@ class Model(Attention):
 
         self.f_log_probs = theano.function(list(self.inputs.values()), cost)
 
+        if self.sampled_softmax > 0:
+            # Validation loss still uses the full softmax through f_log_probs
+            return sampled_cost
+
         return cost
 
     def build_sampler(self, **kwargs):
@@ -300,6 +370,12 @@ class Model(Attention):
         # Broadcast middle dimension to make it 196 x 1 x 2000
         img_ctx         = img_ctx[:, None, :]
 
+        # Attention projection of image context which is otherwise
+        # recomputed at each decoding step (*_ind_ind share Wc_att)
+        suffix          = '2' if pp('decoder_multi', 'Wc_att2') in self.tparams else ''
+        img_pctx        = tensor.dot(img_ctx, self.tparams[pp('decoder_multi', 'Wc_att' + suffix)]) + \
+                            self.tparams[pp('decoder_multi', 'b_att' + suffix)]
+
         #####################
         # Text Bi-GRU Encoder
         #####################
@@ -333,9 +409,12 @@ class Model(Attention):
         ################
         # Build f_init()
         ################
+        # Image outputs are computed once per image and cached
         inps        = [x, x_img]
-        outs        = [init_state, text_ctx, img_ctx]
-        self.f_init = theano.function(inps, outs, name='f_init')
+        outs        = [init_state, text_ctx]
+        f_text      = theano.function(inps, outs, name='f_init', on_unused_input='ignore')
+        f_img       = theano.function([x_img], [img_ctx, img_pctx], name='f_img')
+        self.f_init = ImageContextCache(f_text, f_img, self.img_ctx_cache)
 
         ###################
         # Target Embeddings
@@ -352,7 +431,7 @@ class Model(Attention):
                                     prefix='decoder_multi',
                                     input_mask=None,
                                     ctx1=text_ctx, ctx1_mask=None,
-                                    ctx2=img_ctx,
+                                    ctx2=img_ctx, pctx2=img_pctx,
                                     one_step=True,
                                     init_state=init_state)
         h      = dec_mult[0]
@@ -376,6 +455,6 @@ class Model(Attention):
         ################
         # Build f_next()
         ################
-        inputs      = [y, init_state, text_ctx, img_ctx]
+        inputs      = [y, init_state, text_ctx, img_ctx, img_pctx]
         outs        = [next_log_probs, h, alphas]
         self.f_next = theano.function(inputs, outs, name='f_next')
@@ -46,6 +46,9 @@ class BaseModel(object, metaclass=ABCMeta):
         # Optimizer instance (will not be serialized)
         self.__opt          = None
 
+        # Gradient accumulators and their number of samples
+        self.__acc_vars     = []
+
     @staticmethod
     def beam_search(inputs, f_inits, f_nexts, beam_size=12, maxlen=100, suppress_unks=False, **kwargs):
         # Override this from your classes
@@ -64,8 +67,15 @@ class BaseModel(object, metaclass=ABCMeta):
         if seed == 0:
             # No seed given, randomly pick the seed
             seed = np.random.randint(2**29) + 1
+        self._trng_seed = seed
         self._trng = RandomStreams(seed)
 
+    def reseed_trng(self, offset):
+        """Reseed the Theano RNG streams, including the ones used by the
+        compiled functions, with the initial seed plus offset. This gives
+        each data-parallel worker its own dropout masks and samples."""
+        self._trng.seed(self._trng_seed + offset)
+
     def set_dropout(self, val):
         """Set dropout indicator for activation scaling if dropout is available through configuration."""
         if self._use_dropout is None:
@@ -77,19 +87,51 @@ class BaseModel(object, metaclass=ABCMeta):
         """Update learning rate."""
         self.__opt.set_lrate(lrate)
 
+    def get_lrate(self):
+        """Return the current learning rate."""
+        return float(self.__opt.lr.get_value())
+
+    def get_opt_history(self, borrow=False):
+        """Return the optimizer accumulators as numpy arrays."""
+        return self.__opt.get_history(borrow=borrow)
+
+    def get_accum_grads(self):
+        """Return the gradient accumulators and the number of accumulated
+        samples as numpy arrays that alias the shared variables on CPU."""
+        return [v.get_value(borrow=True) for v in self.__acc_vars]
+
+    def set_accum_grads(self, values):
+        """Set the gradient accumulators, e.g. after summing them across workers."""
+        for var, value in zip(self.__acc_vars, values):
+            var.set_value(value, borrow=True)
+
+    def get_trng_state(self):
+        """Return the states of the Theano RNG streams, e.g. for dropout."""
+        return [su[0].get_value() for su in self._trng.state_updates]
+
+    def set_trng_state(self, states):
+        """Restore the states returned by get_trng_state()."""
+        for su, state in zip(self._trng.state_updates, states):
+            su[0].set_value(state)
+
     def get_nb_params(self):
         """Return the number of parameters of the model."""
         return readable_size(sum([p.size for p in self.initial_params.values()]))
 
-    def save(self, fname):
-        """Save model parameters as .npz."""
+    def get_save_dict(self, borrow=False):
+        """Return the options and parameters that are saved as .npz.
+        Parameters are not copied if borrow is True and device is CPU."""
         kwargs = OrderedDict()
         kwargs['opts'] = self._options
         if self.tparams is not None:
-            kwargs.update(unzip(self.tparams))
+            for k, v in self.tparams.items():
+                kwargs[k] = v.get_value(borrow=borrow)
+        return kwargs
 
+    def save(self, fname):
+        """Save model parameters as .npz."""
         # Save each param as a separate argument into npz
-        np.savez(fname, **kwargs)
+        np.savez(fname, **self.get_save_dict())
 
     def load(self, params):
         """Restore .npz checkpoint file into model."""
@@ -143,7 +185,8 @@ class BaseModel(object, metaclass=ABCMeta):
         return weight_decay
 
     def get_clipped_grads(self, grads, clip_c):
-        """Clip gradients a la Pascanu et al."""
+        """Clip gradients a la Pascanu et al. When accumulating, grads are
+        the mean gradients of all accumulated minibatches."""
         g2 = 0.
         new_grads = []
         for g in grads:
@@ -154,8 +197,10 @@ class BaseModel(object, metaclass=ABCMeta):
                                            g))
         return new_grads
 
-    def build_optimizer(self, cost, regcost, clip_c, dont_update=None, opt_history=None):
-        """Build optimizer by optionally disabling learning for some weights."""
+    def build_optimizer(self, cost, regcost, clip_c, dont_update=None, opt_history=None, accum_steps=1, n_workers=1):
+        """Build optimizer by optionally disabling learning for some weights.
+        If accum_steps > 1 or n_workers > 1, train_batch() only accumulates
+        gradients and apply_grads() should be called to update the weights."""
         tparams = OrderedDict(self.tparams)
 
         # Filter out weights that we do not want to update during backprop
@@ -180,9 +225,29 @@ class BaseModel(object, metaclass=ABCMeta):
         else:
             norm_cost = final_cost
 
-        # Get gradients of cost with respect to variables
-        # This uses final_cost which is not normalized w.r.t sentence lengths
-        grads = tensor.grad(final_cost, wrt=list(tparams.values()))
+        accumulate = accum_steps > 1 or n_workers > 1
+        if accumulate:
+            # Accumulate sums of per-sample gradients and number of samples
+            # so that minibatches of different sizes are weighted correctly
+            grad_sums = tensor.grad(cost.sum(), wrt=list(tparams.values()))
+            acc_grads = [theano.shared(np.zeros_like(p.get_value()), name='%s_acc' % p.name)
+                         for p in tparams.values()]
+            acc_n = theano.shared(np.float64(0.).astype(FLOAT), name='n_acc')
+            self.__acc_vars = acc_grads + [acc_n]
+
+            acc_updates = [(a, a + g) for a, g in zip(acc_grads, grad_sums)]
+            acc_updates.append((acc_n, acc_n + tensor.cast(cost.shape[0], FLOAT)))
+
+            # Mean gradients over accumulated samples
+            grads = [a / acc_n for a in acc_grads]
+            if regcost is not None:
+                # Regularization does not depend on the minibatches
+                reg_grads = tensor.grad(regcost, wrt=list(tparams.values()))
+                grads = [g + rg for g, rg in zip(grads, reg_grads)]
+        else:
+            # Get gradients of cost with respect to variables
+            # This uses final_cost which is not normalized w.r.t sentence lengths
+            grads = tensor.grad(final_cost, wrt=list(tparams.values()))
 
         # Clip gradients if requested
         if clip_c > 0:
@@ -196,10 +261,19 @@ class BaseModel(object, metaclass=ABCMeta):
         # Get updates
         updates = self.__opt.get_updates(tparams, grads, opt_history)
 
-        # Compile forward/backward function
-        self.train_batch = theano.function(list(self.inputs.values()), norm_cost, updates=updates)
+        if accumulate:
+            # Compile forward/backward function that accumulates gradients
+            self.train_batch = theano.function(list(self.inputs.values()), norm_cost, updates=acc_updates)
+
+            # Apply accumulated gradients and reset the accumulators
+            updates += [(a, tensor.zeros_like(a)) for a in acc_grads]
+            updates.append((acc_n, tensor.zeros_like(acc_n)))
+            self.apply_grads = theano.function([], [], updates=updates)
+        else:
+            # Compile forward/backward function
+            self.train_batch = theano.function(list(self.inputs.values()), norm_cost, updates=updates)
 
-    def run_beam_search(self, beam_size=12, n_jobs=8, metric='bleu', f_valid_out=None):
+    def run_beam_search(self, beam_size=12, n_jobs=8, metric='bleu', f_valid_out=None, timings=None):
         """Save model under /tmp for passing it to nmt-translate."""
         # Save model temporarily
         with get_temp_file(suffix=".npz", delete=True) as tmpf:
@@ -208,7 +282,8 @@ class BaseModel(object, metaclass=ABCMeta):
                                           beam_size=beam_size,
                                           n_jobs=n_jobs,
                                           metric=metric,
-                                          f_valid_out=f_valid_out)
+                                          f_valid_out=f_valid_out,
+                                          timings=timings)
 
         # Return every available metric back
         return result
@@ -13,6 +13,7 @@ from ..iterators.fusion import FusionIterator
 
 # Base fusion model
 from .attention import Model as Attention
+from .basefusion import ImageContextCache
 
 def init_gru_decoder_multi(params, nin, dim, dimctx, scale=0.01, prefix='gru_decoder_multi'):
     # Init with usual gru_cond function
@@ -228,6 +229,22 @@ class Model(Attention):
         # Call Attention's __init__
         super(Model, self).__init__(seed, logger, **kwargs)
 
+        # The decoders of this model only implement the full softmax
+        assert not self.adaptive_softmax, \
+                "adaptive_softmax is not supported by this model."
+
+        # Feed unique images of minibatches with sample->image idxs
+        self.img_dedup = kwargs.pop('img_dedup', False)
+
+        # Number of hot images whose features are kept in memory
+        self.img_cache = kwargs.pop('img_cache', 0)
+
+        # Number of images whose contexts are cached during decoding
+        self.img_ctx_cache = kwargs.pop('img_ctx_cache', 32)
+
+        # How the sentences of the splits are combined, see WMTIterator
+        self.data_mode = kwargs.pop('data_mode', 'pairs')
+
         self.init_gru_decoder   = init_gru_decoder_multi
         self.gru_decoder        = gru_decoder_multi
 
@@ -247,14 +264,19 @@ class Model(Attention):
         # Load training data
         self.train_iterator = FusionIterator(
                 batch_size=self.batch_size,
+                n_jobs=self.load_jobs,
+                img_cache=self.img_cache,
+                img_dedup=self.img_dedup,
                 shuffle_mode=self.shuffle_mode,
+                bucket_batches=self.bucket_batches,
+                bucket_max_pad=self.bucket_max_pad,
                 logger=self._logger,
                 pklfile=self.data['train_src'],
                 imgfile=self.data['train_img'],
                 trgdict=self.trg_dict,
                 srcdict=self.src_dict,
                 n_words_trg=self.n_words_trg, n_words_src=self.n_words_src,
-                mode=self._options.get('data_mode', 'pairs'))
+                mode=self.data_mode)
         self.train_iterator.read()
         self.load_valid_data()
 
@@ -277,6 +299,7 @@ class Model(Attention):
             # Just for loss computation
             self.valid_iterator = FusionIterator(
                     batch_size=self.batch_size,
+                    img_dedup=self.img_dedup,
                     pklfile=self.data['valid_src'],
                     imgfile=self.data['valid_img'],
                     trgdict=self.trg_dict, srcdict=self.src_dict,
@@ -351,10 +374,18 @@ class Model(Attention):
         # Image: 196 (n_annotations) x n_samples x 1024 (conv_dim)
         x_img   = tensor.tensor3('x_img', dtype=FLOAT)
 
+        # Image idxs of samples if x_img only has unique images
+        x_img_idx = tensor.vector('x_img_idx', dtype=INT)
+
         # Target sentences: n_timesteps, n_samples
         y       = tensor.matrix('y', dtype=INT)
         y_mask  = tensor.matrix('y_mask', dtype=FLOAT)
 
+        # Mean of image features: n_samples x conv_dim
+        img_mean = x_img.mean(axis=0)
+        if self.img_dedup:
+            img_mean = img_mean[x_img_idx]
+
         # Reverse stuff
         xr      = x[::-1]
         xr_mask = x_mask[::-1]
@@ -369,6 +400,8 @@ class Model(Attention):
         self.inputs['x']        = x         # Source words
         self.inputs['x_mask']   = x_mask    # Source mask
         self.inputs['x_img']    = x_img     # Image features
+        if self.img_dedup:
+            self.inputs['x_img_idx'] = x_img_idx    # Sample -> image idxs
         self.inputs['y']        = y         # Target labels
         self.inputs['y_mask']   = y_mask    # Target mask
 
@@ -403,10 +436,10 @@ class Model(Attention):
             # -> n_samples x rnn_dim (last dim shrinked down by this FF to rnn_dim)
         elif self.init_cgru == 'img':
             # Reduce to nb_samples x conv_dim and transform
-            init_state = get_new_layer('ff')[1](self.tparams, x_img.mean(axis=0), prefix='ff_img_state_init', activ='tanh')
+            init_state = get_new_layer('ff')[1](self.tparams, img_mean, prefix='ff_img_state_init', activ='tanh')
         elif self.init_cgru == 'textimg':
             # n_samples x conv_dim
-            img_ctx_mean  = x_img.mean(axis=0)
+            img_ctx_mean  = img_mean
             # n_samples x ctx_dim
             text_ctx_mean = (text_ctx * x_mask[:, :, None]).sum(0) / x_mask.sum(0)[:, None]
             # n_samples x (conv_dim + ctx_dim)
@@ -423,6 +456,10 @@ class Model(Attention):
         img_ctx = get_new_layer('ff')[1](self.tparams, x_img, prefix='ff_img_adaptor', activ='linear')
         # -> 196 x n_samples x ctx_dim
 
+        if self.img_dedup:
+            # Image features are projected once per unique image
+            img_ctx = img_ctx[:, x_img_idx]
+
         ####################
         # Target embeddings
         ####################
@@ -466,6 +503,10 @@ class Model(Attention):
         # Dropout
         logit = dropout(tanh(logit_gru + logit_emb + logit_ctx_text + logit_ctx_img), self._trng, self.out_dropout, self._use_dropout)
 
+        if self.sampled_softmax > 0:
+            # Training cost over a subset of the target vocabulary
+            sampled_cost = self.get_sampled_cost(logit, y, y_mask)
+
         if self.tied_emb is False:
             logit = get_new_layer('ff')[1](self.tparams, logit, prefix='ff_logit', activ='linear')
         else:
@@ -486,6 +527,10 @@ class Model(Attention):
 
         self.f_log_probs = theano.function(list(self.inputs.values()), cost)
 
+        if self.sampled_softmax > 0:
+            # Validation loss still uses the full softmax through f_log_probs
+            return sampled_cost
+
         return cost
 
     def build_sampler(self, **kwargs):
@@ -536,9 +581,12 @@ class Model(Attention):
         ################
         # Build f_init()
         ################
+        # Image context is computed once per image and cached
         inps        = [x, x_img]
-        outs        = [init_state, text_ctx, img_ctx]
-        self.f_init = theano.function(inps, outs, name='f_init')
+        outs        = [init_state, text_ctx]
+        f_text      = theano.function(inps, outs, name='f_init', on_unused_input='ignore')
+        f_img       = theano.function([x_img], [img_ctx], name='f_img')
+        self.f_init = ImageContextCache(f_text, f_img, self.img_ctx_cache)
 
         ###################
         # Target Embeddings
@@ -567,7 +615,7 @@ class Model(Attention):
         logit_gru       = get_new_layer('ff')[1](self.tparams, h, prefix='ff_logit_gru', activ='linear')
         logit_ctx_text  = get_new_layer('ff')[1](self.tparams, c_t, prefix='ff_logit_ctx_text', activ='linear')
         logit_ctx_img   = get_new_layer('ff')[1](self.tparams, i_t, prefix='ff_logit_ctx_img', activ='linear')
-        logit_emb       = get_new_layer('ff')[1](self.tparams, emb_trg, prefix='ff_logit_emb', activ='linear')
+        logit_emb       = self.get_prev_logits(y, prefix='ff_logit_emb', emb_name='Wemb_dec')
 
         # NOTE: They also had logit_emb
         logit = tanh(logit_gru + logit_emb + logit_ctx_text + logit_ctx_img)
@@ -45,7 +45,7 @@ def init_gru_decoder_multi(params, nin, dim, dimctx, scale=0.01, prefix='gru_dec
 def gru_decoder_multi(tparams, state_below,
                       ctx1, ctx2, prefix='gru_decoder_multi',
                       input_mask=None, one_step=False,
-                      init_state=None, ctx1_mask=None):
+                      init_state=None, ctx1_mask=None, pctx2=None):
     if one_step:
         assert init_state, 'previous state must be provided'
 
@@ -85,7 +85,8 @@ def gru_decoder_multi(tparams, state_below,
     # Wc_att: dimctx -> dimctx
     # Linearly transform the contexts to another space with same dimensionality
     pctx1_ = tensor.dot(ctx1, tparams[pp(prefix, 'Wc_att')]) + tparams[pp(prefix, 'b_att')]
-    pctx2_ = tensor.dot(ctx2, tparams[pp(prefix, 'Wc_att2')]) + tparams[pp(prefix, 'b_att2')]
+    # Projected image context may be given, e.g. cached across sentences
+    pctx2_ = pctx2 if pctx2 is not None else tensor.dot(ctx2, tparams[pp(prefix, 'Wc_att2')]) + tparams[pp(prefix, 'b_att2')]
 
     # Step function for the recurrence/scan
     # Sequences
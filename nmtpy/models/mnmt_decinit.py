@@ -21,10 +21,23 @@ class Model(Attention):
         # Call parent's init first
         super(Model, self).__init__(seed, logger, **kwargs)
 
+        # The decoders of this model only implement the full softmax
+        assert not self.adaptive_softmax, \
+                "adaptive_softmax is not supported by this model."
+
+        # Feed unique images of minibatches with sample->image idxs
+        self.img_dedup = kwargs.pop('img_dedup', False)
+
+        # Number of hot images whose features are kept in memory
+        self.img_cache = kwargs.pop('img_cache', 0)
+
     def load_data(self):
         # Load training data
         self.train_iterator = MNMTIterator(
                 batch_size=self.batch_size,
+                n_jobs=self.load_jobs,
+                img_cache=self.img_cache,
+                img_dedup=self.img_dedup,
                 logger=self._logger,
                 pklfile=self.data['train_src'],
                 imgfile=self.data['train_img'],
@@ -53,6 +66,7 @@ class Model(Attention):
             # Just for loss computation
             self.valid_iterator = MNMTIterator(
                     batch_size=self.batch_size,
+                    img_dedup=self.img_dedup,
                     pklfile=self.data['valid_src'],
                     imgfile=self.data['valid_img'],
                     trgdict=self.trg_dict, srcdict=self.src_dict,
@@ -109,6 +123,7 @@ class Model(Attention):
         x                       = T.matrix('x', dtype=INT)
         x_mask                  = T.matrix('x_mask', dtype=FLOAT)
         x_img                   = T.matrix('x_img', dtype=FLOAT)
+        x_img_idx               = T.vector('x_img_idx', dtype=INT)
         y                       = T.matrix('y', dtype=INT)
         y_mask                  = T.matrix('y_mask', dtype=FLOAT)
 
@@ -116,6 +131,8 @@ class Model(Attention):
         self.inputs['x']        = x
         self.inputs['x_mask']   = x_mask
         self.inputs['x_img']    = x_img     # Image features
+        if self.img_dedup:
+            self.inputs['x_img_idx'] = x_img_idx    # Sample -> image idxs
         self.inputs['y']        = y
         self.inputs['y_mask']   = y_mask
 
@@ -152,6 +169,10 @@ class Model(Attention):
         # Decoder initialized with pool5 features
         init_state = get_new_layer('ff')[1](self.tparams, x_img, prefix='ff_imginit', activ='tanh')
 
+        if self.img_dedup:
+            # Image features are projected once per unique image
+            init_state = init_state[x_img_idx]
+
         # word embedding (target), we will shift the target sequence one time step
         # to the right. This is done because of the bi-gram connections in the
         # readout and decoder rnn. The first target will be all zeros and we will
@@ -183,6 +204,10 @@ class Model(Attention):
 
         logit = dropout(tanh(logit), self._trng, self.out_dropout, self._use_dropout)
 
+        if self.sampled_softmax > 0:
+            # Training cost over a subset of the target vocabulary
+            sampled_cost = self.get_sampled_cost(logit, y, y_mask)
+
         if self.tied_emb is False:
             logit = get_new_layer('ff')[1](self.tparams, logit, prefix='ff_logit', activ='linear')
         else:
@@ -207,6 +232,10 @@ class Model(Attention):
         #penalty = (0.002*T.arange(n_timesteps_trg)**2) + 1
         #return ((cost * penalty[:, None]) * y_mask).sum(0)
 
+        if self.sampled_softmax > 0:
+            # Validation loss still uses the full softmax through f_log_probs
+            return sampled_cost
+
         return cost
 
     def build_sampler(self, **kwargs):
@@ -266,7 +295,7 @@ class Model(Attention):
         logit = get_new_layer('ff')[1](self.tparams, next_state, prefix='ff_logit_gru', activ='linear')
 
         if not self.simple_output:
-            logit += get_new_layer('ff')[1](self.tparams, emb, prefix='ff_logit_prev',activ='linear')
+            logit += self.get_prev_logits(y)
             logit += get_new_layer('ff')[1](self.tparams, ctxs,prefix='ff_logit_ctx', activ='linear')
 
         logit = tanh(logit)
@@ -50,13 +50,15 @@ class Optimizer(object, metaclass=ABCMeta):
         self.history[name] = theano.shared(value, name)
         return self.history[name]
 
-    def get_history(self):
+    def get_history(self, borrow=False):
         """Returns a dictionary of numpy tensors for history variables."""
+        if borrow:
+            return OrderedDict((k, v.get_value(borrow=True)) for k, v in self.history.items())
         return unzip(self.history)
 
     def set_lrate(self, lrate):
         """Update the internal lrate."""
-        self.lr.set_value(lrate)
+        self.lr.set_value(np.float64(lrate).astype(FLOAT))
 
     @abstractmethod
     def get_updates(self, tparams, grads, history=None):
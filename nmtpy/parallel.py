@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+import os
+import threading
+import multiprocessing as mp
+
+import numpy as np
+
+from .defaults import FLOAT
+
+# Synchronous data-parallel training on a single node:
+#   - nmt-train builds the model once and forks n_workers - 1 processes
+#     with fork_workers() so that compiled functions, training data and
+#     RNG states are shared as copy-on-write memory.
+#   - Every worker trains on a disjoint shard of the training minibatches
+#     (Iterator.shard()) and accumulates its gradients locally.
+#   - SharedAllReduce sums the gradient accumulators through shared memory,
+#     each worker reducing an equal chunk, so every replica applies the
+#     same optimizer update.
+#   - Rank 0 validates, saves checkpoints and broadcasts its learning rate
+#     and early-stopping decision to the others.
+
+class TrainingStopped(Exception):
+    """Raised by SharedAllReduce in the workers once rank 0 stops."""
+    pass
+
+class SharedAllReduce(object):
+    """Sums lists of numpy arrays across worker processes. It should be
+    created before forking and attach()'ed by every worker afterwards."""
+    def __init__(self, n_workers, size):
+        self.n_workers  = n_workers
+        self.size       = size
+        self.rank       = None
+
+        # A slot per worker for the local values and the reduced values
+        typecode        = np.dtype(FLOAT).char
+        self.__slots    = mp.RawArray(typecode, n_workers * size)
+        self.__result   = mp.RawArray(typecode, size)
+
+        # Learning rate and stop flag broadcasted by rank 0
+        self.__lrate    = mp.RawValue('d', 0.)
+        self.__stop     = mp.RawValue('i', 0)
+
+        self.__barrier  = mp.Barrier(n_workers)
+
+    def attach(self, rank):
+        """Sets the rank of the calling process."""
+        self.rank   = rank
+        self.slots  = np.frombuffer(self.__slots, dtype=FLOAT).reshape(self.n_workers, self.size)
+        self.result = np.frombuffer(self.__result, dtype=FLOAT)
+
+        # The chunk of the arrays that this worker reduces
+        bounds = np.linspace(0, self.size, self.n_workers + 1).astype(np.int64)
+        self.chunk = slice(bounds[rank], bounds[rank + 1])
+
+    def __wait(self):
+        try:
+            self.__barrier.wait()
+        except threading.BrokenBarrierError:
+            if self.__stop.value:
+                raise TrainingStopped()
+            raise
+
+    def all_reduce(self, arrays, lrate=None):
+        """Replaces arrays with their sums over all workers in-place and
+        returns the learning rate of rank 0."""
+        slot = self.slots[self.rank]
+        offset = 0
+        for arr in arrays:
+            slot[offset:offset + arr.size] = arr.ravel()
+            offset += arr.size
+
+        if self.rank == 0:
+            self.__lrate.value = lrate
+
+        # Wait for every slot to be written
+        self.__wait()
+        np.sum(self.slots[:, self.chunk], axis=0, out=self.result[self.chunk])
+        lrate = self.__lrate.value
+
+        # Wait for every chunk to be reduced
+        self.__wait()
+        offset = 0
+        for arr in arrays:
+            np.copyto(arr, self.result[offset:offset + arr.size].reshape(arr.shape))
+            offset += arr.size
+
+        return lrate
+
+    def stop(self):
+        """Called by rank 0 to stop the other workers."""
+        self.__stop.value = 1
+        self.__barrier.abort()
+
+    def abort(self):
+        """Releases the workers waiting for a failed process."""
+        self.__barrier.abort()
+
+def fork_workers(n_workers):
+    """Forks n_workers - 1 processes. Returns the rank of the calling process
+    and the list of worker PIDs which is only filled for rank 0."""
+    pids = []
+    for rank in range(1, n_workers):
+        pid = os.fork()
+        if pid == 0:
+            return rank, []
+        pids.append(pid)
+    return 0, pids
+
+def wait_workers(pids):
+    """Waits for the forked workers and returns their exit codes."""
+    return [os.waitpid(pid, 0)[1] >> 8 for pid in pids]
+
+def trng_offset(rank, n_workers, avg_rank=0, avg_workers=1, uctr=0):
+    """Returns the offset of the Theano RNG seed of a data-parallel worker or
+    averaging node, 0 for rank 0 of node 0 which keeps its own RNG states.
+    When resuming, every worker restores the RNG states saved by rank 0 so
+    the update counter is mixed in: the others do not replay the dropout
+    masks and samples that they drew during the first updates."""
+    offset = avg_rank * n_workers + rank
+    if offset == 0:
+        return 0
+    return offset + uctr * n_workers * avg_workers
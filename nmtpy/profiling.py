@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+import time
+import atexit
+from collections import OrderedDict
+
+# Profiling of compiled Theano functions, enabled by the 'profile' training
+# option of nmt-train and -p/--profile of nmt-translate and nmt-rescore.
+# For a given prefix, the following reports are written at exit:
+#   <prefix>.theano.txt : Theano's per-function, per-op and per-apply-node
+#                         time summaries
+#   <prefix>.calls.txt  : Number of calls and wall-clock times of the
+#                         profiled functions as seen from Python
+# Decoding workers of nmt-translate write both reports for their own calls
+# into <prefix>.worker<idx>.txt as they do not run exit handlers.
+
+class CallTimer(object):
+    """Wraps a function to measure its number of calls and wall-clock times."""
+    def __init__(self, func, name):
+        self.func       = func
+        self.name       = name
+        self.n_calls    = 0
+        self.total      = 0.
+        self.max        = 0.
+
+    def __call__(self, *args, **kwargs):
+        start = time.time()
+        result = self.func(*args, **kwargs)
+        elapsed = time.time() - start
+
+        self.n_calls += 1
+        self.total += elapsed
+        self.max = max(self.max, elapsed)
+        return result
+
+    def __getattr__(self, name):
+        # Expose the attributes of the wrapped function, e.g. profile
+        return getattr(self.func, name)
+
+class Profiler(object):
+    """Enables Theano profiling and times the calls to the compiled
+    functions of models wrapped with wrap()."""
+    def __init__(self, prefix, at_exit=True):
+        import theano
+
+        self.prefix = prefix
+        self.timers = OrderedDict()
+
+        # Every function compiled from now on will be profiled
+        theano.config.profile = True
+        theano.config.profiling.destination = '%s.theano.txt' % prefix
+
+        if at_exit:
+            atexit.register(self.write)
+
+    def wrap(self, obj, names):
+        """Replaces the functions given by attribute names of obj, e.g. a
+        model, with timed versions. Missing attributes are skipped."""
+        for name in names:
+            func = getattr(obj, name, None)
+            if func is not None and not isinstance(func, CallTimer):
+                # Ensembles have functions of the same name
+                key = name
+                idx = 1
+                while key in self.timers:
+                    idx += 1
+                    key = '%s.%d' % (name, idx)
+                self.timers[key] = CallTimer(func, key)
+                setattr(obj, name, self.timers[key])
+
+    def write_calls(self, f):
+        """Writes the wall-clock time table into the file object f."""
+        total = sum(t.total for t in self.timers.values())
+        f.write('%-20s %10s %12s %12s %12s %8s\n' % ('function', 'calls', 'total (s)',
+                                                     'mean (ms)', 'max (ms)', '%'))
+        for t in sorted(self.timers.values(), key=lambda t: t.total, reverse=True):
+            mean = t.total / max(t.n_calls, 1)
+            f.write('%-20s %10d %12.3f %12.3f %12.3f %8.2f\n' % (t.name, t.n_calls, t.total,
+                                                                 1000 * mean, 1000 * t.max,
+                                                                 100 * t.total / max(total, 1e-9)))
+
+    def write(self):
+        """Writes the wall-clock time table. Theano writes its own report."""
+        with open('%s.calls.txt' % self.prefix, 'w') as f:
+            self.write_calls(f)
+
+    def write_worker(self, idx):
+        """Writes both reports of a worker process into a single file."""
+        with open('%s.worker%d.txt' % (self.prefix, idx), 'w') as f:
+            self.write_calls(f)
+            for t in self.timers.values():
+                if t.n_calls > 0 and getattr(t.func, 'profile', None):
+                    f.write('\n')
+                    t.func.profile.summary(file=f)
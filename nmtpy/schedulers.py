@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+from .metrics import is_last_best
+
+
+def get_scheduler(name):
+    schedulers = {
+            'noam'      : InverseSqrt,
+            'step'      : StepDecay,
+            'plateau'   : ReduceOnPlateau,
+            }
+    return schedulers[name]
+
+class Scheduler(object):
+    def __init__(self, lr0, min_lr=0.):
+        # Initial and minimum learning rates
+        self.lr0    = lr0
+        self.min_lr = min_lr
+
+    def get_lrate(self, uctr):
+        """Returns the learning rate for the update following uctr updates."""
+        return self.lr0
+
+    def on_validation(self, metric, history):
+        """Called after each validation with the early-stopping metric
+        history. Returns True if the learning rate is changed."""
+        return False
+
+    def follow(self, lrate):
+        """Called on the workers that do not validate with the learning
+        rate of rank 0. Schedules only depending on updates ignore it."""
+        pass
+
+    def get_state(self):
+        """Returns a dict that will be saved with snapshots."""
+        return {}
+
+    def set_state(self, state):
+        """Restores the state returned by get_state()."""
+        self.__dict__.update(state)
+
+###############################
+# Linear warmup + inverse sqrt
+###############################
+class InverseSqrt(Scheduler):
+    """Increases the lrate linearly to lr0 in warmup updates and
+    decays it proportionally to the inverse square root of updates."""
+    def __init__(self, lr0, warmup=4000, min_lr=0., **kwargs):
+        super(InverseSqrt, self).__init__(lr0, min_lr)
+        self.warmup = max(warmup, 1)
+
+    def get_lrate(self, uctr):
+        step = uctr + 1
+        lrate = self.lr0 * min(step / self.warmup, (self.warmup / step) ** 0.5)
+        return max(lrate, self.min_lr)
+
+############
+# Step decay
+############
+class StepDecay(Scheduler):
+    """Multiplies the lrate by factor after each decay_freq updates."""
+    def __init__(self, lr0, factor=0.5, decay_freq=10000, min_lr=0., **kwargs):
+        super(StepDecay, self).__init__(lr0, min_lr)
+        self.factor     = factor
+        self.decay_freq = decay_freq
+
+    def get_lrate(self, uctr):
+        lrate = self.lr0 * self.factor ** (uctr // self.decay_freq)
+        return max(lrate, self.min_lr)
+
+###################
+# Reduce on plateau
+###################
+class ReduceOnPlateau(Scheduler):
+    """Multiplies the lrate by factor if the early-stopping metric does
+    not improve for patience consecutive validations."""
+    def __init__(self, lr0, factor=0.5, patience=2, min_lr=0., min_delta=0., **kwargs):
+        super(ReduceOnPlateau, self).__init__(lr0, min_lr)
+        self.factor     = factor
+        self.patience   = patience
+        self.min_delta  = min_delta
+
+        # Current lrate and number of validations without improvement
+        self.lrate      = lr0
+        self.n_bad      = 0
+
+    def get_lrate(self, uctr):
+        return self.lrate
+
+    def on_validation(self, metric, history):
+        if is_last_best(metric, history, self.min_delta):
+            self.n_bad = 0
+            return False
+
+        self.n_bad += 1
+        if self.n_bad < self.patience or self.lrate <= self.min_lr:
+            return False
+
+        self.n_bad = 0
+        self.lrate = max(self.lrate * self.factor, self.min_lr)
+        return True
+
+    def follow(self, lrate):
+        self.lrate = lrate
+
+    def get_state(self):
+        return {'lrate' : self.lrate, 'n_bad' : self.n_bad}
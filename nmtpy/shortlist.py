@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+import heapq
+import pickle as pkl
+from collections import Counter
+
+import numpy as np
+
+from .defaults import INT
+from .sysutils import fopen
+
+# Lexical shortlists restrict the output layer of beam search to the
+# target words that are likely for a given source sentence:
+#   - nmt-build-shortlist scores source/target word pairs co-occurring in
+#     the sentence pairs of a parallel corpus with the Dice coefficient and
+#     pickles the best n target words of every source word. The corpus is
+#     read twice: first to count the words, then to count the pairs of the
+#     words occurring at least min_count times, optionally restricted to the
+#     most frequent target words. As the pair counts of a large corpus do
+#     not fit in memory, those of each source word are periodically pruned
+#     to its best candidates so far.
+#   - nmt-translate -l loads the table and for each source sentence, passes
+#     the sorted union of the candidates of its words and of the top_k most
+#     frequent target words to beam_search() which feeds it to f_next().
+
+def build_table(src_file, trg_file, n_cands=50, min_count=2, n_words_trg=0, prune_every=100000):
+    """Returns a dict of source words to their n_cands best target words.
+    Only the n_words_trg most frequent target words are considered if > 0.
+    Every prune_every sentences (never if 0), only the 10 * n_cands best
+    target words of each source word are kept, which makes the counts of
+    the pairs found again afterwards approximate."""
+    src_counts = Counter()
+    trg_counts = Counter()
+
+    with fopen(src_file) as fs, fopen(trg_file) as ft:
+        for src, trg in zip(fs, ft):
+            src_counts.update(set(src.split()))
+            trg_counts.update(set(trg.split()))
+
+    # A pair can not co-occur more often than any of its words
+    src_vocab = set(w for w, c in src_counts.items() if c >= min_count)
+    trg_vocab = set(w for w, c in trg_counts.most_common(n_words_trg or None) if c >= min_count)
+
+    def dice(s, t, count):
+        return 2. * count / (src_counts[s] + trg_counts[t])
+
+    def prune(n):
+        for s, counts in pair_counts.items():
+            if len(counts) > n:
+                best = heapq.nlargest(n, counts.items(), key=lambda tc: dice(s, *tc))
+                pair_counts[s] = Counter(dict(best))
+
+    # Source word -> Counter of co-occurring target words
+    pair_counts = {}
+
+    with fopen(src_file) as fs, fopen(trg_file) as ft:
+        for idx, (src, trg) in enumerate(zip(fs, ft), 1):
+            trg = trg_vocab.intersection(trg.split())
+            if trg:
+                for s in src_vocab.intersection(src.split()):
+                    pair_counts.setdefault(s, Counter()).update(trg)
+            if prune_every > 0 and idx % prune_every == 0:
+                prune(10 * n_cands)
+
+    table = {}
+    for s, counts in pair_counts.items():
+        cands = sorted(((dice(s, t, c), t) for t, c in counts.items() if c >= min_count), reverse=True)
+        if cands:
+            table[s] = [t for _, t in cands[:n_cands]]
+
+    return table
+
+def write_table(fname, table):
+    with fopen(fname, 'wb') as f:
+        pkl.dump(table, f)
+
+class Shortlist(object):
+    """Maps source sentences to target vocabulary subsets."""
+    def __init__(self, fname, src_dict, trg_dict, n_words_trg, top_k=1000):
+        with fopen(fname, 'rb') as f:
+            table = pkl.load(f)
+
+        # The most frequent target words, including <eos> and <unk>
+        self.top_k = np.arange(min(max(top_k, 2), n_words_trg), dtype=INT)
+
+        # Source word idx -> target word idxs within the shortlist size
+        self.cands = {}
+        for src_word, trg_words in table.items():
+            if src_word in src_dict:
+                idxs = [trg_dict[w] for w in trg_words if trg_dict.get(w, n_words_trg) < n_words_trg]
+                self.cands[src_dict[src_word]] = np.array(idxs, dtype=INT)
+
+    def get(self, src_idxs):
+        """Returns the sorted target word idxs for a source sentence given as
+        an array of word idxs. As the top_k words come first, <eos> and <unk>
+        keep their positions 0 and 1 in the subset."""
+        subset = [self.top_k] + [self.cands[idx] for idx in set(src_idxs.flatten().tolist()) if idx in self.cands]
+        return np.unique(np.concatenate(subset))
@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+import os
+import copy
+import queue
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+# A training snapshot is a single .npz file holding everything that is
+# needed to resume an interrupted training:
+#   opts        : Model options
+#   state       : Pickled dict of training loop counters, validation
+#                 history, numpy/Python RNG states and learning rate
+#   p/<name>    : Model parameters
+#   h/<name>    : Optimizer accumulators, e.g. Adam's m, v and i
+#   r/<idx>     : Theano RNG states
+#   it/<name>   : Position of the training iterator (if restorable)
+# Snapshots and model checkpoints are written into a temporary file which
+# is then renamed so that a job killed while saving never leaves a
+# truncated file behind. CheckpointWriter does this in a background
+# thread so that training only waits for the arrays to be copied.
+
+def write_npz(fname, arrays):
+    """Atomically saves a dict of arrays into the .npz file fname."""
+    with open(fname + '.tmp', 'wb') as f:
+        np.savez(f, **arrays)
+    os.rename(fname + '.tmp', fname)
+
+def pack_snapshot(opts, state, params, history, trng_state, iter_state=None):
+    """Returns the dict of arrays that is saved as a training snapshot."""
+    kwargs = OrderedDict()
+    kwargs['opts'] = opts
+    kwargs['state'] = state
+
+    for prefix, arrays in [('p', params), ('h', history), ('it', iter_state or {})]:
+        for name, value in arrays.items():
+            kwargs['%s/%s' % (prefix, name)] = value
+
+    for idx, value in enumerate(trng_state):
+        kwargs['r/%d' % idx] = value
+
+    return kwargs
+
+def save_snapshot(fname, *args, **kwargs):
+    """Saves a training snapshot into fname."""
+    write_npz(fname, pack_snapshot(*args, **kwargs))
+
+def load_snapshot(fname):
+    """Loads a training snapshot saved by save_snapshot()."""
+    npz = np.load(fname, allow_pickle=True)
+
+    snapshot = {
+            'opts'      : npz['opts'].tolist(),
+            'state'     : npz['state'].tolist(),
+            'params'    : OrderedDict(),
+            'history'   : OrderedDict(),
+            'iter_state': OrderedDict(),
+            'trng_state': [],
+            }
+
+    sections = {'p' : 'params', 'h' : 'history', 'it' : 'iter_state'}
+    n_trng = 0
+    for key in npz.files:
+        prefix, _, name = key.partition('/')
+        if prefix in sections:
+            snapshot[sections[prefix]][name] = npz[key]
+        elif prefix == 'r':
+            n_trng += 1
+
+    snapshot['trng_state'] = [npz['r/%d' % idx] for idx in range(n_trng)]
+
+    # Streaming iterators restart their pass
+    if len(snapshot['iter_state']) == 0:
+        snapshot['iter_state'] = None
+
+    return snapshot
+
+class CheckpointWriter(object):
+    """Writes .npz files in a background thread. Arrays are first copied
+    into staging buffers that are reused by the following writes of the
+    same kind, e.g. 'model' or 'snapshot'."""
+    def __init__(self):
+        self.queue = queue.Queue()
+
+        # Staging buffers and pending write events for each kind
+        self.buffers = {}
+        self.pending = {}
+
+        # An exception raised by the writer thread, re-raised by wait()
+        self.error = None
+
+        self.thread = threading.Thread(target=self.__run, daemon=True)
+        self.thread.start()
+
+    def __run(self):
+        while True:
+            job = self.queue.get()
+            if job is None:
+                break
+
+            fname, arrays, callback, done = job
+            try:
+                write_npz(fname, arrays)
+                if callback:
+                    callback()
+            except Exception as e:
+                self.error = e
+            finally:
+                done.set()
+
+    def __stage(self, kind, arrays):
+        """Copies arrays into the staging buffers of kind."""
+        buffers = self.buffers.setdefault(kind, {})
+        staged = OrderedDict()
+        for name, value in arrays.items():
+            if isinstance(value, np.ndarray):
+                buf = buffers.get(name, None)
+                if buf is None or buf.shape != value.shape or buf.dtype != value.dtype:
+                    buf = buffers[name] = np.empty_like(value)
+                np.copyto(buf, value)
+                staged[name] = buf
+            else:
+                # Options and pickled state that training may modify
+                staged[name] = copy.deepcopy(value)
+        return staged
+
+    def write(self, fname, arrays, kind='model', callback=None):
+        """Queues arrays to be saved into fname. callback is called from
+        the writer thread once the file is complete."""
+        # The staging buffers are busy until the previous write is done
+        self.wait(kind)
+
+        done = threading.Event()
+        self.pending[kind] = done
+        self.queue.put((fname, self.__stage(kind, arrays), callback, done))
+
+    def wait(self, kind=None):
+        """Blocks until the pending writes (of kind if given) are done."""
+        kinds = [kind] if kind else list(self.pending)
+        for k in kinds:
+            if k in self.pending:
+                self.pending.pop(k).wait()
+
+        if self.error:
+            error, self.error = self.error, None
+            raise error
+
+    def close(self):
+        """Waits for the pending writes and stops the writer thread."""
+        self.queue.put(None)
+        self.thread.join()
+        self.wait()
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+import os
+import csv
+import json
+import time
+import queue
+import threading
+from collections import OrderedDict
+
+# Training statistics are events, i.e. flat dicts with the following keys
+# followed by the values of the event:
+#   time : UNIX timestamp
+#   kind : 'update', 'interval', 'epoch' or 'valid'
+#   step : Update counter for 'update' and 'interval', epoch counter for
+#          'epoch' and validation counter for 'valid'
+# StatsWriter passes them to the sinks in a background thread.
+
+def get_sink(name):
+    sinks = {
+            'jsonl'     : JSONLinesSink,
+            'csv'       : CSVSink,
+            }
+    return sinks[name]
+
+def get_rss():
+    """Returns the resident memory of this process in MiB."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024.**2
+    except (IOError, OSError, ValueError):
+        # Peak RSS in KiB on Linux
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+
+def to_builtin(value):
+    """Converts numpy scalars to Python numbers for serialization."""
+    return value.item() if hasattr(value, 'item') else value
+
+def read_stats(fname, kind=None):
+    """Returns the events of a .stats.jsonl file, optionally of a given kind."""
+    events = []
+    with open(fname) as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                event = json.loads(line, object_pairs_hook=OrderedDict)
+                if kind is None or event['kind'] == kind:
+                    events.append(event)
+    return events
+
+class JSONLinesSink(object):
+    """Appends every event as a line of JSON into <prefix>.stats.jsonl."""
+    def __init__(self, prefix):
+        self.f = open('%s.stats.jsonl' % prefix, 'a')
+
+    def write(self, events):
+        for event in events:
+            self.f.write(json.dumps(event, default=str) + '\n')
+        self.f.flush()
+
+    def close(self):
+        self.f.close()
+
+class CSVSink(object):
+    """Appends events into a <prefix>.<kind>.csv file for each kind. The
+    columns are taken from the first event of a kind."""
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self.files = {}
+        self.writers = {}
+
+    def __get_writer(self, event):
+        kind = event['kind']
+        if kind not in self.writers:
+            fname = '%s.%s.csv' % (self.prefix, kind)
+            fields = list(event.keys())
+            if os.path.exists(fname) and os.path.getsize(fname) > 0:
+                # Continue with the columns of a resumed training
+                with open(fname) as f:
+                    fields = next(csv.reader(f))
+                self.files[kind] = open(fname, 'a', newline='')
+                self.writers[kind] = csv.DictWriter(self.files[kind], fields, extrasaction='ignore')
+            else:
+                self.files[kind] = open(fname, 'w', newline='')
+                self.writers[kind] = csv.DictWriter(self.files[kind], fields, extrasaction='ignore')
+                self.writers[kind].writeheader()
+        return self.writers[kind]
+
+    def write(self, events):
+        for event in events:
+            self.__get_writer(event).writerow(event)
+        for f in self.files.values():
+            f.flush()
+
+    def close(self):
+        for f in self.files.values():
+            f.close()
+
+class StatsWriter(object):
+    """Buffers events and writes them to the sinks in a background thread
+    at most every flush_secs seconds so that training never waits for I/O."""
+    def __init__(self, prefix, sinks=('jsonl',), flush_secs=10.):
+        self.sinks = [get_sink(name)(prefix) for name in sinks]
+        self.flush_secs = flush_secs
+        self.queue = queue.Queue()
+
+        self.thread = threading.Thread(target=self.__run, daemon=True)
+        self.thread.start()
+
+    def __run(self):
+        events = []
+        last_flush = time.time()
+        running = True
+        while running:
+            try:
+                event = self.queue.get(timeout=self.flush_secs)
+                if event is None:
+                    running = False
+                else:
+                    events.append(event)
+            except queue.Empty:
+                pass
+
+            if events and (not running or time.time() - last_flush >= self.flush_secs):
+                for sink in self.sinks:
+                    sink.write(events)
+                events = []
+                last_flush = time.time()
+
+        for sink in self.sinks:
+            sink.close()
+
+    def add(self, kind, step, **values):
+        """Queues an event."""
+        event = OrderedDict([('time', time.time()), ('kind', kind), ('step', step)])
+        event.update((k, to_builtin(v)) for k, v in values.items())
+        self.queue.put(event)
+
+    def close(self):
+        """Writes the buffered events and stops the writer thread."""
+        self.queue.put(None)
+        self.thread.join()
@@ -145,10 +145,15 @@ def get_temp_file(suffix="", name=None, delete=False):
     return t
 
 def get_valid_evaluation(save_path, beam_size, n_jobs, metric,
-                         trans_cmd='nmt-translate', f_valid_out=None, factors=None):
-    """Run nmt-translate for validation during training."""
+                         trans_cmd='nmt-translate', f_valid_out=None, factors=None, timings=None):
+    """Run nmt-translate for validation during training. If a timings dict
+    is given, the seconds spent computing metrics are stored as 'scoring'."""
     cmd = [trans_cmd, "-b", str(beam_size), "-j", str(n_jobs), "-m", save_path]
     cmd.extend(["-M"] + metric.split(','))
+    if timings is not None:
+        timef = get_temp_file(suffix=".time")
+        timef.close()
+        cmd.extend(["-T", timef.name])
     # Factors option needs -fa option with the script and 2 output files
     if factors:
         cmd.extend(["-f", factors, "-o", f_valid_out+'.lem', f_valid_out+'.fact'])
@@ -166,6 +171,11 @@ def get_valid_evaluation(save_path, beam_size, n_jobs, metric,
     if p.returncode != 0:
         return None
 
+    if timings is not None:
+        with open(timef.name) as f:
+            timings['scoring'] = float(f.read().strip() or 0.)
+        os.remove(timef.name)
+
     out = out.splitlines()[-1]
     # Convert metrics back to dict
     return eval(out.strip())
@@ -178,16 +188,18 @@ def create_gpu_lock(used_gpu):
 
 def fopen(filename, mode=None):
     """GZ/BZ2/XZ-aware file opening function."""
-    # NOTE: Mode is not used but kept for not breaking iterators.
+    # NOTE: Text files are always opened for reading, the mode being kept
+    # for not breaking iterators. Binary modes e.g. 'rb', 'wb' are honored.
+    mode = mode if mode and 'b' in mode else 'rt'
     if filename.endswith('.gz'):
-        return gzip.open(filename, 'rt')
+        return gzip.open(filename, mode)
     elif filename.endswith('.bz2'):
-        return bz2.open(filename, 'rt')
+        return bz2.open(filename, mode)
     elif filename.endswith(('.xz', '.lzma')):
-        return lzma.open(filename, 'rt')
+        return lzma.open(filename, mode)
     else:
         # Plain text
-        return open(filename, 'r')
+        return open(filename, mode)
 
 def find_executable(fname):
     """Find executable in PATH."""
@@ -272,6 +284,12 @@ def get_exp_identifier(train_args, model_args, suffix=None):
     if train_args.clip_c > 0:
         name += "-gc%d" % int(train_args.clip_c)
 
+    if train_args.grad_accum > 1:
+        name += "-acc%d" % train_args.grad_accum
+
+    if train_args.n_workers > 1:
+        name += "-w%d" % train_args.n_workers
+
     if isinstance(model_args.weight_init, str):
         name += "-init_%s" % model_args.weight_init
     else:
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+# Phases of the training loop whose time is measured:
+#   data    : Fetching and padding minibatches from the training iterator
+#   train   : Forward/backward passes and weight updates
+#   sync    : Gradient all-reduce or parameter averaging across workers
+#   valid   : Validation loss
+#   beam    : Validation decoding with nmt-translate
+#   scoring : Computing validation metrics of the decoded hypotheses
+#   io      : Time training is blocked by checkpoint and snapshot saving
+# The remaining time is reported as 'other'.
+PHASES = ['data', 'train', 'sync', 'valid', 'beam', 'scoring', 'io']
+
+class StatsWindow(object):
+    """Counters of a time window, e.g. a display interval or an epoch."""
+    def __init__(self):
+        self.start  = time.time()
+        self.sents  = 0
+        self.times  = OrderedDict((phase, 0.) for phase in PHASES)
+
+        # Real and padded token counts of source and target sides
+        self.tokens = {'src' : 0., 'trg' : 0.}
+        self.slots  = {'src' : 0., 'trg' : 0.}
+
+    def summary(self):
+        """Returns a dict of rates, padding efficiencies and phase times."""
+        elapsed = max(time.time() - self.start, 1e-6)
+        stats = OrderedDict()
+        stats['elapsed']    = elapsed
+        stats['sents_sec']  = self.sents / elapsed
+        for side in ['src', 'trg']:
+            if self.slots[side] > 0:
+                stats['%s_tok_sec' % side] = self.tokens[side] / elapsed
+                stats['%s_pad_eff' % side] = self.tokens[side] / self.slots[side]
+
+        for phase, secs in self.times.items():
+            stats['time_%s' % phase] = secs
+        stats['time_other'] = max(elapsed - sum(self.times.values()), 0.)
+        return stats
+
+class Throughput(object):
+    """Counts the processed tokens and sentences and the time spent in
+    each phase of training over display intervals and epochs."""
+    def __init__(self):
+        self.interval   = StatsWindow()
+        self.epoch      = StatsWindow()
+
+        # Mask keys of source and target sides, found in the first minibatch
+        self.masks      = None
+
+    def new_interval(self):
+        self.interval = StatsWindow()
+
+    def new_epoch(self):
+        self.epoch = StatsWindow()
+        self.interval = StatsWindow()
+
+    def add_time(self, phase, secs):
+        self.interval.times[phase] += secs
+        self.epoch.times[phase] += secs
+
+    @contextmanager
+    def timer(self, phase):
+        """Measures the time spent in a with block."""
+        start = time.time()
+        yield
+        self.add_time(phase, time.time() - start)
+
+    def timed(self, iterator):
+        """Yields the minibatches of iterator by measuring their data time."""
+        iterator = iter(iterator)
+        while True:
+            start = time.time()
+            try:
+                data = next(iterator)
+            except StopIteration:
+                self.add_time('data', time.time() - start)
+                return
+            self.add_time('data', time.time() - start)
+            yield data
+
+    def add_batch(self, data):
+        """Counts the sentences and tokens of a minibatch dict."""
+        if self.masks is None:
+            # The last mask belongs to the target side, e.g. x_mask, y_mask
+            masks = [k for k in data if k.endswith('_mask')]
+            self.masks = OrderedDict()
+            if len(masks) > 1:
+                self.masks['src'] = masks[0]
+            if len(masks) > 0:
+                self.masks['trg'] = masks[-1]
+
+        for window in [self.interval, self.epoch]:
+            for side, key in self.masks.items():
+                mask = data[key]
+                window.tokens[side] += float(mask.sum())
+                window.slots[side] += mask.size
+            if 'trg' in self.masks:
+                window.sents += data[self.masks['trg']].shape[1]
+
+    @staticmethod
+    def format(stats):
+        """Returns the throughput and time breakdown lines of a summary()."""
+        speed = ['%d sents/s' % stats['sents_sec']]
+        for side in ['src', 'trg']:
+            if '%s_tok_sec' % side in stats:
+                speed.append('%d %s tok/s (%.1f%% non-pad)' % (stats['%s_tok_sec' % side], side,
+                                                               100 * stats['%s_pad_eff' % side]))
+
+        times = []
+        for phase in PHASES + ['other']:
+            secs = stats['time_%s' % phase]
+            if secs > 0:
+                times.append('%s %.1fs (%.1f%%)' % (phase, secs, 100 * secs / stats['elapsed']))
+
+        return ['Speed: %s' % ', '.join(speed), 'Time: %s' % ', '.join(times)]
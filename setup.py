@@ -40,11 +40,16 @@ setup(
         ],
         scripts=[
                     'bin/nmt-train',
+                    'bin/nmt-coordinator',
+                    'bin/nmt-stats',
                     'bin/nmt-extract',
                     'bin/nmt-rescore',
                     'bin/nmt-translate',
                     'bin/nmt-translate-factors', # Factored NMT variant.
                     'bin/nmt-build-dict',
+                    'bin/nmt-build-shortlist',
+                    'bin/nmt-binarize',
+                    'bin/nmt-convert-feats',
                     'bin/nmt-coco-metrics',
                     'bin/nmt-bpe-apply',
                     'bin/nmt-bpe-learn',
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+from collections import OrderedDict
+
+import numpy as np
+import pytest
+
+theano = pytest.importorskip('theano')
+tensor = theano.tensor
+
+from nmtpy.models.attention import Model
+
+
+def _logsoftmax(x):
+    x = x - x.max(-1, keepdims=True)
+    return x - np.log(np.exp(x).sum(-1, keepdims=True))
+
+
+def _model(n_words_trg, dim, seed=1):
+    """A bare attention model with only the output layer parameters."""
+    rng = np.random.RandomState(seed)
+    model = Model.__new__(Model)
+    model.set_trng(seed)
+    model.n_words_trg = n_words_trg
+    model.tied_emb = False
+    model.trg_emb_name = 'Wemb_dec'
+    model.tparams = OrderedDict()
+    for name, shape in [('ff_logit_W', (dim, n_words_trg)), ('ff_logit_b', (n_words_trg, )),
+                        ('Wemb_dec', (n_words_trg, dim))]:
+        model.tparams[name] = theano.shared(rng.randn(*shape).astype('float32'), name=name)
+    return model
+
+
+def test_sampled_softmax_with_all_words_sampled():
+    # With many samples from a tiny vocabulary, every word is a candidate
+    # and the sampled cost is the cost of the full softmax
+    model = _model(n_words_trg=5, dim=3)
+    model.sampled_softmax = 500
+
+    logit = tensor.tensor3('logit', dtype='float32')
+    y = tensor.matrix('y', dtype='int64')
+    y_mask = tensor.matrix('y_mask', dtype='float32')
+    f_cost = theano.function([logit, y, y_mask], model.get_sampled_cost(logit, y, y_mask))
+
+    rng = np.random.RandomState(2)
+    x = rng.randn(4, 2, 3).astype('float32')
+    targets = rng.randint(5, size=(4, 2))
+    mask = np.ones((4, 2), dtype='float32')
+    mask[3, 1] = 0
+
+    W = model.tparams['ff_logit_W'].get_value()
+    b = model.tparams['ff_logit_b'].get_value()
+    log_probs = _logsoftmax(np.dot(x, W) + b)
+    ref = -np.take_along_axis(log_probs, targets[..., None], axis=-1)[..., 0]
+    assert np.allclose(f_cost(x, targets, mask), (ref * mask).sum(0), atol=1e-5)
+
+
+def test_sampled_softmax_normalizes_over_candidates():
+    model = _model(n_words_trg=1000, dim=3)
+    model.sampled_softmax = 10
+
+    logit = tensor.tensor3('logit', dtype='float32')
+    y = tensor.matrix('y', dtype='int64')
+    y_mask = tensor.matrix('y_mask', dtype='float32')
+    f_cost = theano.function([logit, y, y_mask], model.get_sampled_cost(logit, y, y_mask))
+
+    x = np.random.RandomState(3).randn(3, 2, 3).astype('float32')
+    targets = np.array([[1, 2], [3, 4], [5, 6]])
+    mask = np.ones((3, 2), dtype='float32')
+
+    W = model.tparams['ff_logit_W'].get_value()
+    b = model.tparams['ff_logit_b'].get_value()
+    full = -np.take_along_axis(_logsoftmax(np.dot(x, W) + b), targets[..., None], axis=-1)[..., 0]
+    cost = f_cost(x, targets, mask)
+    # Less candidates than the vocabulary: a lower bound of the full cost
+    assert (cost > 0).all() and (cost < full.sum(0)).all()
+
+
+def test_prev_logits_table():
+    model = _model(n_words_trg=7, dim=3)
+    rng = np.random.RandomState(4)
+    model.tparams['ff_logit_prev_W'] = theano.shared(rng.randn(3, 4).astype('float32'))
+    model.tparams['ff_logit_prev_b'] = theano.shared(rng.randn(4).astype('float32'))
+
+    y = tensor.vector('y', dtype='int64')
+    f_prev = theano.function([y], model.get_prev_logits(y))
+
+    emb = model.tparams['Wemb_dec'].get_value()
+    W = model.tparams['ff_logit_prev_W'].get_value()
+    b = model.tparams['ff_logit_prev_b'].get_value()
+    words = np.array([-1, 0, 3, 6, 3])
+    out = f_prev(words)
+
+    # Projections of the previous word embeddings, only the bias at first step
+    assert out.shape == (5, 4)
+    assert np.allclose(out[1:], np.dot(emb[words[1:]], W) + b, atol=1e-5)
+    assert np.allclose(out[0], b)
@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+import threading
+
+import numpy as np
+
+from nmtpy.averaging import AveragingClient, Coordinator
+
+
+def _start(n_workers, timeout=60.):
+    coordinator = Coordinator(0, n_workers, timeout=timeout, host='127.0.0.1')
+    address = '127.0.0.1:%d' % coordinator.server.getsockname()[1]
+    thread = threading.Thread(target=coordinator.serve, daemon=True)
+    thread.start()
+    return coordinator, address, thread
+
+
+def _run(clients, args):
+    """Calls average() of every client in its own thread."""
+    results = [None] * len(clients)
+
+    def run(i):
+        results[i] = clients[i].average(*args[i])
+
+    threads = [threading.Thread(target=run, args=(i, )) for i in range(len(clients))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join(10)
+    return results
+
+
+def test_average_and_lrate():
+    coordinator, address, thread = _start(3)
+    clients = [AveragingClient(address, rank, 3) for rank in range(3)]
+    params = [[np.full((2, 2), rank, dtype='float32'), np.arange(3, dtype='float32') * rank]
+              for rank in range(3)]
+
+    # Only rank 0 gives its learning rate
+    results = _run(clients, [(params[0], 0.5), (params[1], ), (params[2], )])
+    assert results == [True] * 3
+    for client, arrays in zip(clients, params):
+        assert client.round == 1
+        assert client.lrate == 0.5
+        assert np.array_equal(arrays[0], np.ones((2, 2)))
+        assert np.array_equal(arrays[1], np.arange(3))
+
+    # A decayed lrate of rank 0 reaches the others in the next round
+    _run(clients, [(params[0], 0.25), (params[1], ), (params[2], )])
+    assert [c.lrate for c in clients] == [0.25] * 3
+
+    # Rank 0 early-stops
+    clients[0].stop()
+    assert _run(clients[1:], [(params[1], ), (params[2], )]) == [False, False]
+    for client in clients[1:]:
+        client.close()
+    thread.join(10)
+    assert not thread.is_alive()
+
+
+def test_straggler_gets_last_average():
+    coordinator, address, thread = _start(2, timeout=0.2)
+    clients = [AveragingClient(address, rank, 2) for rank in range(2)]
+
+    # Rank 1 misses the first round
+    arrays0 = [np.full(4, 2., dtype='float32')]
+    assert clients[0].average(arrays0, 1e-3)
+    assert np.array_equal(arrays0[0], np.full(4, 2.))
+    assert coordinator.round == 1
+
+    arrays1 = [np.zeros(4, dtype='float32')]
+    assert clients[1].average(arrays1)
+    assert np.array_equal(arrays1[0], np.full(4, 2.))
+    assert clients[1].lrate == 1e-3
+
+    for client in clients:
+        client.close()
+    thread.join(10)
+    assert not thread.is_alive()
+
+
+def test_broadcast_waits_for_rank0():
+    coordinator, address, thread = _start(3, timeout=0.1)
+    clients = [AveragingClient(address, rank, 3) for rank in range(3)]
+    params = [[np.full(4, rank + 1, dtype='float32')] for rank in range(3)]
+
+    # The others arrive first and wait beyond the timeout for rank 0
+    results = [None] * 3
+
+    def run(i):
+        results[i] = clients[i].average(params[i], 0.5 if i == 0 else None, True)
+
+    threads = [threading.Thread(target=run, args=(i, )) for i in (1, 2)]
+    for t in threads:
+        t.start()
+    threads[0].join(0.3)
+    assert coordinator.round == 0
+    run(0)
+    for t in threads:
+        t.join(10)
+
+    # Every node starts from the parameters and lrate of rank 0
+    assert results == [True] * 3
+    for client, arrays in zip(clients, params):
+        assert client.round == 1 and client.lrate == 0.5
+        assert np.array_equal(arrays[0], np.ones(4))
+
+    # Later rounds are averages
+    params[1][0][:] = 4.
+    _run(clients, [(params[0], 0.5), (params[1], ), (params[2], )])
+    assert all(np.array_equal(arrays[0], np.full(4, 2.)) for arrays in params)
+
+    for client in clients:
+        client.close()
+    thread.join(10)
+    assert not thread.is_alive()
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pytest
+
+pytest.importorskip('theano')
+
+from nmtpy.models.basefusion import ImageContextCache
+
+
+def test_image_context_cache():
+    calls = []
+
+    def f_text(x, x_img):
+        return [x.sum()]
+
+    def f_img(x_img):
+        calls.append(x_img)
+        return [x_img * 2, x_img.sum()]
+
+    f_init = ImageContextCache(f_text, f_img, cache_size=2)
+    img1, img2, img3 = [np.full((3, 1, 2), v, dtype='float32') for v in (1, 2, 3)]
+    x = np.ones((4, 1), dtype='int64')
+
+    outs = f_init(x, img1)
+    assert outs[0] == 4 and np.array_equal(outs[1], img1 * 2) and outs[2] == 6
+
+    # Another sentence of the same image reuses the image outputs
+    outs = f_init(x * 2, img1.copy())
+    assert outs[0] == 8 and outs[2] == 6
+    assert len(calls) == 1
+
+    # Least recently used images are evicted
+    f_init(x, img2)
+    f_init(x, img1)
+    f_init(x, img3)
+    assert len(calls) == 3
+    f_init(x, img1)
+    assert len(calls) == 3
+    f_init(x, img2)
+    assert len(calls) == 4
+
+
+def test_image_context_cache_disabled():
+    calls = []
+    f_init = ImageContextCache(lambda x, x_img: [], lambda x_img: calls.append(1) or [], cache_size=0)
+    img = np.zeros((3, 1, 2), dtype='float32')
+    f_init(None, img)
+    f_init(None, img)
+    assert len(calls) == 2 and len(f_init.cache) == 0
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+from collections import OrderedDict
+
+import numpy as np
+import pytest
+
+theano = pytest.importorskip('theano')
+tensor = theano.tensor
+
+from nmtpy.models.basemodel import BaseModel
+
+
+class Linear(BaseModel):
+    """Linear regression with a squared error per sample."""
+    def __init__(self):
+        super(Linear, self).__init__(optimizer='sgd', lrate=0.1)
+        self.tparams = OrderedDict()
+        self.tparams['W'] = theano.shared(np.ones(3, dtype='float32'), name='W')
+
+        x = tensor.matrix('x', dtype='float32')
+        t = tensor.vector('t', dtype='float32')
+        self.inputs = OrderedDict([('x', x), ('t', t)])
+        self.cost = (tensor.dot(x, self.tparams['W']) - t) ** 2
+
+    def load_data(self):
+        pass
+
+    def init_params(self):
+        pass
+
+    def build(self):
+        pass
+
+    def build_sampler(self, **kwargs):
+        pass
+
+
+def _data(n, seed):
+    rng = np.random.RandomState(seed)
+    return rng.randn(n, 3).astype('float32'), rng.randn(n).astype('float32')
+
+
+def test_accumulated_update_equals_large_batch():
+    x1, t1 = _data(2, 1)
+    x2, t2 = _data(5, 2)
+
+    ref = Linear()
+    ref.build_optimizer(ref.cost, None, 0)
+    ref.train_batch(np.concatenate((x1, x2)), np.concatenate((t1, t2)))
+
+    acc = Linear()
+    acc.build_optimizer(acc.cost, None, 0, accum_steps=2)
+    acc.train_batch(x1, t1)
+    acc.train_batch(x2, t2)
+    # Nothing is updated before apply_grads()
+    assert np.array_equal(acc.tparams['W'].get_value(), np.ones(3))
+    assert acc.get_accum_grads()[-1] == 7
+    acc.apply_grads()
+
+    assert np.allclose(acc.tparams['W'].get_value(), ref.tparams['W'].get_value(), atol=1e-6)
+    # Accumulators are reset
+    assert acc.get_accum_grads()[-1] == 0
+    assert not acc.get_accum_grads()[0].any()
+
+
+def test_reseed_trng():
+    def draws(offset=None):
+        model = Linear()
+        model.set_trng(1234)
+        f = theano.function([], model._trng.uniform((5,)))
+        if offset is not None:
+            model.reseed_trng(offset)
+        return f()
+
+    # Workers get different draws than rank 0 but they are reproducible
+    assert np.array_equal(draws(), draws(0))
+    assert not np.array_equal(draws(), draws(1))
+    assert np.array_equal(draws(1), draws(1))
+    assert not np.array_equal(draws(1), draws(2))
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pytest
+
+pytest.importorskip('theano')
+
+from nmtpy.models.attention import Model
+
+
+V = 30
+LOGP = np.log(np.random.RandomState(1).dirichlet(np.ones(V) * 0.3, size=V)).astype('float32')
+
+
+def f_init(x):
+    return [np.zeros((1, 4), dtype='float32'), np.zeros((x.shape[0], 1, 8), dtype='float32')]
+
+
+def f_next(y, state, ctx):
+    # Next word distributions only depend on the previous word
+    n = y.shape[0]
+    return LOGP[np.maximum(y, 0)], np.zeros((n, 4), dtype='float32'), np.zeros((n, ctx.shape[0]), dtype='float32')
+
+
+def test_beam_search_stats():
+    inputs = [np.zeros((6, 1), dtype='int64')]
+    ref = Model.beam_search(inputs, [f_init], [f_next], beam_size=4, maxlen=10)
+
+    stats = {}
+    out = Model.beam_search(inputs, [f_init], [f_next], beam_size=4, maxlen=10, stats=stats)
+    # Collecting statistics does not change the hypotheses
+    assert [list(h) for h in out[0]] == [list(h) for h in ref[0]]
+
+    n_steps = len(stats['next_times'])
+    # maxlen is at least 3 times the source length
+    assert stats['src_len'] == 6 and stats['maxlen'] == 18
+    assert 0 < n_steps <= 18
+    assert len(stats['step_times']) == len(stats['live_beams']) == n_steps
+    assert stats['live_beams'][0] == 1
+    assert max(stats['live_beams']) <= 4
+    assert stats['init_time'] >= 0.
+    if n_steps < 18:
+        assert not stats['maxlen_hit']
+
+
+def test_beam_search_stats_maxlen_hit():
+    def f_next_no_eos(y, state, ctx):
+        log_p, state, alpha = f_next(y, state, ctx)
+        log_p = log_p.copy()
+        log_p[:, 0] = -np.inf
+        return log_p, state, alpha
+
+    stats = {}
+    Model.beam_search([np.zeros((2, 1), dtype='int64')], [f_init], [f_next_no_eos],
+                      beam_size=3, maxlen=8, stats=stats)
+    assert stats['maxlen_hit']
+    assert len(stats['next_times']) == 8
+    assert stats['live_beams'] == [1] + [3] * 7
+
+
+def f_next_vocab(y, state, ctx, vocab):
+    # Softmax over the target vocabulary subset
+    log_p, state, alpha = f_next(y, state, ctx)
+    log_p = np.ascontiguousarray(log_p[:, vocab])
+    return log_p - np.log(np.exp(log_p).sum(1, keepdims=True)), state, alpha
+
+
+def test_beam_search_shortlist():
+    inputs = [np.zeros((6, 1), dtype='int64')]
+    ref = Model.beam_search(inputs, [f_init], [f_next], beam_size=4, maxlen=10)
+
+    # The whole vocabulary as shortlist gives the same hypotheses
+    out = Model.beam_search(inputs, [f_init], [f_next_vocab], beam_size=4, maxlen=10,
+                            shortlist=np.arange(V))
+    assert [list(h) for h in out[0]] == [list(h) for h in ref[0]]
+    assert np.allclose(out[1], ref[1])
+
+    # Hypotheses only consist of shortlist words
+    shortlist = np.array([0, 1, 3, 7, 12, 20, 29])
+    out = Model.beam_search(inputs, [f_init], [f_next_vocab], beam_size=4, maxlen=10,
+                            shortlist=shortlist)
+    assert all(w in shortlist for h in out[0] for w in h)
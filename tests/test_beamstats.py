@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+import csv
+
+from nmtpy.beamstats import FIELDS, sentence_row, summarize, write_report
+
+
+def _stats(src_len, n_steps, maxlen_hit=False):
+    return {
+            'src_len'   : src_len,
+            'maxlen'    : 3 * src_len,
+            'init_time' : 0.002,
+            'next_times': [0.001] * n_steps,
+            'step_times': [0.0005] * n_steps,
+            'live_beams': list(range(n_steps, 0, -1)),
+            'maxlen_hit': maxlen_hit,
+           }
+
+
+def test_sentence_row():
+    row = sentence_row(3, _stats(5, 4))
+    assert list(row) == FIELDS
+    assert row['idx'] == 3 and row['n_steps'] == 4 and row['maxlen'] == 15
+    assert row['init_ms'] == '2.000'
+    assert row['next_ms'] == '4.000' and row['next_ms_per_step'] == '1.000'
+    assert row['overhead_ms_per_step'] == '0.500'
+    assert row['mean_live_beam'] == '2.50'
+
+
+def test_summarize():
+    lines = summarize([_stats(5, 4), None, _stats(12, 10, maxlen_hit=True)])
+    assert lines[0] == 'Sentences: 2, decoding steps: 14'
+    assert lines[1].startswith('f_init ') and 'mean    2.000 ms' in lines[1]
+    assert any(l.startswith('Mean live beam (sentences) at step 1: 7.00 (2), 2: 6.00 (2)') for l in lines)
+    assert any('source length   0-9  :     1 sentences' in l for l in lines)
+    assert lines[-1] == 'maxlen hits: 1 (50.00%)'
+    assert summarize([None]) == ['No beam search statistics were collected.']
+
+
+def test_write_report(tmpdir):
+    prefix = str(tmpdir.join('hyps.beamstats'))
+    lines = write_report(prefix, [_stats(5, 4), None, _stats(7, 6)])
+
+    with open(prefix + '.txt') as f:
+        assert f.read().splitlines() == lines
+    with open(prefix + '.csv') as f:
+        rows = list(csv.DictReader(f))
+    # Sentences without statistics are skipped but keep their idx
+    assert [r['idx'] for r in rows] == ['0', '2']
+    assert rows[1]['n_steps'] == '6'
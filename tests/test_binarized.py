@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+import os
+
+import numpy as np
+
+from nmtpy.nmtutils import sent_to_idx
+from nmtpy.iterators.binarized import load_binarized, numericalize, numericalize_sents
+
+
+SRC = ['a b c', 'b b', '', 'c a x y']
+TRG = ['d e', 'e', 'd', 'f f f']
+SRC_VOCAB = {'<eos>': 0, '<unk>': 1, 'a': 2, 'b': 3, 'c': 4}
+TRG_VOCAB = {'<eos>': 0, '<unk>': 1, 'd': 2, 'e': 3, 'f': 4}
+
+
+def _write(tmpdir, name, lines):
+    fname = str(tmpdir.join(name))
+    with open(fname, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+    return fname
+
+
+def _files(tmpdir):
+    return [_write(tmpdir, 'train.src', SRC), _write(tmpdir, 'train.trg', TRG)]
+
+
+def test_numericalize_skips_empty_and_limits_vocab(tmpdir):
+    files = _files(tmpdir)
+    tokens, offsets, n_unks = numericalize(files, [SRC_VOCAB, TRG_VOCAB], [4, 0])
+    # 3rd sample has an empty source and is skipped, 'c' is out of the short-list
+    assert tokens[0].tolist() == [2, 3, 1, 3, 3, 1, 2, 1, 1]
+    assert offsets[0].tolist() == [0, 3, 5, 9]
+    assert tokens[1].tolist() == [2, 3, 3, 4, 4, 4]
+    assert n_unks == [4, 0]
+
+
+def test_numericalize_parallel_equals_serial(tmpdir):
+    files = _files(tmpdir)
+    vocabs = [SRC_VOCAB, TRG_VOCAB]
+    serial = numericalize(files, vocabs, [0, 0])
+    parallel = numericalize(files, vocabs, [0, 0], n_jobs=2, chunk_size=1)
+    for a, b in zip(serial[0] + serial[1], parallel[0] + parallel[1]):
+        assert np.array_equal(a, b)
+    assert serial[2] == parallel[2]
+
+
+def test_numericalize_sents_equals_sent_to_idx():
+    sents = [line.split() for line in SRC if line] * 7
+    tokens, offsets, n_unks = numericalize_sents(sents, SRC_VOCAB, 4, n_jobs=2, chunk_size=3)
+    for i, sent in enumerate(sents):
+        assert tokens[offsets[i]:offsets[i + 1]].tolist() == sent_to_idx(SRC_VOCAB, sent, 4)
+    assert n_unks == 7 * 4
+
+
+def test_load_binarized_reuses_cache(tmpdir):
+    files = _files(tmpdir)
+    cache_dir = str(tmpdir.join('cache'))
+    vocabs = [SRC_VOCAB, TRG_VOCAB]
+    msgs = []
+
+    corpus = load_binarized(cache_dir, files, vocabs, [0, 0], print_func=msgs.append)
+    assert len(corpus) == 3
+    assert corpus[2][0].tolist() == [4, 2, 1, 1]
+    assert corpus[2][1].tolist() == [4, 4, 4]
+    assert corpus.streams[1].lengths().tolist() == [2, 1, 3]
+    assert corpus.n_unks == [2, 0]
+
+    again = load_binarized(cache_dir, files, vocabs, [0, 0], print_func=msgs.append)
+    assert again.prefix == corpus.prefix
+    assert msgs[0].startswith('Binarizing') and msgs[1].startswith('Using')
+
+
+def test_load_binarized_rebuilds_on_change(tmpdir):
+    files = _files(tmpdir)
+    cache_dir = str(tmpdir.join('cache'))
+    vocabs = [SRC_VOCAB, TRG_VOCAB]
+
+    first = load_binarized(cache_dir, files, vocabs, [0, 0])
+    limited = load_binarized(cache_dir, files, vocabs, [4, 0])
+    assert limited.prefix != first.prefix
+
+    _write(tmpdir, 'train.trg', ['d', 'd', 'd', 'd'])
+    edited = load_binarized(cache_dir, files, vocabs, [0, 0])
+    assert edited.prefix != first.prefix
+    assert edited[0][1].tolist() == [2]
+    assert os.path.exists(first.prefix + '.json')
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+from nmtpy.iterators.bitext import BiTextIterator
+
+
+VOCAB = {'<eos>': 0, '<unk>': 1, 'a': 2, 'b': 3, 'c': 4}
+
+
+def _files(tmpdir, n_lines=100):
+    src = str(tmpdir.join('train.src'))
+    trg = str(tmpdir.join('train.trg'))
+    with open(src, 'w') as f:
+        for i in range(n_lines):
+            f.write(' '.join(['a', 'c', 'z'][:1 + i % 3] * (1 + i % 4)) + '\n')
+    with open(trg, 'w') as f:
+        for i in range(n_lines):
+            # Every 10th sample has an empty target and is skipped
+            f.write(('' if i % 10 == 0 else ' '.join(['b', 'q'] * (1 + i % 5))) + '\n')
+    return src, trg
+
+
+def _read(src, trg, **kwargs):
+    it = BiTextIterator(batch_size=4, srcfile=src, trgfile=trg,
+                        srcdict=VOCAB, trgdict=VOCAB, n_words_src=4, **kwargs)
+    it.read()
+    return it
+
+
+def test_parallel_numericalization_equals_text(tmpdir):
+    src, trg = _files(tmpdir)
+    text = _read(src, trg)
+    par = _read(src, trg, n_jobs=3)
+    assert len(par) == len(text) == 90
+    assert (par.n_unks_src, par.n_unks_trg) == (text.n_unks_src, text.n_unks_trg)
+    for (s1, t1), (s2, t2) in zip(text._seqs, par._seqs):
+        assert list(s1) == s2.tolist()
+        assert list(t1) == t2.tolist()
+
+    for b1, b2 in zip(text, par):
+        for key in b1:
+            assert (b1[key] == b2[key]).all()
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+import os
+import glob
+import pickle
+
+import numpy as np
+
+from nmtpy.iterators.columnar import write_columnar, ColumnarCorpus, ColumnarSamples
+from nmtpy.iterators.fusion import FusionIterator
+from nmtpy.iterators.wmt import WMTIterator
+
+
+SRC_VOCAB = {'<eos>': 0, '<unk>': 1, 'a': 2, 'man': 3, 'dog': 4, 'runs': 5}
+TRG_VOCAB = {'<eos>': 0, '<unk>': 1, 'ein': 2, 'mann': 3, 'hund': 4, 'rennt': 5}
+
+SRC = [['a', 'man', 'runs'], ['a', 'dog'], ['a', 'big', 'dog', 'runs']]
+TRG = [['ein', 'mann', 'rennt'], ['ein', 'hund'], ['ein', 'großer', 'hund']]
+
+
+def _rows():
+    rows = []
+    for img in range(3):
+        for s in range(2):
+            for t in range(2):
+                rows.append([s, t, img, '%d.jpg' % img,
+                             SRC[(img + s) % 3], TRG[(img + t) % 3]])
+    return rows
+
+
+def _write(tmpdir, rows):
+    pklfile = str(tmpdir.join('train.pkl'))
+    with open(pklfile, 'wb') as f:
+        pickle.dump(rows, f)
+    prefix = str(tmpdir.join('train'))
+    write_columnar(prefix, rows)
+    return pklfile, prefix + '.json'
+
+
+def test_columnar_roundtrip(tmpdir):
+    rows = _rows()
+    _, jsonfile = _write(tmpdir, rows)
+    corpus = ColumnarCorpus(jsonfile)
+    assert corpus.n_samples == len(rows) and corpus.has_src and corpus.has_trg
+    assert corpus.imgnames == ['0.jpg', '1.jpg', '2.jpg']
+
+    samples = ColumnarSamples(corpus,
+                              corpus.sentences('src', SRC_VOCAB),
+                              corpus.sentences('trg', TRG_VOCAB, limit=5))
+    for row, sample in zip(rows, samples):
+        assert tuple(sample[:4]) == tuple(row[:4])
+        assert sample[4].tolist() == [SRC_VOCAB.get(w, 1) for w in row[4]]
+        trg = [TRG_VOCAB.get(w, 1) for w in row[5]]
+        assert sample[5].tolist() == [w if w < 5 else 1 for w in trg]
+    assert samples.lengths(0).tolist() == [len(r[4]) for r in rows]
+    assert samples.n_unks(0).tolist() == [r[4].count('big') for r in rows]
+
+
+def test_columnar_equals_pkl(tmpdir):
+    pklfile, jsonfile = _write(tmpdir, _rows())
+
+    def read(cls, fname, **kwargs):
+        it = cls(batch_size=1, pklfile=fname, srcdict=SRC_VOCAB, trgdict=TRG_VOCAB, **kwargs)
+        it.read()
+        return [[v.tolist() for v in batch.values()] for batch in it], it
+
+    for cls, kwargs in [(FusionIterator, {}), (WMTIterator, {'mode': 'all'})]:
+        pkl, pkl_it = read(cls, pklfile, **kwargs)
+        col, col_it = read(cls, jsonfile, **kwargs)
+        assert pkl == col
+        assert (pkl_it.unk_src, pkl_it.total_trg_words) == (col_it.unk_src, col_it.total_trg_words)
+
+
+def test_columnar_rewrite_drops_mapped_tokens(tmpdir):
+    rows = _rows()
+    _, jsonfile = _write(tmpdir, rows)
+    prefix = jsonfile[:-len('.json')]
+    ColumnarCorpus(jsonfile).sentences('src', SRC_VOCAB)
+    assert len(glob.glob(prefix + '.src.*.tok.npy')) == 1
+
+    # Rewrite the corpus at the same prefix with other sentences
+    for row in rows:
+        row[4] = ['dog'] + row[4]
+    write_columnar(prefix, rows)
+    assert glob.glob(prefix + '.src.*.tok.npy') == []
+
+    corpus = ColumnarCorpus(jsonfile)
+    samples = ColumnarSamples(corpus, corpus.sentences('src', SRC_VOCAB))
+    for row, sample in zip(rows, samples):
+        assert sample[4].tolist() == [SRC_VOCAB.get(w, 1) for w in row[4]]
+
+
+def test_columnar_mapped_tokens_follow_corpus(tmpdir):
+    _, jsonfile = _write(tmpdir, _rows())
+    prefix = jsonfile[:-len('.json')]
+    ColumnarCorpus(jsonfile).sentences('src', SRC_VOCAB)
+    cached = glob.glob(prefix + '.src.*.tok.npy')
+
+    # A corpus replaced without write_columnar() gets new mapped tokens
+    tokfile = prefix + '.src.tok.npy'
+    tokens = np.load(tokfile)
+    np.save(tokfile, tokens[::-1].copy())
+    st = os.stat(tokfile)
+    os.utime(tokfile, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+
+    new, _, _ = ColumnarCorpus(jsonfile).sentences('src', SRC_VOCAB)
+    assert glob.glob(prefix + '.src.*.tok.npy') != cached
+    words = ColumnarCorpus(jsonfile).meta['src_words']
+    assert new.tolist() == [SRC_VOCAB.get(words[i], 1) for i in tokens[::-1]]
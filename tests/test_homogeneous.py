@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+
+from nmtpy.iterators.homogeneous import BucketedData, HomogeneousData
+
+
+def _corpus(n, seed=0):
+    rng = np.random.RandomState(seed)
+    return [(list(range(rng.randint(1, 30))),) for _ in range(n)]
+
+
+def test_bucketed_covers_corpus_with_bounded_padding():
+    data = _corpus(500)
+    it = BucketedData(data, 16, trg_pos=0, n_batches=10, max_pad_ratio=0.1)
+    seen = []
+    for idxs in it:
+        lens = it.lengths[idxs]
+        assert len(idxs) <= 16
+        if len(idxs) > 1:
+            assert 1. - lens.sum() / float(lens.max() * len(idxs)) <= 0.1
+        seen.extend(idxs)
+    assert sorted(seen) == list(range(len(data)))
+
+
+def test_bucketed_options():
+    data = _corpus(200)
+    loose = BucketedData(data, 16, trg_pos=0, n_batches=1, max_pad_ratio=1.)
+    strict = BucketedData(data, 16, trg_pos=0, n_batches=1, max_pad_ratio=0.)
+    assert all(len(b) == 16 for b in loose.batches[:-1])
+    for b in strict.batches:
+        assert len(set(strict.lengths[b])) == 1
+
+
+def test_bucketed_state_roundtrip():
+    data = _corpus(300)
+    it = BucketedData(data, 8, trg_pos=0)
+    for _ in range(5):
+        next(it)
+    state = it.get_state()
+    rest = [b.tolist() for b in it]
+
+    other = BucketedData(data, 8, trg_pos=0)
+    other.set_state(state)
+    assert [b.tolist() for b in other] == rest
+
+
+def test_bucketed_empty_corpus():
+    it = BucketedData([], 8, trg_pos=0, print_func=lambda msg: None)
+    assert it.stats()['n_batches'] == 0
+    state = it.get_state()
+    it.set_state(state)
+    assert it.batches == []
+    assert list(it) == []
+
+
+def test_homogeneous_empty_corpus(tmpdir):
+    index = str(tmpdir.join('index.npz'))
+    it = HomogeneousData([], 32, trg_pos=0, index_file=index)
+    assert len(it.len_starts) == len(it.len_unique) == 0
+    assert list(it) == [] and list(it) == []
+    it.set_state(it.get_state())
+    assert list(it) == []
+
+    # The saved empty index is reused
+    assert list(HomogeneousData([], 32, trg_pos=0, index_file=index)) == []
+
+
+def test_homogeneous_batches_have_equal_lengths():
+    data = _corpus(300)
+    it = HomogeneousData(data, 8, trg_pos=0)
+    seen = []
+    for idxs in it:
+        assert len(set(len(data[i][0]) for i in idxs)) == 1
+        seen.extend(idxs)
+    assert sorted(seen) == list(range(len(data)))
+
+
+def test_homogeneous_index_reuse(tmpdir):
+    fname = str(tmpdir.join('corpus.lenidx.npz'))
+    data = _corpus(100)
+    first = HomogeneousData(data, 8, trg_pos=0, index_file=fname)
+    index = np.load(fname)
+    assert np.array_equal(index['lengths'], first.lengths)
+
+    # Same corpus: the persisted index is reused
+    other = HomogeneousData(data, 8, trg_pos=0, index_file=fname)
+    assert np.array_equal(np.sort(other.idxs), np.arange(len(data)))
+    assert np.array_equal(other.len_counts, first.len_counts)
+
+
+def test_homogeneous_index_rejects_edited_corpus(tmpdir):
+    fname = str(tmpdir.join('corpus.lenidx.npz'))
+    data = _corpus(100)
+    HomogeneousData(data, 8, trg_pos=0, index_file=fname)
+
+    # Same number of samples but a sentence changed in place
+    data[0] = (data[0][0] + [1, 2, 3],)
+    it = HomogeneousData(data, 8, trg_pos=0, index_file=fname)
+    assert it.lengths[0] == len(data[0][0])
+    assert np.array_equal(np.load(fname)['lengths'], it.lengths)
+    for idxs in it:
+        assert len(set(len(data[i][0]) for i in idxs)) == 1
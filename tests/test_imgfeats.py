@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+
+from nmtpy.iterators.imgfeats import ImageFeatures, convert_features, validate_features
+
+
+def _feats(tmpdir, shape=(20, 6, 4), seed=0):
+    fname = str(tmpdir.join('feats.npy'))
+    feats = np.random.RandomState(seed).uniform(-2, 3, size=shape).astype('float32')
+    np.save(fname, feats)
+    return fname, feats
+
+
+def test_gather_is_memory_mapped(tmpdir):
+    fname, feats = _feats(tmpdir)
+    store = ImageFeatures(fname)
+    assert isinstance(store.feats, np.memmap)
+    assert len(store) == 20
+
+    idxs = [3, 0, 3, 19]
+    assert np.array_equal(store.gather(idxs), feats[idxs])
+    assert np.array_equal(store.gather(idxs, time_major=True), feats[idxs].swapaxes(0, 1))
+
+
+def test_gather_with_cache(tmpdir):
+    fname, feats = _feats(tmpdir)
+    store = ImageFeatures(fname, cache_size=4)
+    for idxs in ([1, 2, 3], [3, 4, 5, 1], [0, 1, 2, 3, 4, 5, 6]):
+        assert np.array_equal(store.gather(idxs), feats[idxs])
+        assert len(store.cache) <= 4
+    assert len(store.cache) == 4
+    for idx, row in store.cache.items():
+        assert np.array_equal(row, feats[idx])
+
+    # Cached rows are served without touching the features
+    store.feats = None
+    cached = list(store.cache)
+    assert np.array_equal(store.gather(cached[::-1]), feats[cached[::-1]])
+
+
+def test_convert_float16(tmpdir):
+    fname, feats = _feats(tmpdir)
+    outfile = str(tmpdir.join('feats.fp16.npy'))
+    convert_features(fname, outfile, chunk_size=7)
+
+    store = ImageFeatures(outfile)
+    assert store.dtype == np.float16 and store.scale is None
+    out = store.gather(np.arange(20))
+    assert out.dtype == np.float32
+    assert np.allclose(out, feats, atol=1e-2)
+
+    stats = validate_features(fname, outfile)
+    assert stats['conv_bytes'] < stats['orig_bytes']
+    assert stats['max_abs_err'] < 1e-2
+
+
+def test_convert_quantized(tmpdir):
+    fname, feats = _feats(tmpdir)
+    # A constant channel should not break the quantization
+    feats[..., 2] = 1.5
+    np.save(fname, feats)
+    outfile = str(tmpdir.join('feats.q8.npy'))
+    convert_features(fname, outfile, quantize=True, chunk_size=7)
+
+    store = ImageFeatures(outfile)
+    assert store.dtype == np.uint8 and store.scale is not None
+    out = store.gather([4, 4, 0], time_major=True)
+    ref = feats[[4, 4, 0]].swapaxes(0, 1)
+    # Half of a quantization step of the largest channel range
+    assert np.abs(out - ref).max() <= 5. / 255 / 2 + 1e-5
+    assert np.allclose(out[..., 2], 1.5)
+
+    stats = validate_features(fname, outfile)
+    assert stats['conv_bytes'] < stats['orig_bytes'] / 3.
+
+    # Converting again to float16 drops the stale quantization parameters
+    convert_features(fname, outfile)
+    assert ImageFeatures(outfile).scale is None
+
+
+def test_gather_unique(tmpdir):
+    fname, feats = _feats(tmpdir)
+    store = ImageFeatures(fname, cache_size=2)
+    idxs = [7, 2, 7, 7, 2, 11]
+    uniq, pos = store.gather_unique(idxs)
+    assert uniq.shape == (3, 6, 4)
+    assert pos.dtype == np.int64
+    assert np.array_equal(uniq[pos], feats[idxs])
+
+    uniq, pos = store.gather_unique(idxs, time_major=True)
+    assert uniq.shape == (6, 3, 4)
+    assert np.array_equal(uniq[:, pos], store.gather(idxs, time_major=True))
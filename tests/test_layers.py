@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+from collections import OrderedDict
+
+import numpy as np
+import pytest
+
+theano = pytest.importorskip('theano')
+tensor = theano.tensor
+
+from nmtpy.layers import param_init_adaptive_softmax, adaptive_softmax_layer
+
+
+def _adaptive_softmax(nin, n_words, cutoffs):
+    """Returns the full log-probabilities and the target costs functions."""
+    np.random.seed(1234)
+    params = param_init_adaptive_softmax(OrderedDict(), nin, n_words, cutoffs, div=2, scale=1.)
+    tparams = OrderedDict((k, theano.shared(v, name=k)) for k, v in params.items())
+
+    x = tensor.matrix('x', dtype='float32')
+    y = tensor.vector('y', dtype='int64')
+    f_probs = theano.function([x], adaptive_softmax_layer(tparams, x, n_words, cutoffs))
+    f_cost = theano.function([x, y], adaptive_softmax_layer(tparams, x, n_words, cutoffs, targets=y))
+    return f_probs, f_cost
+
+
+def test_adaptive_softmax_normalized():
+    f_probs, _ = _adaptive_softmax(nin=8, n_words=20, cutoffs=[4, 10])
+    x = np.random.RandomState(0).randn(6, 8).astype('float32')
+
+    log_probs = f_probs(x)
+    assert log_probs.shape == (6, 20)
+    assert np.allclose(np.exp(log_probs).sum(1), 1., atol=1e-5)
+
+
+def test_adaptive_softmax_targets_cost():
+    # Targets from the head and from both tail clusters
+    f_probs, f_cost = _adaptive_softmax(nin=8, n_words=20, cutoffs=[4, 10])
+    x = np.random.RandomState(0).randn(6, 8).astype('float32')
+    y = np.array([0, 3, 4, 9, 10, 19], dtype='int64')
+
+    log_probs = f_probs(x)
+    assert np.allclose(f_cost(x, y), -log_probs[np.arange(6), y], atol=1e-5)
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+import multiprocessing as mp
+
+import numpy as np
+
+from nmtpy.parallel import SharedAllReduce, TrainingStopped, trng_offset
+
+
+def _arrays(rank):
+    return [np.full((2, 3), rank + 1, dtype='float32'), np.arange(4, dtype='float32') * (rank + 1)]
+
+
+def _worker(comm, rank, queue):
+    comm.attach(rank)
+    arrays = _arrays(rank)
+    lrate = comm.all_reduce(arrays)
+    queue.put((rank, lrate, [a.tolist() for a in arrays]))
+    try:
+        comm.all_reduce(arrays)
+    except TrainingStopped:
+        queue.put((rank, 'stopped', None))
+
+
+def test_shared_all_reduce():
+    n_workers = 3
+    comm = SharedAllReduce(n_workers, 10)
+    ctx = mp.get_context('fork')
+    queue = ctx.Queue()
+    procs = [ctx.Process(target=_worker, args=(comm, rank, queue)) for rank in range(1, n_workers)]
+    for proc in procs:
+        proc.start()
+
+    comm.attach(0)
+    arrays = _arrays(0)
+    assert comm.all_reduce(arrays, lrate=0.5) == 0.5
+    expected = [sum(a) for a in zip(*[_arrays(r) for r in range(n_workers)])]
+    for arr, ref in zip(arrays, expected):
+        assert np.array_equal(arr, ref)
+
+    results = sorted(queue.get(timeout=10) for _ in range(1, n_workers))
+    for rank, lrate, values in results:
+        # Every worker gets the sums and the learning rate of rank 0
+        assert lrate == 0.5
+        assert values == [a.tolist() for a in expected]
+
+    # Rank 0 stops the workers waiting for the next reduction
+    comm.stop()
+    assert sorted(queue.get(timeout=10)[1] for _ in range(1, n_workers)) == ['stopped'] * 2
+    for proc in procs:
+        proc.join(10)
+        assert proc.exitcode == 0
+
+
+def test_trng_offset():
+    # Rank 0 of node 0 keeps its RNG states, fresh or resumed
+    assert trng_offset(0, 4) == trng_offset(0, 4, uctr=100) == 0
+
+    # Every worker and node gets its own seed, which changes when resuming
+    offsets = [trng_offset(rank, 4, uctr=uctr) for rank in range(1, 4) for uctr in (0, 1, 7)]
+    offsets += [trng_offset(0, 1, rank, 3, uctr=uctr) for rank in range(1, 3) for uctr in (0, 1, 7)]
+    assert 0 not in offsets
+    assert len(set(offsets[:9])) == 9 and len(set(offsets[9:])) == 6
+    assert trng_offset(2, 4) == 2 and trng_offset(0, 1, 2, 3) == 2
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+import time
+
+import pytest
+
+from nmtpy.profiling import CallTimer, Profiler
+
+
+def _func(x, y=1):
+    time.sleep(0.005)
+    return x + y
+
+_func.profile = 'theano profile'
+
+
+def test_call_timer():
+    timer = CallTimer(_func, 'f_next')
+    assert timer(1) == 2
+    assert timer(1, y=3) == 4
+    assert timer.n_calls == 2
+    assert timer.max >= 0.005 and timer.total >= 2 * 0.005
+    # Attributes of the wrapped function are exposed
+    assert timer.profile == 'theano profile'
+
+
+def test_profiler_wraps_and_writes(tmpdir):
+    pytest.importorskip('theano')
+
+    class Model(object):
+        f_init = staticmethod(_func)
+        f_next = staticmethod(_func)
+
+    prefix = str(tmpdir.join('model.profile'))
+    profiler = Profiler(prefix, at_exit=False)
+    models = [Model(), Model()]
+    for model in models:
+        profiler.wrap(model, ['f_init', 'f_next', 'f_missing'])
+    # Functions of ensembles get distinct names and are not wrapped twice
+    profiler.wrap(models[0], ['f_init'])
+    assert list(profiler.timers) == ['f_init', 'f_next', 'f_init.2', 'f_next.2']
+
+    models[0].f_next(1)
+    models[1].f_next(1)
+    models[1].f_next(2)
+    profiler.write()
+    with open(prefix + '.calls.txt') as f:
+        lines = f.read().splitlines()
+    assert lines[0].split()[:3] == ['function', 'calls', 'total']
+    assert lines[1].split()[:2] == ['f_next.2', '2']
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from nmtpy.schedulers import get_scheduler, InverseSqrt, StepDecay, ReduceOnPlateau
+
+
+def test_get_scheduler():
+    assert get_scheduler('noam') is InverseSqrt
+    assert get_scheduler('step') is StepDecay
+    assert get_scheduler('plateau') is ReduceOnPlateau
+
+
+def test_inverse_sqrt():
+    sched = InverseSqrt(1e-3, warmup=100, min_lr=1e-5)
+    assert sched.get_lrate(0) == pytest.approx(1e-5)
+    assert sched.get_lrate(49) == pytest.approx(5e-4)
+    assert sched.get_lrate(99) == pytest.approx(1e-3)
+    assert sched.get_lrate(399) == pytest.approx(5e-4)
+    assert sched.get_lrate(10**9) == 1e-5
+
+
+def test_step_decay():
+    sched = StepDecay(1., factor=0.5, decay_freq=10, min_lr=0.2)
+    assert [sched.get_lrate(u) for u in (0, 9, 10, 25, 1000)] == [1., 1., 0.5, 0.25, 0.2]
+
+
+def test_reduce_on_plateau():
+    sched = ReduceOnPlateau(1., factor=0.5, patience=2, min_lr=0.3)
+    history = []
+    decays = []
+    for bleu in [10, 12, 11, 11.5, 13, 12, 12, 12, 12]:
+        history.append(bleu)
+        decays.append(sched.on_validation('bleu', history))
+    assert decays == [False, False, False, True, False, False, True, False, False]
+    # Decayed twice, the second time down to min_lr
+    assert sched.get_lrate(0) == 0.3
+
+    # Lower is better for the loss
+    sched = ReduceOnPlateau(1., patience=1)
+    assert not sched.on_validation('loss', [3.])
+    assert not sched.on_validation('loss', [3., 2.])
+    assert sched.on_validation('loss', [3., 2., 2.5])
+    assert sched.get_lrate(0) == 0.5
+
+
+def test_scheduler_state():
+    sched = ReduceOnPlateau(1., patience=1)
+    sched.on_validation('bleu', [1.])
+    sched.on_validation('bleu', [1., 0.])
+    state = sched.get_state()
+
+    other = ReduceOnPlateau(1., patience=1)
+    other.set_state(state)
+    assert other.get_lrate(0) == sched.get_lrate(0) == 0.5
+    assert StepDecay(1.).get_state() == {}
+
+
+def test_follow_rank0_lrate():
+    # Workers that do not validate take the decays of rank 0
+    sched = ReduceOnPlateau(1., patience=1)
+    sched.follow(0.25)
+    assert sched.get_lrate(100) == 0.25
+
+    # Update-driven schedules are computed locally
+    sched = StepDecay(1., decay_freq=10)
+    sched.follow(0.25)
+    assert sched.get_lrate(10) == 0.5
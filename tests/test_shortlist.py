@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+import gzip
+
+import numpy as np
+
+from nmtpy.shortlist import build_table, write_table, Shortlist
+
+
+SRC = ['das haus', 'das auto', 'ein haus', 'ein auto', 'das haus ist rot', 'rot']
+TRG = ['the house', 'the car', 'a house', 'a car', 'the house is red', 'red']
+
+
+def _files(tmpdir, ext=''):
+    src = str(tmpdir.join('train.de' + ext))
+    trg = str(tmpdir.join('train.en' + ext))
+    open_ = gzip.open if ext == '.gz' else open
+    for fname, lines in [(src, SRC), (trg, TRG)]:
+        with open_(fname, 'wt') as f:
+            f.write('\n'.join(lines) + '\n')
+    return src, trg
+
+
+def test_build_table(tmpdir):
+    table = build_table(*_files(tmpdir), n_cands=2, min_count=2)
+    assert table['haus'] == ['house', 'the']
+    assert table['auto'] == ['car']
+    assert table['rot'] == ['red']
+    # Words occurring less than min_count times have no candidates
+    assert 'ist' not in table
+
+
+def test_build_table_gz(tmpdir):
+    assert build_table(*_files(tmpdir, '.gz')) == build_table(*_files(tmpdir))
+
+
+def test_build_table_n_words_trg(tmpdir):
+    # Only 'the', 'house', 'a', 'car' are counted, not 'red'
+    table = build_table(*_files(tmpdir), n_words_trg=4)
+    assert table['haus'] == ['house', 'the']
+    assert 'rot' not in table
+    assert all(t in ('the', 'house', 'a', 'car') for ts in table.values() for t in ts)
+
+
+def test_build_table_pruning(tmpdir):
+    # Large enough candidate lists are not affected by pruning
+    src, trg = _files(tmpdir)
+    assert build_table(src, trg, prune_every=1) == build_table(src, trg, prune_every=0)
+
+    # Pruning after each sentence keeps a single candidate per source word
+    table = build_table(src, trg, n_cands=1, min_count=1, prune_every=1)
+    assert all(len(ts) == 1 for ts in table.values())
+
+
+def test_shortlist(tmpdir):
+    fname = str(tmpdir.join('shortlist.pkl.gz'))
+    write_table(fname, {'haus': ['house', 'home'], 'rot': ['red'], 'xyz': ['abc']})
+
+    src_dict = {'<eos>': 0, '<unk>': 1, 'haus': 2, 'rot': 3}
+    trg_dict = {'<eos>': 0, '<unk>': 1, 'the': 2, 'house': 3, 'red': 4, 'home': 5}
+    shortlist = Shortlist(fname, src_dict, trg_dict, n_words_trg=5, top_k=3)
+
+    # 'home' is out of the target vocabulary and 'xyz' out of the source one
+    assert list(shortlist.top_k) == [0, 1, 2]
+    assert sorted(shortlist.cands) == [2, 3]
+    assert list(shortlist.get(np.array([[2], [0]]))) == [0, 1, 2, 3]
+    assert list(shortlist.get(np.array([[2], [3], [1]]))) == [0, 1, 2, 3, 4]
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+import os
+import random
+from collections import OrderedDict
+
+import numpy as np
+import pytest
+
+from nmtpy.snapshot import save_snapshot, load_snapshot, CheckpointWriter
+from nmtpy.iterators.bitext import BiTextIterator
+
+
+VOCAB = {'<eos>': 0, '<unk>': 1, 'a': 2, 'b': 3}
+
+
+def _iterator(tmpdir, shuffle_mode):
+    src = str(tmpdir.join('train.src'))
+    with open(src, 'w') as f:
+        for i in range(50):
+            f.write(' '.join(['a', 'b'] * (1 + i % 6)) + '\n')
+    it = BiTextIterator(batch_size=4, srcfile=src, trgfile=src, srcdict=VOCAB,
+                        trgdict=VOCAB, shuffle_mode=shuffle_mode)
+    it.read()
+    return it
+
+
+def test_snapshot_roundtrip(tmpdir):
+    fname = str(tmpdir.join('model.snapshot.npz'))
+    opts = {'model_type': 'attention', 'dim': 8}
+    state = {'uctr': 12, 'valid_metrics': OrderedDict([('bleu', [1., 2.])]),
+             'np_rng': np.random.get_state(), 'py_rng': random.getstate()}
+    params = OrderedDict([('W', np.arange(6, dtype='float32').reshape(2, 3)),
+                          ('b', np.ones(3, dtype='float32'))])
+    history = OrderedDict([('W_m', np.zeros((2, 3), dtype='float32'))])
+    trng_state = [np.arange(6, dtype='int32').reshape(1, 6)] * 2
+
+    save_snapshot(fname, opts, state, params, history, trng_state)
+    assert not os.path.exists(fname + '.tmp')
+
+    snap = load_snapshot(fname)
+    assert snap['opts'] == opts
+    assert snap['state']['uctr'] == 12
+    assert snap['state']['valid_metrics']['bleu'] == [1., 2.]
+    assert list(snap['params']) == ['W', 'b']
+    assert np.array_equal(snap['params']['W'], params['W'])
+    assert np.array_equal(snap['history']['W_m'], history['W_m'])
+    assert len(snap['trng_state']) == 2
+    # Streaming iterators do not have a state
+    assert snap['iter_state'] is None
+
+
+def test_snapshot_resumes_iterator(tmpdir):
+    fname = str(tmpdir.join('model.snapshot.npz'))
+    for shuffle_mode in ('trglen', 'bucket', 'simple', None):
+        it = _iterator(tmpdir, shuffle_mode)
+        for _ in range(3):
+            next(it)
+        save_snapshot(fname, {}, {}, {}, {}, [], it.get_state())
+        rest = [b['y'].tolist() for b in it]
+
+        other = _iterator(tmpdir, shuffle_mode)
+        other.set_state(load_snapshot(fname)['iter_state'])
+        assert [b['y'].tolist() for b in other] == rest, shuffle_mode
+
+
+def test_checkpoint_writer_stages_arrays(tmpdir):
+    writer = CheckpointWriter()
+    fname = str(tmpdir.join('model.npz'))
+    params = {'W': np.zeros((3, 3), dtype='float32')}
+    done = []
+
+    writer.write(fname, params, callback=lambda: done.append(fname))
+    # Training goes on modifying the parameters in place
+    params['W'] += 1
+    writer.wait()
+    assert done == [fname]
+    assert np.array_equal(np.load(fname)['W'], np.zeros((3, 3)))
+
+    # Staging buffers are reused by the writes of the same kind
+    buf = writer.buffers['model']['W']
+    writer.write(fname, params)
+    writer.close()
+    assert writer.buffers['model']['W'] is buf
+    assert np.array_equal(np.load(fname)['W'], np.ones((3, 3)))
+    assert not os.path.exists(fname + '.tmp')
+
+
+def test_checkpoint_writer_reraises_errors(tmpdir):
+    writer = CheckpointWriter()
+    fname = str(tmpdir.join('missing', 'model.npz'))
+    writer.write(fname, {'W': np.zeros(2)}, kind='snapshot')
+    with pytest.raises(IOError):
+        writer.wait('snapshot')
+
+    # The writer keeps working after an error
+    fname = str(tmpdir.join('model.npz'))
+    writer.write(fname, {'W': np.zeros(2)}, kind='snapshot')
+    writer.close()
+    assert os.path.exists(fname)
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+import os
+import csv
+import sys
+import subprocess
+
+import numpy as np
+
+from nmtpy.defaults import TRAIN_DEFAULTS
+from nmtpy.statsink import StatsWriter, read_stats
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _train(prefix, sinks, bleus):
+    writer = StatsWriter(prefix, sinks, flush_secs=0.05)
+    for step in range(1, 4):
+        writer.add('update', step, loss=np.float32(1. / step), lrate=1e-3)
+    for vctr, bleu in enumerate(bleus, 1):
+        writer.add('valid', vctr, update=vctr * 3, bleu=np.float64(bleu))
+    writer.close()
+
+
+def test_stats_sink_is_opt_in():
+    assert TRAIN_DEFAULTS['stats_sink'] is None
+
+
+def test_stats_writer(tmpdir):
+    prefix = str(tmpdir.join('model'))
+    _train(prefix, ['jsonl', 'csv'], [20.5, 22.])
+
+    updates = read_stats(prefix + '.stats.jsonl', 'update')
+    assert [e['step'] for e in updates] == [1, 2, 3]
+    assert list(updates[0]) == ['time', 'kind', 'step', 'loss', 'lrate']
+    assert isinstance(updates[1]['loss'], float) and updates[1]['loss'] == 0.5
+    assert [e['bleu'] for e in read_stats(prefix + '.stats.jsonl', 'valid')] == [20.5, 22.]
+
+    with open(prefix + '.valid.csv') as f:
+        rows = list(csv.DictReader(f))
+    assert [r['bleu'] for r in rows] == ['20.5', '22.0']
+
+    # A resumed training appends with the existing columns
+    _train(prefix, ['jsonl', 'csv'], [23.])
+    assert len(read_stats(prefix + '.stats.jsonl')) == 9
+    with open(prefix + '.valid.csv') as f:
+        lines = f.read().splitlines()
+    assert len(lines) == 4 and lines[0].split(',') == ['time', 'kind', 'step', 'update', 'bleu']
+
+
+def test_nmt_stats(tmpdir):
+    run1 = str(tmpdir.join('run1'))
+    run2 = str(tmpdir.join('run2'))
+    _train(run1, ['jsonl'], [20., 22., 21.])
+    _train(run2, ['jsonl'], [25.])
+
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    out = subprocess.check_output([sys.executable, os.path.join(ROOT, 'bin', 'nmt-stats'),
+                                   run1 + '.stats.jsonl', run2 + '.stats.jsonl', '-y', 'bleu'],
+                                  env=env, universal_newlines=True)
+    lines = out.splitlines()
+    assert lines[0] == 'bleu (valid events)'
+    assert lines[2].split() == ['run1', '3', '21.0000', '20.0000', '22.0000']
+    assert lines[3].split() == ['run2', '1', '25.0000', '25.0000', '25.0000']
@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+import os
+import sys
+
+from nmtpy.sysutils import get_valid_evaluation
+
+
+FAKE_TRANSLATE = '''#!%s
+import sys
+args = sys.argv[1:]
+if '-T' in args:
+    with open(args[args.index('-T') + 1], 'w') as f:
+        f.write('1.5\\n')
+sys.stderr.write('Computed metrics in 1.500 seconds\\n')
+print({'BLEU': ('BLEU = 30.00', 30.0)})
+'''
+
+
+def _fake_translate(tmpdir):
+    fname = str(tmpdir.join('fake-translate'))
+    with open(fname, 'w') as f:
+        f.write(FAKE_TRANSLATE % sys.executable)
+    os.chmod(fname, 0o755)
+    return fname
+
+
+def test_valid_evaluation_scoring_time(tmpdir):
+    cmd = _fake_translate(tmpdir)
+
+    # Metrics are the unchanged dict printed by nmt-translate
+    timings = {}
+    results = get_valid_evaluation('model.npz', 12, 1, 'bleu', trans_cmd=cmd, timings=timings)
+    assert results == {'BLEU': ('BLEU = 30.00', 30.0)}
+    assert timings == {'scoring': 1.5}
+
+    # The scoring time is only asked for if timings are collected
+    assert get_valid_evaluation('model.npz', 12, 1, 'bleu', trans_cmd=cmd) == results
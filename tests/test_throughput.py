@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from nmtpy.throughput import Throughput
+
+
+def _batch(src_lens, trg_lens):
+    def mask(lens):
+        m = np.zeros((max(lens), len(lens)), dtype='float32')
+        for i, n in enumerate(lens):
+            m[:n, i] = 1
+        return m
+    return OrderedDict([('x', None), ('x_mask', mask(src_lens)),
+                        ('y', None), ('y_mask', mask(trg_lens))])
+
+
+def test_counts_tokens_and_padding():
+    tp = Throughput()
+    batches = [_batch([2, 4], [3, 1]), _batch([1, 1, 2], [2, 2, 2])]
+    for data in tp.timed(batches):
+        tp.add_batch(data)
+        with tp.timer('train'):
+            time.sleep(0.01)
+
+    assert tp.masks == OrderedDict([('src', 'x_mask'), ('trg', 'y_mask')])
+    stats = tp.epoch.summary()
+    assert tp.epoch.sents == 5
+    assert stats['src_pad_eff'] == 10. / 14
+    assert stats['trg_pad_eff'] == 10. / 12
+    assert stats['time_train'] >= 0.02
+    assert stats['time_data'] >= 0.
+    assert abs(sum(stats['time_%s' % p] for p in ['data', 'train', 'other']) - stats['elapsed']) < 0.01
+
+    lines = Throughput.format(stats)
+    assert lines[0].startswith('Speed: ') and '83.3% non-pad' in lines[0]
+    assert 'train' in lines[1]
+
+    # A new interval does not reset the epoch
+    tp.new_interval()
+    assert tp.interval.sents == 0 and tp.epoch.sents == 5
+    tp.new_epoch()
+    assert tp.epoch.sents == 0
+
+
+def test_target_only_minibatches():
+    tp = Throughput()
+    tp.add_batch(OrderedDict([('y', None), ('y_mask', np.ones((3, 2)))]))
+    stats = tp.interval.summary()
+    assert 'src_tok_sec' not in stats and stats['trg_pad_eff'] == 1.
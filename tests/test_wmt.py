@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+import pickle
+from collections import Counter
+
+import numpy as np
+import pytest
+
+from nmtpy.iterators.wmt import WMTIterator
+
+
+N_IMAGES, N_SSPLITS, N_TSPLITS = 4, 2, 3
+
+
+def _vocab(side):
+    words = ['<eos>', '<unk>']
+    words += ['%s%d_%d' % (side, s, i) for s in range(3) for i in range(N_IMAGES)]
+    return {w: idx for idx, w in enumerate(words)}
+
+
+SRC_VOCAB = _vocab('s')
+TRG_VOCAB = _vocab('t')
+
+
+def _rows(skip=()):
+    """Task 2 style rows, one for each (src_split, trg_split) of an image,
+    ordered by splits then by image like the files of 02-prepare.py."""
+    rows = []
+    for s in range(N_SSPLITS):
+        for t in range(N_TSPLITS):
+            for img in range(N_IMAGES):
+                if (img, s, t) in skip:
+                    continue
+                # Sentence lengths depend on the split and the image
+                src = ['s%d_%d' % (s, img)] * (1 + (s + img) % 3)
+                trg = ['t%d_%d' % (t, img)] * (1 + (t + img) % 4)
+                rows.append([s, t, img, '%d.jpg' % img, src, trg])
+    return rows
+
+
+def _write_pkl(tmpdir, rows):
+    fname = str(tmpdir.join('train.pkl'))
+    with open(fname, 'wb') as f:
+        pickle.dump(rows, f)
+    return fname
+
+
+def _samples(pklfile, mode, shuffle_mode=None):
+    it = WMTIterator(batch_size=3, pklfile=pklfile, srcdict=SRC_VOCAB,
+                     trgdict=TRG_VOCAB, mode=mode, shuffle_mode=shuffle_mode)
+    it.read()
+    samples = []
+    for batch in it:
+        for i in range(batch['x'].shape[1]):
+            src = batch['x'][:, i][batch['x_mask'][:, i] > 0]
+            trg = batch['y'][:, i][batch['y_mask'][:, i] > 0]
+            samples.append((tuple(src[:-1]), tuple(trg[:-1])))
+    return it, samples
+
+
+def _expected(rows, keep):
+    """Returns the samples of the kept rows in file order."""
+    samples = []
+    for s, t, img, _, src, trg in rows:
+        if keep(s, t):
+            samples.append((tuple(SRC_VOCAB[w] for w in src), tuple(TRG_VOCAB[w] for w in trg)))
+    return samples
+
+
+def test_virtual_index_modes(tmpdir):
+    rows = _rows()
+    pklfile = _write_pkl(tmpdir, rows)
+
+    # Unshuffled samples follow the file order without explicit idxs
+    it, samples = _samples(pklfile, 'all')
+    assert it._vidxs is None and len(it) == N_IMAGES * N_SSPLITS * N_TSPLITS
+    assert samples == _expected(rows, lambda s, t: True)
+
+    it, samples = _samples(pklfile, 'pairs')
+    assert it._vidxs is None and len(it) == N_IMAGES * N_SSPLITS
+    assert samples == _expected(rows, lambda s, t: s == t)
+
+    it, samples = _samples(pklfile, 'single')
+    assert it._vidxs is None and len(it) == N_IMAGES
+    assert samples == _expected(rows, lambda s, t: s == t == 0)
+
+
+def test_virtual_index_keeps_row_order(tmpdir):
+    # Rows ordered by image first
+    rows = sorted(_rows(), key=lambda r: (r[2], r[0], r[1]))
+    pklfile = _write_pkl(tmpdir, rows)
+
+    it, samples = _samples(pklfile, 'all')
+    assert it._vidxs is not None
+    assert samples == _expected(rows, lambda s, t: True)
+
+    it, samples = _samples(pklfile, 'pairs')
+    assert samples == _expected(rows, lambda s, t: s == t)
+
+
+def test_duplicate_slots_are_rejected(tmpdir):
+    rows = _rows()
+    with pytest.raises(AssertionError):
+        _samples(_write_pkl(tmpdir, rows + rows[:1]), 'all')
+
+    # Another sentence for the source slot of a row
+    rows[1][4] = ['s0_0']
+    with pytest.raises(AssertionError):
+        _samples(_write_pkl(tmpdir, rows), 'all')
+
+
+def test_virtual_index_with_missing_combinations(tmpdir):
+    skip = [(0, 1, 2), (3, 0, 0)]
+    rows = _rows(skip)
+    pklfile = _write_pkl(tmpdir, rows)
+
+    it, samples = _samples(pklfile, 'all')
+    assert it._vidxs is not None and len(it) == len(rows)
+    assert samples == _expected(rows, lambda s, t: True)
+
+    it, samples = _samples(pklfile, 'all', shuffle_mode='trglen')
+    assert Counter(samples) == Counter(_expected(rows, lambda s, t: True))
+
+    img, src, trg = it.decode(np.arange(len(it)))
+    assert not set(skip) & set(zip(img.tolist(), src.tolist(), trg.tolist()))
+    assert it.total_trg_words == sum(len(r[5]) for r in rows)